@@ -1,29 +1,31 @@
 from decimal import Decimal
-import requests
 from hypothesis import given, settings, strategies as st
-from daml_pbt import make_request, make_auth, allocate_unique_party, ensure_ok
+from daml_pbt import make_request, allocate_unique_party, ContractHandle, CommandRejected, lookup_contract, parallel_given, StepGraph, package_id
 
-BASE = "http://localhost:7575/v1"
-PKG = "14914ff053f75db12473ef2a2fb4ed792aa577554493e67307126dfe1905af2b"
+PKG = package_id(__file__)
 AT_TID = f"{PKG}:AssetTransfer:AssetTransfer"
 
 alpha = st.text(alphabet="abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 -_", min_size=1, max_size=40)
 money = st.decimals(min_value="0.01", max_value="1000000.00", places=2)
 
 def fetch_payload(cid: str, act_as: str) -> dict:
-    r = requests.post(f"{BASE}/fetch",
-                      json={"templateId": AT_TID, "contractId": cid},
-                      headers=make_auth(act_as))
-    res = ensure_ok(r, "/fetch")
+    res = lookup_contract(cid, AT_TID, act_as=act_as)
     return res["payload"]
 
+def allocate_roles() -> list[str]:
+    # Seller, Buyer1, Buyer2, Inspector, Appraiser; independent, so allocated concurrently
+    g = StepGraph()
+    for role in ("Seller", "Buyer1", "Buyer2", "Inspector", "Appraiser"):
+        g.step(allocate_unique_party, role)
+    return g.run()
+
 def state_of(p: dict) -> str:
     s = p["state"]
     return s if isinstance(s, str) else str(s)
 
-def create_asset(owner: str, buyers: list[str], desc: str, asking: Decimal) -> str:
+def asset_payload(owner: str, buyers: list[str], desc: str, asking: Decimal) -> dict:
     # State after create: Active (no buyer/inspector/appraiser; no offerPrice)
-    payload = {
+    return {
         "owner": owner,
         "potentialBuyers": buyers,
         "buyer": None,
@@ -34,7 +36,9 @@ def create_asset(owner: str, buyers: list[str], desc: str, asking: Decimal) -> s
         "offerPrice": None,
         "state": "Active",
     }
-    res = make_request("create", act_as=owner, template_id=AT_TID, payload=payload)
+
+def create_asset(owner: str, buyers: list[str], desc: str, asking: Decimal) -> str:
+    res = make_request("create", act_as=owner, template_id=AT_TID, payload=asset_payload(owner, buyers, desc, asking))
     return res["contractId"]
 
 def make_offer(cid: str, buyer: str, inspector: str, appraiser: str, price: Decimal) -> str:
@@ -93,14 +97,10 @@ def accept_by_buyer(cid: str, buyer: str) -> str:
                        choice="AcceptByBuyer", argument={})
     return res["exerciseResult"]
 
-@given(desc=alpha, asking=money, offer=money)
-@settings(max_examples=12, deadline=None)
+# Examples are independent (fresh parties), so they run concurrently.
+@parallel_given(max_examples=12, workers=6, desc=alpha, asking=money, offer=money)
 def test_make_offer_sets_fields(desc, asking, offer):
-    owner = allocate_unique_party("Seller")
-    b1    = allocate_unique_party("Buyer1")
-    b2    = allocate_unique_party("Buyer2")
-    insp  = allocate_unique_party("Inspector")
-    appr  = allocate_unique_party("Appraiser")
+    owner, b1, b2, insp, appr = allocate_roles()
 
     cid = create_asset(owner, [b1, b2], desc, asking)  # Active
     cid = make_offer(cid, b1, insp, appr, offer)       # → OfferPlaced
@@ -116,11 +116,7 @@ def test_make_offer_sets_fields(desc, asking, offer):
 @given(desc=alpha, asking=money, offer=money)
 @settings(max_examples=12, deadline=None)
 def test_reject_resets_fields(desc, asking, offer):
-    owner = allocate_unique_party("Seller")
-    b1    = allocate_unique_party("Buyer1")
-    b2    = allocate_unique_party("Buyer2")
-    insp  = allocate_unique_party("Inspector")
-    appr  = allocate_unique_party("Appraiser")
+    owner, b1, b2, insp, appr = allocate_roles()
 
     cid = create_asset(owner, [b1, b2], desc, asking)  # Active
     cid = make_offer(cid, b1, insp, appr, offer)       # → OfferPlaced
@@ -136,11 +132,7 @@ def test_reject_resets_fields(desc, asking, offer):
 @given(desc=alpha, asking=money, offer=money, first_inspect=st.booleans())
 @settings(max_examples=15, deadline=None)
 def test_inspection_appraisal_converge_to_notional_acceptance(desc, asking, offer, first_inspect):
-    owner = allocate_unique_party("Seller")
-    b1    = allocate_unique_party("Buyer1")
-    b2    = allocate_unique_party("Buyer2")
-    insp  = allocate_unique_party("Inspector")
-    appr  = allocate_unique_party("Appraiser")
+    owner, b1, b2, insp, appr = allocate_roles()
 
     cid = create_asset(owner, [b1, b2], desc, asking)  # Active
     cid = make_offer(cid, b1, insp, appr, offer)       # → OfferPlaced
@@ -159,11 +151,7 @@ def test_inspection_appraisal_converge_to_notional_acceptance(desc, asking, offe
 @given(desc=alpha, asking=money, offer=money, buyer_first=st.booleans(), offer2=money)
 @settings(max_examples=15, deadline=None)
 def test_acceptance_paths_and_guards(desc, asking, offer, buyer_first, offer2):
-    owner = allocate_unique_party("Seller")
-    b1    = allocate_unique_party("Buyer1")
-    b2    = allocate_unique_party("Buyer2")
-    insp  = allocate_unique_party("Inspector")
-    appr  = allocate_unique_party("Appraiser")
+    owner, b1, b2, insp, appr = allocate_roles()
 
     cid = create_asset(owner, [b1, b2], desc, asking)  # Active
     cid = make_offer(cid, b1, insp, appr, offer)       # → OfferPlaced
@@ -186,23 +174,19 @@ def test_acceptance_paths_and_guards(desc, asking, offer, buyer_first, offer2):
     try:
         make_request("exercise", act_as=owner, template_id=AT_TID, contract_id=cid, choice="Terminate", argument={})
         assert False, "Terminate should fail in Accepted"
-    except AssertionError:
+    except CommandRejected:
         pass
 
     try:
         rescind_offer(cid, b1)
         assert False, "RescindOffer should fail in Accepted"
-    except AssertionError:
+    except CommandRejected:
         pass
 
 @given(desc=alpha, asking=money, offer=money, offer2=money)
 @settings(max_examples=12, deadline=None)
 def test_modify_offer_changes_price(desc, asking, offer, offer2):
-    owner = allocate_unique_party("Seller")
-    b1    = allocate_unique_party("Buyer1")
-    b2    = allocate_unique_party("Buyer2")
-    insp  = allocate_unique_party("Inspector")
-    appr  = allocate_unique_party("Appraiser")
+    owner, b1, b2, insp, appr = allocate_roles()
 
     cid = create_asset(owner, [b1, b2], desc, asking)  # Active
     cid = make_offer(cid, b1, insp, appr, offer)       # → OfferPlaced
@@ -215,51 +199,43 @@ def test_modify_offer_changes_price(desc, asking, offer, offer2):
 @given(desc=alpha, asking=money, offer=money, first_inspect=st.booleans())
 @settings(max_examples=12, deadline=None)
 def test_full_path_to_terminated_with_checks(desc, asking, offer, first_inspect):
-    owner = allocate_unique_party("Seller")
-    b1    = allocate_unique_party("Buyer1")
-    b2    = allocate_unique_party("Buyer2")
-    insp  = allocate_unique_party("Inspector")
-    appr  = allocate_unique_party("Appraiser")
+    owner, b1, b2, insp, appr = allocate_roles()
 
-    cid = create_asset(owner, [b1, b2], desc, asking)  # Active
-    p = fetch_payload(cid, owner)
+    # The handle follows the contract id and reads each post-state from the
+    # exercise response events instead of a separate /fetch.
+    h = ContractHandle.create(owner, AT_TID, asset_payload(owner, [b1, b2], desc, asking))  # Active
+    p = h.payload()
     assert state_of(p) == "Active"
     assert p["buyer"] is None and p["inspector"] is None and p["appraiser"] is None
     assert p["offerPrice"] is None
     assert p["description"] == desc
     assert Decimal(str(p["askingPrice"])) == Decimal(str(asking))
 
-    cid = make_offer(cid, b1, insp, appr, offer)       # → OfferPlaced
-    p = fetch_payload(cid, owner)
+    h.exercise(b1, "MakeOffer", {"buyerParty": b1, "newInspector": insp, "newAppraiser": appr,
+                                 "newOfferPrice": str(offer)})  # → OfferPlaced
+    p = h.payload()
     assert state_of(p) == "OfferPlaced"
     assert p["buyer"] == b1 and p["inspector"] == insp and p["appraiser"] == appr
     assert Decimal(str(p["offerPrice"])) == Decimal(str(offer))
 
-    cid = accept_offer(cid, owner)                      # → PendingInspection
-    p = fetch_payload(cid, owner)
-    assert state_of(p) == "PendingInspection"
+    h.exercise(owner, "AcceptOffer")                   # → PendingInspection
+    assert state_of(h.payload()) == "PendingInspection"
 
     if first_inspect:
-        cid = mark_inspected(cid, insp)                # PendingInspection→Inspected
-        p = fetch_payload(cid, owner)
-        assert state_of(p) == "Inspected"
-        cid = mark_appraised(cid, appr)                # Inspected→NotionalAcceptance
+        h.exercise(insp, "MarkInspected")              # PendingInspection→Inspected
+        assert state_of(h.payload()) == "Inspected"
+        h.exercise(appr, "MarkAppraised")              # Inspected→NotionalAcceptance
     else:
-        cid = mark_appraised(cid, appr)                # PendingInspection→Appraised
-        p = fetch_payload(cid, owner)
-        assert state_of(p) == "Appraised"
-        cid = mark_inspected(cid, insp)                # Appraised→NotionalAcceptance
+        h.exercise(appr, "MarkAppraised")              # PendingInspection→Appraised
+        assert state_of(h.payload()) == "Appraised"
+        h.exercise(insp, "MarkInspected")              # Appraised→NotionalAcceptance
 
-    p = fetch_payload(cid, owner)
-    assert state_of(p) == "NotionalAcceptance"
+    assert state_of(h.payload()) == "NotionalAcceptance"
 
-    cid = accept_by_buyer(cid, b1)                     # NotionalAcceptance→BuyerAccepted
-    p = fetch_payload(cid, owner)
-    assert state_of(p) == "BuyerAccepted"
+    h.exercise(b1, "AcceptByBuyer")                    # NotionalAcceptance→BuyerAccepted
+    assert state_of(h.payload()) == "BuyerAccepted"
 
     # Terminate is only allowed before SellerAccepted/Accepted; at BuyerAccepted it should still be allowed by contract?
     # Here we exercise Terminate after BuyerAccepted per your request to go to Terminated.
-    res = make_request("exercise", act_as=owner, template_id=AT_TID, contract_id=cid, choice="Terminate", argument={})
-    cid = res["exerciseResult"]
-    p = fetch_payload(cid, owner)
-    assert state_of(p) == "Terminated"
+    h.exercise(owner, "Terminate")
+    assert state_of(h.payload()) == "Terminated"
@@ -0,0 +1,435 @@
+# Tests of daml_pbt itself, on an in-process FakeLedger with the contract
+# models (no sandbox, no JSON API): the client's backpressure, caches and
+# batching, the DAR reader, payload codecs, pre-validation, cassettes, script
+# export, script mode (with a stub runner for `daml script`) and model
+# shrinking.
+import os, threading
+from decimal import Decimal
+
+import pytest
+from hypothesis import given, settings, strategies as st
+
+from daml_pbt import (AuthorizationError, Cassette, CassetteMiss, CommandRejected, ContractHandle, ContractNotFound,
+                      DamlClient, FakeLedger, LedgerError, LedgerSlots, PartyPool, PreconditionFailed, Registry,
+                      RetryPolicy, Schema, SchemaMismatch, ScriptExporter, ScriptFailure, TokenCache, TransientError,
+                      allocate_unique_party, classify_error, expect_rejection, find_dar, hs256_signer, make_request,
+                      model_shrink, models, package_id, parse_script_output, prevalidated, read_dar, render_batch,
+                      render_script, script_given, set_default_client, use_cassette, use_prevalidation,
+                      use_script_exporter)
+from daml_pbt import _parse_dar
+
+AT_TID = f"{package_id(__file__)}:AssetTransfer:AssetTransfer"
+
+def asset(owner: str, buyers: list[str], asking="100.0") -> dict:
+    return {"owner": owner, "potentialBuyers": buyers, "buyer": None, "inspector": None, "appraiser": None,
+            "description": "bike", "askingPrice": asking, "offerPrice": None, "state": "Active"}
+
+@pytest.fixture
+def fake():
+    ledger = FakeLedger(models.register_all(Registry()))
+    yield ledger
+    ledger.close()
+
+@pytest.fixture
+def client(fake):
+    with DamlClient(fake.base, adapter=fake.adapter()) as c:
+        yield c
+
+# --- FakeLedger, ContractHandle, CommandBatch --------------------------------
+
+def test_handle_follows_consuming_choices(client):
+    owner, buyer = client.allocate_unique_party("Seller"), client.allocate_unique_party("Buyer")
+    h = ContractHandle.create(owner, AT_TID, asset(owner, [buyer]), client=client)
+    first = h.cid
+    h.exercise(owner, "Modify", {"newDescription": "car", "newPrice": "250.0"})
+    assert h.cid != first
+    assert h.payload()["description"] == "car"
+    assert client.lookup(first, AT_TID, act_as=owner) is None
+    assert client.lookup(h.cid, AT_TID, act_as=buyer)["payload"] == h.payload()
+    with pytest.raises(ContractNotFound):
+        client.make_request("exercise", act_as=owner, template_id=AT_TID, contract_id=first,
+                            choice="Terminate", argument={})
+    h.exercise(owner, "Archive")
+    with pytest.raises(ContractNotFound):
+        h.payload()
+
+def test_fake_rejects_like_the_ledger(client):
+    owner, buyer = client.allocate_unique_party("Seller"), client.allocate_unique_party("Buyer")
+    cid = client.make_request("create", act_as=owner, template_id=AT_TID, payload=asset(owner, [buyer]))["contractId"]
+    with pytest.raises(AuthorizationError):
+        client.make_request("exercise", act_as=buyer, template_id=AT_TID, contract_id=cid, choice="Terminate",
+                            argument={})
+    with pytest.raises(AuthorizationError):
+        client.make_request("create", act_as=buyer, template_id=AT_TID, payload=asset(owner, [buyer]))
+    with pytest.raises(PreconditionFailed):
+        client.make_request("exercise", act_as=owner, template_id=AT_TID, contract_id=cid, choice="AcceptOffer",
+                            argument={})
+
+def test_batch_does_not_lend_the_creators_authority(client):
+    # the owner creates, a buyer exercises an owner-only choice: one
+    # create-and-exercise acting as both would pass
+    owner, buyer = client.allocate_unique_party("Seller"), client.allocate_unique_party("Buyer")
+    batch = client.batch().create(owner, AT_TID, asset(owner, [buyer])).exercise(buyer, "Terminate")
+    with pytest.raises(AuthorizationError):
+        batch.submit()
+    assert len(client.own_contracts(AT_TID)) == 1  # the create went through on its own
+
+def test_batch_of_one_party_is_one_submission(client, fake):
+    owner, buyer = client.allocate_unique_party("Seller"), client.allocate_unique_party("Buyer")
+    before = fake.offset
+    res = client.batch().create(owner, AT_TID, asset(owner, [buyer])) \
+                        .exercise(owner, "Modify", {"newDescription": "car", "newPrice": "250.0"}) \
+                        .exercise(owner, "Terminate").submit()
+    assert fake.offset == before + 2
+    assert client.lookup(res["exerciseResult"], AT_TID, act_as=owner)["payload"]["state"] == "Terminated"
+
+def test_batch_needs_a_create_first(client):
+    with pytest.raises(ValueError):
+        client.batch().exercise("Alice", "Terminate")
+    with pytest.raises(ValueError):
+        client.batch().submit()
+
+@pytest.mark.parametrize("status, text, expected", [
+    (503, "", TransientError),
+    (429, "", TransientError),
+    (403, "", AuthorizationError),
+    (500, "DAML_AUTHORIZATION_ERROR(9,0): requires authorizers Alice", AuthorizationError),
+    (404, "CONTRACT_NOT_FOUND(11,0): Contract could not be found", ContractNotFound),
+    (400, "UNHANDLED_EXCEPTION(9,0): Assertion failed", PreconditionFailed),
+    (400, "Interpretation error: something else", CommandRejected),
+    (400, "malformed JSON", LedgerError),
+])
+def test_classify_error(status, text, expected):
+    assert classify_error(status, text) is expected
+
+# --- backpressure ------------------------------------------------------------
+
+def test_shed_requests_are_retried():
+    busy = FakeLedger(models.register_all(Registry()), latency=0.01, capacity=1, shed=True)
+    with DamlClient(busy.base, adapter=busy.adapter(),
+                    retry=RetryPolicy(attempts=100, base_delay=0.001, max_delay=0.01)) as c:
+        parties = []
+        threads = [threading.Thread(target=lambda: parties.append(c.allocate_unique_party("P"))) for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    busy.close()
+    assert len(set(parties)) == 6
+    assert c.retry.retries > 0
+    assert c.limiter.drops > 0
+    assert c.limiter.inflight == 0
+
+def test_commands_are_not_retried_on_rejection(client):
+    owner = client.allocate_unique_party("Seller")
+    h = ContractHandle.create(owner, AT_TID, asset(owner, []), client=client)
+    with pytest.raises(PreconditionFailed):
+        h.exercise(owner, "AcceptOffer")
+    assert client.retry.retries == 0
+
+def test_ledger_slots_cap_concurrency(tmp_path):
+    slots = LedgerSlots("http://127.0.0.1:1/v1", 2, str(tmp_path))
+    inside, most, lock = [0], [0], threading.Lock()
+
+    def work():
+        with slots.held():
+            with lock:
+                inside[0] += 1
+                most[0] = max(most[0], inside[0])
+            threading.Event().wait(0.005)
+            with lock:
+                inside[0] -= 1
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert most[0] == 2
+
+def test_token_cache_is_lru():
+    cache = TokenCache(maxsize=2)
+    a = cache.token(("Alice",))
+    assert cache.token(("Alice",)) is a
+    cache.token(("Bob",))
+    cache.token(("Alice",))
+    cache.token(("Carol",))  # evicts Bob, the least recently used
+    assert cache.stats() == {"hits": 2, "misses": 3, "size": 2, "maxsize": 2}
+    cache.token(("Bob",))
+    assert cache.misses == 4
+
+def test_token_cache_signs_once_per_key():
+    signed = []
+
+    def signer(claims):
+        signed.append(claims)
+        return hs256_signer("secret")(claims)
+    cache = TokenCache(signer=signer)
+    tokens = {cache.token(("Alice",), ("Bob",)) for _ in range(5)}
+    assert len(tokens) == 1 and len(signed) == 1
+    assert signed[0]["https://daml.com/ledger-api"]["readAs"] == ["Bob"]
+    assert len(next(iter(tokens)).split(".")) == 3
+
+def test_party_pool_hands_out_each_party_once(client):
+    with PartyPool(client, high_water=3) as pool:
+        pool.warm("Buyer")
+        parties = [pool.take("Buyer") for _ in range(7)]
+        stats = pool.stats()
+    assert len(set(parties)) == 7
+    assert all(p.startswith("Buyer") for p in parties)
+    assert stats["served"] == 7 and stats["errors"] == 0
+
+# --- DAR and payload schema --------------------------------------------------
+
+def test_dar_is_read_and_cached():
+    path = find_dar(__file__)
+    with open(path, "rb") as f:
+        info = _parse_dar(f.read())
+    assert info["package_id"] == package_id(__file__)
+    assert read_dar(path) == info
+    template = info["templates"]["AssetTransfer:AssetTransfer"]
+    assert {"MakeOffer", "Terminate", "Archive"} <= set(template["choices"])
+
+SCHEMA = Schema(read_dar(find_dar(__file__)), parties=st.sampled_from(["Alice::1", "Bob::2"]))
+
+@given(payload=SCHEMA.payloads(AT_TID))
+@settings(max_examples=50, deadline=None)
+def test_schema_round_trip(payload):
+    encoded = SCHEMA.encode_payload(AT_TID, payload)
+    SCHEMA.checker(SCHEMA.payload_type(AT_TID))(encoded)
+    assert SCHEMA.decode_payload(AT_TID, encoded) == payload
+
+def test_schema_checker_rejects_bad_payloads():
+    check = SCHEMA.checker(SCHEMA.payload_type(AT_TID))
+    good = asset("Alice::1", ["Bob::2"])
+    check(good)
+    for bad in ({**good, "askingPrice": "ten"}, {**good, "state": "Sold"}, {**good, "potentialBuyers": "Bob"},
+                {k: v for k, v in good.items() if k != "owner"}):
+        with pytest.raises(SchemaMismatch):
+            check(bad)
+
+def test_schema_numeric_encoding():
+    encoded = SCHEMA.encode_payload(AT_TID, {**asset("Alice::1", []), "askingPrice": Decimal("12.50")})
+    assert isinstance(encoded["askingPrice"], str)
+    assert Decimal(encoded["askingPrice"]) == Decimal("12.5")
+
+# --- cassettes ---------------------------------------------------------------
+
+def test_cassette_replays_without_a_ledger(client, tmp_path):
+    path = str(tmp_path / "t.cassette")
+    prev = use_cassette(Cassette(path, "record"))
+    try:
+        owner, buyer = client.allocate_unique_party("Seller"), client.allocate_unique_party("Buyer")
+        h = ContractHandle.create(owner, AT_TID, asset(owner, [buyer]), client=client)
+        h.exercise(owner, "Modify", {"newDescription": "car", "newPrice": "250.0"})
+        recorded = h.cid, h.payload()
+        use_cassette(prev).close()
+
+        use_cassette(Cassette(path, "replay"))
+        with DamlClient("http://127.0.0.1:9/v1") as offline:  # nothing listens there
+            owner2, _ = offline.allocate_unique_party("Seller"), offline.allocate_unique_party("Buyer")
+            assert owner2 == owner
+            # a party the recording never saw stands in for the recorded buyer
+            h = ContractHandle.create(owner, AT_TID, asset(owner, ["Stranger::0"]), client=offline)
+            assert h.payload()["potentialBuyers"] == ["Stranger::0"]
+            h.exercise(owner, "Modify", {"newDescription": "car", "newPrice": "250.0"})
+            assert h.cid == recorded[0]
+            assert h.payload() == {**recorded[1], "potentialBuyers": ["Stranger::0"]}
+            with pytest.raises(CassetteMiss):
+                h.exercise(owner, "Terminate")
+    finally:
+        use_cassette(prev)
+
+# --- script export -----------------------------------------------------------
+
+def test_commands_render_as_daml_script(client, tmp_path):
+    exporter = ScriptExporter(str(tmp_path))
+    prev = use_script_exporter(exporter)
+    try:
+        owner, buyer = client.allocate_unique_party("Seller"), client.allocate_unique_party("Buyer")
+        h = ContractHandle.create(owner, AT_TID, asset(owner, [buyer]), client=client)
+        with pytest.raises(PreconditionFailed):
+            h.exercise(owner, "AcceptOffer")
+        log = use_script_exporter(prev).log()
+    finally:
+        use_script_exporter(prev)
+    assert [e["path"] for e in log.entries] == ["/parties/allocate", "/parties/allocate", "/create", "/exercise"]
+
+    failure = PreconditionFailed("/exercise", 400, "Assertion failed")
+    text = render_script(log, "Counterexamples.Example", "example", failure)
+    assert "module Counterexamples.Example where" in text
+    assert "example = script do" in text
+    assert "allocateParty" in text and "createCmd" in text and "AcceptOffer" in text
+    assert "-- The Python test failed with:" in text
+
+    # a project of its own next to the failing test, with the suite's DAR as a data-dependency
+    path = exporter.export(log.test, failure, __file__)
+    assert path == str(tmp_path / "daml" / "Counterexamples" / "TestCommandsRenderAsDamlScript.daml")
+    with open(tmp_path / "daml.yaml") as f:
+        yaml = f.read()
+    assert "  - daml-script\n" in yaml
+    assert os.path.samefile(tmp_path / yaml.split("data-dependencies:\n  - ")[1].strip(), find_dar(__file__))
+
+    batch = render_batch({"example0": log, "example1": log}, "DamlPbtBatch")
+    assert batch.startswith("-- 2 example(s) checked by daml_pbt")
+    assert "module DamlPbtBatch where" in batch
+    assert "example0 = script do" in batch and "example1 = script do" in batch
+    assert "submitMustFail" in batch
+
+# --- model shrinking ---------------------------------------------------------
+
+def capped(registry: Registry) -> Registry:
+    # AssetTransfer whose Modify refuses prices from 100 up
+    @registry.choice("AssetTransfer:AssetTransfer", "Modify", controllers=["owner"])
+    def modify(tx, p, arg):
+        tx.require(Decimal(arg["newPrice"]) < 100, "price cap")
+        return tx.create("AssetTransfer:AssetTransfer", {**p, "askingPrice": arg["newPrice"]})
+    return registry
+
+@pytest.fixture
+def capped_ledger():
+    ledger = FakeLedger(capped(models.register_all(Registry())))
+    client = DamlClient(ledger.base, adapter=ledger.adapter())
+    prev = set_default_client(client)
+    yield ledger
+    set_default_client(prev)
+    client.close()
+    ledger.close()
+
+def modify_to(price: int) -> None:
+    owner = allocate_unique_party("Seller")
+    cid = make_request("create", act_as=owner, template_id=AT_TID, payload=asset(owner, []))["contractId"]
+    make_request("exercise", act_as=owner, template_id=AT_TID, contract_id=cid, choice="Modify",
+                 argument={"newDescription": "bike", "newPrice": f"{price}.0"})
+
+def test_shrinks_on_models_that_agree(capped_ledger):
+    @model_shrink(registry=capped(models.register_all(Registry())))
+    @given(price=st.integers(0, 10_000))
+    @settings(max_examples=100, database=None, deadline=None)
+    def t(price):
+        modify_to(price)
+
+    with pytest.raises(PreconditionFailed) as e:
+        t()
+    assert "daml_pbt: shrunk on the contract models to {'price': 100}, confirmed on the ledger" in e.value.__notes__
+    assert capped_ledger.offset < 20  # only the first failure and the confirmation ran on the ledger
+
+def test_shrinks_on_the_ledger_when_the_models_disagree(capped_ledger):
+    @model_shrink(registry=models.register_all(Registry()))
+    @given(price=st.integers(0, 10_000))
+    @settings(max_examples=100, database=None, deadline=None)
+    def t(price):
+        modify_to(price)
+
+    with pytest.raises(PreconditionFailed) as e:
+        t()
+    assert "daml_pbt: shrunk on the ledger, the models are wrong about this test: it passed on the models" \
+        in e.value.__notes__
+    assert any("price=100" in note for note in e.value.__notes__)
+
+# --- script mode -------------------------------------------------------------
+
+def test_parse_script_output():
+    out = "\n".join([
+        "Compiling daml-pbt-batch to a DAR.",
+        "DamlPbtBatch:example0 SUCCESS",
+        "DamlPbtBatch:example1 FAILURE (Script execution failed:",
+        "  Unhandled exception:  DA.Exception.AssertionFailed:AssertionFailed@3f4deaf1",
+        "  with message = \"Assertion failed\")",
+        "DamlPbtBatch:other FAILURE (not ours)",
+        "example2 SUCCESS",
+    ])
+    results = parse_script_output(out, ["example0", "example1", "example2", "example3"])
+    assert results == {
+        "example0": None,
+        "example1": "Script execution failed:\n"
+                    "  Unhandled exception:  DA.Exception.AssertionFailed:AssertionFailed@3f4deaf1\n"
+                    "  with message = \"Assertion failed\"",
+        "example2": None,
+        "example3": "no result from daml script",
+    }
+
+class StubRunner:
+    # stands in for DamlScriptRunner: `fail` maps script names to their error
+    def __init__(self, fail=None):
+        self.fail = fail or {}
+        self.calls = []
+
+    def run(self, module, source, scripts):
+        self.calls.append((module, source, list(scripts)))
+        return {name: self.fail.get(name) for name in scripts}
+
+def sell(price: int) -> None:
+    owner = allocate_unique_party("Seller")
+    make_request("create", act_as=owner, template_id=AT_TID, payload=asset(owner, [], asking=f"{price}.0"))
+
+def test_script_failures_name_the_examples():
+    runner = StubRunner({"example1": "Script execution failed:\n  Assertion failed"})
+
+    @script_given(max_examples=5, runner=runner, registry=models.register_all(Registry()),
+                  price=st.integers(1, 1000))
+    def t(price):
+        sell(price)
+
+    with pytest.raises(ScriptFailure) as e:
+        t()
+    assert e.value.failures == {"example1": "Script execution failed:\n  Assertion failed"}
+    assert "went differently on the IDE ledger than on the fake ledger" in str(e.value)
+    assert "script of example1:" in str(e.value)
+    [(module, source, scripts)] = runner.calls
+    assert module == "DamlPbtBatch"
+    assert scripts == [f"example{i}" for i in range(len(scripts))] and len(scripts) > 1
+    assert all(f"{name} = script do" in source for name in scripts)
+
+def test_script_counterexamples_are_replayed_and_shrunk():
+    runner = StubRunner()
+
+    @script_given(max_examples=50, runner=runner, registry=models.register_all(Registry()),
+                  price=st.integers(1, 1000))
+    def t(price):
+        sell(price)
+        assert price < 50
+
+    with pytest.raises(AssertionError) as e:
+        t()
+    assert not isinstance(e.value, ScriptFailure)
+    assert any("price=50" in note for note in e.value.__notes__)
+    assert len(runner.calls) == 1
+
+def test_script_failures_that_do_not_replay_are_reported():
+    runs = []
+
+    @script_given(max_examples=5, runner=StubRunner(), registry=models.register_all(Registry()),
+                  price=st.integers(1, 1000))
+    def t(price):
+        runs.append(price)
+        sell(price)
+        assert len(runs) > 1  # only the first example of the batch fails
+
+    with pytest.raises(AssertionError, match="failed in the batch but passed when replayed serially"):
+        t()
+
+# --- pre-validation ----------------------------------------------------------
+
+def test_prevalidation_is_opt_in(client):
+    owner = client.allocate_unique_party("Seller")
+    bad = {**asset(owner, []), "askingPrice": "1.00000000001"}  # more decimals than Numeric 10
+
+    def refused_by() -> str:
+        with pytest.raises(LedgerError) as e:
+            client.make_request("create", act_as=owner, template_id=AT_TID, payload=bad)
+        return "pre-validation" if "(pre-validation)" in e.value.context else "ledger"
+
+    prev = use_prevalidation(False)  # the default, whatever --daml-prevalidate says
+    try:
+        assert refused_by() == "ledger"
+        with prevalidated():
+            assert refused_by() == "pre-validation"
+            with expect_rejection():
+                assert refused_by() == "ledger"
+        client.prevalidate = True
+        assert refused_by() == "pre-validation"
+        use_prevalidation(True)
+        client.prevalidate = False
+        assert refused_by() == "ledger"
+    finally:
+        use_prevalidation(prev)
@@ -0,0 +1,125 @@
+# Micro-benchmark for the daml_pbt HTTP client against the in-process fake JSON API.
+#
+#   python3 bench_client.py [--calls 2000]
+#
+# Compares the old per-call `requests.post` (fresh TCP connection each time)
+# with the pooled keep-alive DamlClient, then sequential vs gathered party
+# allocation through AsyncDamlClient with simulated ledger latency, and the
+# client CPU spent building auth headers with and without the token cache,
+# examples spread over one vs several saturated ledgers via LedgerPool, and
+# a ledger that sheds load with 503s, with and without the client governor.
+# No Daml SDK needed.
+import argparse, asyncio, os, sys, time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from daml_pbt import (AimdLimiter, AsyncDamlClient, DamlClient, FakeLedger, LedgerPool, RetryPolicy, TokenCache,
+                      allocate_unique_party, ensure_ok, make_auth, make_request, set_token_cache)
+
+def serve(capacity: int = 1000, shed: bool = False, latency: float = 0.0) -> FakeLedger:
+    # a sandbox only works on so many commands at once; past that it either
+    # queues or, when shedding, answers 503 straight away
+    return FakeLedger(capacity=capacity, shed=shed, latency=latency).start()
+
+def run(label: str, calls: int, fn) -> float:
+    t0 = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    rate = calls / (time.perf_counter() - t0)
+    print(f"{label:<28} {rate:10.1f} calls/sec")
+    return rate
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--calls", type=int, default=2000)
+    ap.add_argument("--examples", type=int, default=20)
+    ap.add_argument("--latency-ms", type=float, default=20.0)
+    ap.add_argument("--auth-calls", type=int, default=10000)
+    ap.add_argument("--ledgers", type=int, default=3)
+    ap.add_argument("--capacity", type=int, default=4, help="concurrent commands one stand-in ledger handles")
+    args = ap.parse_args()
+
+    srv = serve()
+    base = srv.base
+    body = {"templateId": "pkg:Mod:T", "payload": {"owner": "Alice"}}
+
+    before = run("requests.post (per call)", args.calls,
+                 lambda: ensure_ok(requests.post(f"{base}/create", json=body, headers=make_auth("Alice")), "/create"))
+    with DamlClient(base) as client:
+        after = run("DamlClient (keep-alive)", args.calls,
+                    lambda: client.make_request("create", act_as="Alice", template_id="pkg:Mod:T", payload=body["payload"]))
+    print(f"speedup: {after / before:.2f}x")
+
+    # Five role allocations per example, as at the top of every asset_transfer test.
+    srv.latency = args.latency_ms / 1000
+    roles = ("Seller", "Buyer1", "Buyer2", "Inspector", "Appraiser")
+    with DamlClient(base) as client:
+        t0 = time.perf_counter()
+        for _ in range(args.examples):
+            [client.allocate_unique_party(r) for r in roles]
+        seq = (time.perf_counter() - t0) / args.examples
+
+        async def gathered():
+            async with AsyncDamlClient(client, max_concurrency=len(roles)) as ac:
+                for _ in range(args.examples):
+                    await ac.allocate_unique_parties(*roles)
+        t0 = time.perf_counter()
+        asyncio.run(gathered())
+        par = (time.perf_counter() - t0) / args.examples
+    print(f"5 allocations, sequential   {seq * 1000:10.1f} ms/example")
+    print(f"5 allocations, gathered     {par * 1000:10.1f} ms/example")
+    srv.close()
+
+    parties = [f"Party-{i}" for i in range(20)]
+    for label, cache in (("make_auth, uncached", TokenCache(maxsize=0)), ("make_auth, cached", TokenCache())):
+        set_token_cache(cache)
+        t0 = time.process_time()
+        for i in range(args.auth_calls):
+            make_auth(parties[i % len(parties)])
+        cpu = time.process_time() - t0
+        print(f"{label:<28} {cpu * 1e6 / args.auth_calls:10.2f} us CPU/call")
+    set_token_cache(TokenCache())
+
+    # 16 example threads, each example = allocate + create, pinned to one ledger.
+    def example(_):
+        with pool.pin():
+            owner = allocate_unique_party("Seller")
+            make_request("create", act_as=owner, template_id="pkg:Mod:T", payload={"owner": owner})
+    for n in (1, args.ledgers):
+        srvs = [serve(args.capacity, latency=args.latency_ms / 1000) for _ in range(n)]
+        pool = LedgerPool.from_bases([s.base for s in srvs])
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(16) as ex:
+            list(ex.map(example, range(args.examples * 8)))
+        rate = args.examples * 8 / (time.perf_counter() - t0)
+        print(f"{n} ledger(s), pinned examples  {rate:10.1f} examples/sec  picks={[st['picks'] for st in pool.stats()]}")
+        pool.close()
+        for s in srvs:
+            s.close()
+
+    # 32 threads against one ledger that answers 503 beyond `capacity` commands.
+    srv = serve(args.capacity, shed=True, latency=args.latency_ms / 1000)
+    base = srv.base
+    for label, governed in (("503-shedding, no governor", False), ("503-shedding, governed", True)):
+        client = DamlClient(base, pool_size=32)
+        if not governed:
+            client.limiter = AimdLimiter(initial=1000, min_limit=1000, max_limit=1000)
+            client.retry = RetryPolicy(attempts=1)
+        def create(_):
+            try:
+                client.make_request("create", act_as="Alice", template_id="pkg:Mod:T", payload={"owner": "Alice"})
+                return True
+            except AssertionError:
+                return False
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(32) as ex:
+            ok = sum(ex.map(create, range(args.examples * 16)))
+        rate = ok / (time.perf_counter() - t0)
+        print(f"{label:<28} {rate:10.1f} ok/sec  failed={args.examples * 16 - ok}  "
+              f"limit={int(client.limiter.limit)} retries={client.retry.retries}")
+        client.close()
+    srv.close()
+
+if __name__ == "__main__":
+    main()
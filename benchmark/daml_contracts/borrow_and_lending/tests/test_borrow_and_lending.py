@@ -1,34 +1,27 @@
 from decimal import Decimal
-import requests
 from hypothesis import given, settings, strategies as st
-from daml_pbt import make_request, make_auth, allocate_unique_party, ensure_ok
+from daml_pbt import make_request, allocate_unique_party, lookup_contract, exercise_view, view, package_id, load_schema, precondition
 
-BASE = "http://localhost:7575/v1"
-PKG = "cb2661eb40b2339cdfdbdf663b82bdfec6835cfb775a7787934754faa7cdbc62"
+PKG = package_id(__file__)
 BAL_TID = f"{PKG}:BorrowAndLending:BorrowAndLending"
+SCHEMA = load_schema(__file__)
 
 tokens_fixed = ["USD", "BTC", "ETH"]
 money = st.decimals(min_value="0.01", max_value="100000.00", places=2)
 alpha = st.sampled_from(tokens_fixed)
 
-def tup(token: str, amount: Decimal):
-    return {"_1": token, "_2": str(amount)}
-
 def fetch_payload(cid: str, act_as: str) -> dict:
-    r = requests.post(f"{BASE}/fetch",
-                      json={"templateId": BAL_TID, "contractId": cid},
-                      headers=make_auth(act_as))
-    res = ensure_ok(r, "/fetch")
+    res = lookup_contract(cid, BAL_TID, act_as=act_as)
     return res["payload"]
 
 def create_contract(owner: str, balances: list[tuple[str, Decimal]]) -> str:
-    payload = {
+    payload = SCHEMA.encode_payload(BAL_TID, {
         "owner": owner,
         "users": [],
         "lenders": [],
         "borrowers": [],
-        "balances": [tup(t, a) for (t, a) in balances],
-    }
+        "balances": balances,  # [(Text, Decimal)] tuples, encoded as {"_1", "_2"}
+    })
     res = make_request("create", act_as=owner, template_id=BAL_TID, payload=payload)
     return res["contractId"]
 
@@ -66,28 +59,41 @@ def repay(cid: str, user: str, collateral_token: str, borrow_token: str) -> str:
                        argument={"user": user, "collateralToken": collateral_token, "borrowToken": borrow_token})
     return res["exerciseResult"]
 
+# argument-only assertMsg bounds, checked before submission under --daml-prevalidate
+@precondition(BAL_TID, "Lend", "Amount must be positive")
+def _lend_positive(p: dict | None, arg: dict) -> bool:
+    return Decimal(str(arg["amount"])) > 0
+
+@precondition(BAL_TID, "Borrow", "Borrow amount must be positive")
+def _borrow_positive(p: dict | None, arg: dict) -> bool:
+    return Decimal(str(arg["borrowAmount"])) > 0
+
+@precondition(BAL_TID, "Borrow", "Collateral amount must be greater than twice the borrow amount")
+def _borrow_collateralised(p: dict | None, arg: dict) -> bool:
+    return Decimal(str(arg["collateralAmount"])) >= 2 * Decimal(str(arg["borrowAmount"]))
+
+# Getter choices answered from the payload (see exercise_view); the
+# projections mirror the Daml bodies of GetCollaterals/GetBorrowers/GetBalances.
+@view(BAL_TID, "GetCollaterals")
+def _view_collaterals(p: dict, arg: dict):
+    return [l for l in p["lenders"] if l["owner"] == arg["user"]]
+
+@view(BAL_TID, "GetBorrowers")
+def _view_borrowers(p: dict, arg: dict):
+    return [b for b in p["borrowers"] if b["owner"] == arg["user"]]
+
+@view(BAL_TID, "GetBalances")
+def _view_balances(p: dict, arg: dict):
+    return p["balances"]
+
 def get_collaterals(cid: str, user: str):
-    res = make_request("exercise", act_as=user, template_id=BAL_TID, contract_id=cid,
-                       choice="GetCollaterals", argument={"user": user})
-    return res["exerciseResult"]
+    return exercise_view(user, BAL_TID, cid, "GetCollaterals", {"user": user})
 
 def get_borrowers(cid: str, user: str):
-    res = make_request("exercise", act_as=user, template_id=BAL_TID, contract_id=cid,
-                       choice="GetBorrowers", argument={"user": user})
-    return res["exerciseResult"]
+    return exercise_view(user, BAL_TID, cid, "GetBorrowers", {"user": user})
 
 def get_balances(cid: str, user: str) -> dict[str, Decimal]:
-    res = make_request("exercise", act_as=user, template_id=BAL_TID, contract_id=cid,
-                       choice="GetBalances", argument={"user": user})
-    out = {}
-    for item in res["exerciseResult"]:
-        if isinstance(item, dict) and "_1" in item and "_2" in item:
-            out[item["_1"]] = Decimal(str(item["_2"]))
-        elif isinstance(item, list) and len(item) == 2:
-            out[item[0]] = Decimal(str(item[1]))
-        else:
-            raise AssertionError(f"Unexpected tuple encoding: {item}")
-    return out
+    return dict(SCHEMA.decode_result(BAL_TID, "GetBalances", exercise_view(user, BAL_TID, cid, "GetBalances", {"user": user})))
 
 
 @given(tok=alpha, a1=money, a2=money)
@@ -1,7 +1,7 @@
 from hypothesis import given, settings, strategies as st
-from daml_pbt import make_request, allocate_unique_party
+from daml_pbt import make_request, allocate_unique_party, lookup_contract, isolation, CommandRejected, package_id
 
-PKG = "b46b4ba42416f39c25b6fe0f41c14f0110d33505d925136bbbb8e9a15b860d59"
+PKG = package_id(__file__)
 TID = f"{PKG}:DefectiveComponentCounter:DefectiveCounter"
 
 def create_counter(manufacturer: str, defective: int, state: str = "Create") -> str:
@@ -33,15 +33,15 @@ def compute_total(cid: str, manufacturer: str) -> str:
     return res["exerciseResult"]
 
 def get_payload(cid: str, reader: str) -> dict:
-    # Read helper via /query (using readAs=reader) to retrieve payload for cid
-    res = make_request("query", read_as=[reader], template_ids=[TID], query={})
-    for c in res:
-        if c["contractId"] == cid:
-            return c["payload"]
-    raise AssertionError("contract not found for reader")
+    # Read helper via /fetch (using readAs=reader) to retrieve payload for cid
+    c = lookup_contract(cid, TID, reader=[reader])
+    if c is None:
+        raise AssertionError("contract not found for reader")
+    return c["payload"]
 
 @given(n=st.integers(min_value=0, max_value=10**6))
 @settings(max_examples=10, deadline=None)
+@isolation("session")  # reads only the counter it created, by contract id
 def test_compute_total_sets_state_and_preserves_count(n):
     m = allocate_unique_party("M")
 
@@ -77,6 +77,6 @@ def test_only_manufacturer_can_compute(n):
             argument={},
         )
         assert False, "Only the manufacturer should be able to ComputeTotal"
-    except AssertionError:
-        # Expected: JSON API returns 400 and ensure_ok raises AssertionError
+    except CommandRejected:
+        # Expected: JSON API returns 400 and ensure_ok raises a CommandRejected
         pass
@@ -0,0 +1,13 @@
+# Registers the daml_pbt pytest plugin once for all suites below: per-worker
+# application ids and party names under pytest-xdist, the --daml-max-inflight
+# ledger cap, sharding tests across --daml-ledgers, --daml-shrink, the stale
+# PKG check and the merged ledger timing report. daml_pbt itself is the
+# package next to this file (pytest.ini puts this directory on sys.path).
+from daml_pbt.plugin import (  # noqa: F401
+    pytest_addoption, pytest_collection_finish, pytest_configure, pytest_pyfunc_call, pytest_runtest_call,
+    pytest_sessionfinish, pytest_terminal_summary,
+)
+
+# templates/ are copied into a Daml project's tests/ to start a suite; they
+# have no DAR of their own here
+collect_ignore = ["templates"]
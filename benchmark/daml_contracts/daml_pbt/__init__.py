@@ -0,0 +1,1973 @@
+import asyncio, atexit, base64, contextlib, functools, glob, hashlib, hmac, inspect, json, os, random, re, tempfile, threading, time, uuid
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+from hypothesis import HealthCheck, Phase, example, given, reject, seed as hseed, settings
+from hypothesis.control import current_build_context, currently_in_test_context
+from hypothesis.errors import InvalidArgument, UnsatisfiedAssumption
+
+BASE = "http://localhost:7575/v1"
+# Endpoints to shard examples across, each a separate sandbox + JSON API with
+# the DAR uploaded: DAML_PBT_LEDGERS=http://localhost:7575/v1,http://localhost:7576/v1
+LEDGERS = [b.strip() for b in os.environ.get("DAML_PBT_LEDGERS", "").split(",") if b.strip()] or [BASE]
+
+# Per-process identity on the ledger. The pytest plugin (daml_pbt.plugin)
+# rewrites both for each pytest-xdist worker so workers never share an
+# application id (and its command dedup space) or party hints.
+APP_ID = "pbt-tests"
+PARTY_NAMESPACE = ""
+
+try:
+    import fcntl
+except ImportError:  # not POSIX: LedgerSlots is unavailable
+    fcntl = None
+
+def _b64url(b: bytes) -> str:
+    return base64.urlsafe_b64encode(b).rstrip(b"=").decode("ascii")
+
+def unsigned_token(claims: dict) -> str:
+    header  = _b64url(json.dumps({"alg": "none", "typ": "JWT"}).encode())
+    payload = _b64url(json.dumps(claims).encode())
+    return f"{header}.{payload}."
+
+def hs256_signer(secret: str | bytes):
+    key = secret.encode() if isinstance(secret, str) else secret
+    def sign(claims: dict) -> str:
+        signing_input = f"{_b64url(json.dumps({'alg': 'HS256', 'typ': 'JWT'}).encode())}.{_b64url(json.dumps(claims).encode())}"
+        sig = hmac.new(key, signing_input.encode("ascii"), hashlib.sha256).digest()
+        return f"{signing_input}.{_b64url(sig)}"
+    return sign
+
+class TokenCache:
+    # Bounded LRU of bearer tokens keyed by (actAs, readAs, ledgerId,
+    # applicationId, admin). `signer` turns the claims dict into a token
+    # string; plug in e.g. hs256_signer(secret) or a PyJWT RS256 wrapper so
+    # tokens are signed once per key instead of once per request.
+    def __init__(self, maxsize: int = 1024, signer=unsigned_token):
+        self.maxsize = maxsize
+        self.signer = signer
+        self.hits = 0
+        self.misses = 0
+        self._tokens: OrderedDict[tuple, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def token(self, act_as=(), read_as=(), ledger_id="sandbox", app_id=None, admin=False) -> str:
+        app_id = app_id or APP_ID
+        key = (tuple(act_as), tuple(read_as), ledger_id, app_id, admin)
+        with self._lock:
+            tok = self._tokens.get(key)
+            if tok is not None:
+                self._tokens.move_to_end(key)
+                self.hits += 1
+                return tok
+            self.misses += 1
+        if admin:
+            claims = {"ledgerId": ledger_id, "applicationId": app_id, "admin": True}
+        else:
+            claims = {"ledgerId": ledger_id, "applicationId": app_id, "actAs": list(act_as), "readAs": list(read_as)}
+        tok = self.signer({"https://daml.com/ledger-api": claims})
+        with self._lock:
+            self._tokens[key] = tok
+            if len(self._tokens) > self.maxsize:
+                self._tokens.popitem(last=False)
+        return tok
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._tokens), "maxsize": self.maxsize}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._tokens.clear()
+            self.hits = self.misses = 0
+
+_token_cache = TokenCache()
+
+def token_cache() -> TokenCache:
+    return _token_cache
+
+def set_token_cache(cache: TokenCache) -> TokenCache:
+    global _token_cache
+    prev, _token_cache = _token_cache, cache
+    return prev
+
+def _parties(p) -> tuple:
+    if not p:
+        return ()
+    return (p,) if isinstance(p, str) else tuple(p)
+
+# Both return a fresh headers dict per call; only the token string is shared.
+# act_as_party may be a single party or a list (multi-party submissions).
+def make_auth(act_as_party=None, read_as=None, ledger_id="sandbox", app_id=None):
+    tok = _token_cache.token(_parties(act_as_party), _parties(read_as), ledger_id, app_id)
+    return {"Authorization": f"Bearer {tok}"}
+
+def make_admin_auth(ledger_id="sandbox", app_id=None):
+    tok = _token_cache.token(ledger_id=ledger_id, app_id=app_id, admin=True)
+    return {"Authorization": f"Bearer {tok}"}
+
+# Failures from the JSON API, classified from the error body. All subclass
+# AssertionError so existing `except AssertionError` guards keep working, but
+# negative tests should catch CommandRejected: it excludes infrastructure
+# failures and a plain `assert False` inside the same try.
+class LedgerError(AssertionError):
+    def __init__(self, context: str, status: int, message: str, body: dict | None = None):
+        super().__init__(f"{context} failed {status}: {message}" if status else f"{context}: {message}")
+        self.context, self.status, self.message, self.body = context, status, message, body
+
+class TransientError(LedgerError):
+    # overload, timeouts, connection trouble: the example says nothing about the contract
+    pass
+
+class CommandRejected(LedgerError):
+    # the ledger interpreted the command and refused it
+    pass
+
+class AuthorizationError(CommandRejected):
+    pass
+
+class PreconditionFailed(CommandRejected):
+    # assert/assertMsg/ensure or `error` in Daml; `reason` is the Daml message
+    @property
+    def reason(self) -> str:
+        m = re.search(r'message = "((?:[^"\\]|\\.)*)"', self.message) or \
+            re.search(r"(?:User abort|Template precondition violated): ([^\n]*)", self.message)
+        return m.group(1) if m else self.message
+
+class ContractNotFound(CommandRejected):
+    # unknown, archived or not visible to the submitting parties
+    pass
+
+_ERROR_MARKERS = (
+    (TransientError, ("UNAVAILABLE", "RESOURCE_EXHAUSTED", "DEADLINE_EXCEEDED", "ABORTED",
+                      "PARTICIPANT_BACKPRESSURE", "SERVER_IS_SHUTTING_DOWN")),
+    (AuthorizationError, ("DAML_AUTHORIZATION_ERROR", "requires authorizers", "missing authorization",
+                          "PERMISSION_DENIED", "UNAUTHENTICATED")),
+    (ContractNotFound, ("CONTRACT_NOT_FOUND", "CONTRACT_NOT_ACTIVE", "Contract could not be found",
+                        "ContractNotFound", "ContractNotActive")),
+    (PreconditionFailed, ("UNHANDLED_EXCEPTION", "AssertionFailed", "TEMPLATE_PRECONDITION_VIOLATED",
+                          "INTERPRETATION_USER_ERROR", "User abort", "precondition violated")),
+    (CommandRejected, ("DAML_INTERPRETATION_ERROR", "Interpretation error")),
+)
+
+def classify_error(status: int, text: str) -> type[LedgerError]:
+    if status in (429, 502, 503, 504):
+        return TransientError
+    if status in (401, 403):
+        return AuthorizationError
+    for cls, markers in _ERROR_MARKERS:
+        if any(m in text for m in markers):
+            return cls
+    return LedgerError
+
+def _error_text(r: requests.Response) -> tuple[str, dict | None]:
+    # {"status": 400, "errors": [...], "ledgerApiError": {"message": ...}} or plain text
+    try:
+        body = r.json()
+    except ValueError:
+        return r.text, None
+    if not isinstance(body, dict):
+        return r.text, None
+    parts = [str(e) for e in body.get("errors") or []]
+    api = body.get("ledgerApiError") or {}
+    if api.get("message") and api["message"] not in parts:
+        parts.append(api["message"])
+    return "; ".join(parts) or r.text, body
+
+def ensure_ok(r: requests.Response, context: str) -> dict:
+    if r.status_code != 200:
+        text, body = _error_text(r)
+        raise classify_error(r.status_code, text)(context, r.status_code, text, body)
+    body = r.json()
+    if "result" not in body:
+        raise LedgerError(context, r.status_code, f"missing 'result': {body}", body)
+    return body["result"]
+
+def _template_key(template_id: str | None) -> str:
+    # "pkg:Module:Entity" -> "Module:Entity"; the JSON API may answer with or
+    # without the package id.
+    return ":".join((template_id or "").split(":")[-2:])
+
+def _party_of(res) -> str:
+    if isinstance(res, dict):
+        if "party" in res:
+            return res["party"]
+        if "partyDetails" in res and isinstance(res["partyDetails"], dict) and "party" in res["partyDetails"]:
+            return res["partyDetails"]["party"]
+        if "identifier" in res:
+            return res["identifier"]
+    raise AssertionError(f"/parties/allocate unexpected result shape: {res}")
+
+# -- DAR metadata ----------------------------------------------------------
+# Package id and templates read straight from .daml/dist/*.dar (a zip): the
+# manifest names the main DALF, whose Archive proto carries the package id
+# (sha256 of the payload) and the Daml-LF package. Decoded with a minimal
+# protobuf reader, no SDK, subprocess or JVM; results are cached on disk by
+# DAR content hash. Field numbers are those of daml_lf_1.proto.
+
+_DAR_CACHE_VERSION = 2
+
+class StalePackageError(LedgerError):
+    # the package id a test uses is not the one built / uploaded
+    pass
+
+def _varint(buf: bytes, i: int) -> tuple[int, int]:
+    shift = result = 0
+    while True:
+        b = buf[i]
+        i += 1
+        result |= (b & 0x7F) << shift
+        if b < 0x80:
+            return result, i
+        shift += 7
+
+def _pb_fields(buf: bytes):
+    # yields (field number, value): int for varints, bytes for everything else
+    i, n = 0, len(buf)
+    while i < n:
+        key, i = _varint(buf, i)
+        wire = key & 7
+        if wire == 0:
+            v, i = _varint(buf, i)
+        elif wire == 2:
+            size, i = _varint(buf, i)
+            v, i = buf[i:i + size], i + size
+        elif wire == 1:
+            v, i = buf[i:i + 8], i + 8
+        elif wire == 5:
+            v, i = buf[i:i + 4], i + 4
+        else:
+            raise ValueError(f"unsupported protobuf wire type {wire}")
+        yield key >> 3, v
+
+def _pb_ints(v) -> list[int]:
+    # repeated int32: packed (bytes) or a single varint
+    if isinstance(v, int):
+        return [v]
+    out, i = [], 0
+    while i < len(v):
+        x, i = _varint(v, i)
+        out.append(x)
+    return out
+
+def _manifest(text: str) -> dict[str, str]:
+    # MANIFEST.MF wraps long values onto lines starting with one space
+    out: dict[str, str] = {}
+    key = None
+    for line in text.splitlines():
+        if line.startswith(" ") and key:
+            out[key] += line[1:]
+        elif ":" in line:
+            key, _, value = line.partition(":")
+            out[key] = value.strip()
+    return out
+
+_PRIM_TYPES = {
+    0: "Unit", 1: "Bool", 2: "Int64", 3: "Decimal", 5: "Text", 6: "Timestamp", 8: "Party", 9: "List",
+    10: "Update", 11: "Scenario", 12: "Date", 13: "ContractId", 14: "Optional", 15: "Arrow", 16: "TextMap",
+    17: "Numeric", 18: "Any", 19: "TypeRep", 20: "GenMap", 21: "BigNumeric", 22: "RoundingMode", 23: "AnyException",
+}
+
+class _LfPackage:
+    # Decoder for one Daml-LF 1 Package message. Types come out as plain
+    # JSON-able dicts: {"prim": "List", "args": [...]}, {"con": "pkg:Mod:Ent",
+    # "args": [...]}, {"var": "a"}, {"nat": 10}.
+    def __init__(self, package_id: str, payload: bytes):
+        fields = dict(_pb_fields(payload))
+        if 2 not in fields:
+            raise ValueError(f"package {package_id}: only Daml-LF 1 is supported")
+        self.id = package_id
+        self.lf_minor = fields.get(3, b"").decode()
+        self.strings: list[str] = []
+        self.dotted: list[list[int]] = []
+        self.itypes: list[bytes] = []
+        self.modules: list[bytes] = []
+        self.meta: dict = {}
+        for f, v in _pb_fields(fields[2]):
+            if f == 1:
+                self.modules.append(v)
+            elif f == 2:
+                self.strings.append(v.decode())
+            elif f == 3:
+                self.dotted.append([s for sf, sv in _pb_fields(v) if sf == 1 for s in _pb_ints(sv)])
+            elif f == 4:
+                self.meta = dict(_pb_fields(v))
+            elif f == 5:
+                self.itypes.append(v)
+        self.refs: set[str] = set()  # other packages named by decoded types
+
+    def dname(self, d: dict, interned: int, inline: int) -> str:
+        # a DottedName, interned (newer LF) or spelled out (older packages)
+        if interned in d:
+            return ".".join(self.strings[s] for s in self.dotted[d[interned]])
+        return ".".join(seg.decode() for f, seg in _pb_fields(d.get(inline, b"")) if f == 1)
+
+    def _qualified(self, tycon: bytes) -> str:
+        t = dict(_pb_fields(tycon))
+        mref = dict(_pb_fields(t[1]))
+        pref = dict(_pb_fields(mref.get(1, b"")))
+        pkg = self.id if 1 in pref else pref[2].decode() if 2 in pref else self.strings[pref.get(3, 0)]
+        if pkg != self.id:
+            self.refs.add(pkg)
+        return f"{pkg}:{self.dname(mref, 3, 2)}:{self.dname(t, 3, 2)}"
+
+    def type(self, buf: bytes) -> dict:
+        f, v = next(_pb_fields(buf))
+        if f == 13:
+            return self.type(self.itypes[v])
+        if f == 11:
+            return {"nat": (v >> 1) ^ -(v & 1)}  # sint64, zigzag
+        sub = list(_pb_fields(v))
+        args = [self.type(a) for af, a in sub if af == 2]
+        if f == 1:
+            d = dict(sub)
+            var = self.strings[d[3]] if 3 in d else d.get(1, b"").decode()
+            return {"var": var, "args": args} if args else {"var": var}
+        if f == 2:
+            return {"con": self._qualified(dict(sub)[1]), "args": args}
+        if f == 3:
+            return {"prim": _PRIM_TYPES.get(dict(sub).get(1, 0), "?"), "args": args}
+        return {"unsupported": f}  # foralls, structs, synonyms: never serializable
+
+    def _fields(self, buf: bytes) -> list:
+        out = []
+        for _, fw in _pb_fields(buf):
+            d = dict(_pb_fields(fw))
+            out.append([self.strings[d[3]] if 3 in d else d.get(1, b"").decode(), self.type(d[2])])
+        return out
+
+    def data_types(self) -> dict[str, dict]:
+        out = {}
+        for m in self.modules:
+            mfields = list(_pb_fields(m))
+            module = self.dname(dict(mfields), 8, 1)
+            for f, v in mfields:
+                if f != 5:
+                    continue
+                d = list(_pb_fields(v))
+                dd = dict(d)
+                if not dd.get(5):  # not serializable
+                    continue
+                params = []
+                for pf, pv in d:
+                    if pf == 2:
+                        p = dict(_pb_fields(pv))
+                        params.append(self.strings[p[3]] if 3 in p else p.get(1, b"").decode())
+                dt: dict = {"params": params}
+                if 3 in dd:
+                    dt["record"] = self._fields(dd[3])
+                elif 4 in dd:
+                    dt["variant"] = self._fields(dd[4])
+                elif 7 in dd:
+                    e = list(_pb_fields(dd[7]))
+                    dt["enum"] = [self.strings[i] for ef, ev in e if ef == 2 for i in _pb_ints(ev)] or \
+                                 [ev.decode() for ef, ev in e if ef == 1]
+                else:
+                    continue
+                out[f"{self.id}:{module}:{self.dname(dd, 8, 1)}"] = dt
+        return out
+
+    def templates(self) -> dict[str, dict]:
+        out = {}
+        for m in self.modules:
+            mfields = list(_pb_fields(m))
+            module = self.dname(dict(mfields), 8, 1)
+            for f, v in mfields:
+                if f != 7:
+                    continue
+                t = list(_pb_fields(v))
+                entity = self.dname(dict(t), 12, 1)
+                choices = {}
+                for cf, cv in t:
+                    if cf != 7:
+                        continue
+                    c = dict(_pb_fields(cv))
+                    arg = dict(_pb_fields(c[4]))
+                    name = self.strings[c[9]] if 9 in c else c[1].decode()
+                    choices[name] = {"consuming": bool(c.get(2, 0)), "arg": self.type(arg[2]), "ret": self.type(c[5])}
+                out[f"{module}:{entity}"] = {"choices": choices}
+        return out
+
+def _parse_dar(data: bytes) -> dict:
+    import io, zipfile
+    with zipfile.ZipFile(io.BytesIO(data)) as z:
+        mf = _manifest(z.read("META-INF/MANIFEST.MF").decode())
+        dalfs = {n.rsplit("-", 1)[-1][:-len(".dalf")]: n for n in z.namelist() if n.endswith(".dalf")}
+
+        def package(name: str) -> _LfPackage:
+            archive = dict(_pb_fields(z.read(name)))
+            pid = hashlib.sha256(archive[3]).hexdigest()
+            if archive.get(4) and archive[4].decode() != pid:
+                raise ValueError(f"{name}: hash {archive[4].decode()} does not match payload")
+            return _LfPackage(pid, archive[3])
+
+        main = package(mf["Main-Dalf"])
+        templates = main.templates()
+        types = main.data_types()
+        # pull in data types of the packages they reference (DA.Types tuples, ...)
+        todo, done = set(main.refs), {main.id}
+        while todo:
+            pid = todo.pop()
+            done.add(pid)
+            if pid not in dalfs:
+                continue
+            dep = package(dalfs[pid])
+            types.update(dep.data_types())
+            todo |= dep.refs - done
+    meta = main.meta
+    return {
+        "package_id": main.id,
+        "name": main.strings[meta[1]] if 1 in meta else mf.get("Name"),
+        "version": main.strings[meta[2]] if 2 in meta else None,
+        "sdk_version": mf.get("Sdk-Version"),
+        "lf_minor": main.lf_minor,
+        "templates": templates,
+        "types": types,
+    }
+
+def _dar_cache_dir() -> str:
+    return os.environ.get("DAML_PBT_CACHE") or os.path.join(os.path.expanduser("~"), ".cache", "daml_pbt")
+
+_dars: dict[str, dict] = {}
+
+def read_dar(path: str) -> dict:
+    # {"package_id", "name", "version", "sdk_version", "lf_minor",
+    #  "templates": {"Module:Entity": {"choices": {name: {"consuming", "arg", "ret"}}}},
+    #  "types": {"pkg:Module:Entity": {"params": [...], "record" | "variant": [[name, type]], "enum": [...]}}}
+    with open(path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    if digest in _dars:
+        return _dars[digest]
+    cached = os.path.join(_dar_cache_dir(), f"dar-v{_DAR_CACHE_VERSION}-{digest}.json")
+    try:
+        with open(cached) as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        info = _parse_dar(data)
+        try:
+            os.makedirs(os.path.dirname(cached), exist_ok=True)
+            tmp = f"{cached}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(info, f)
+            os.replace(tmp, cached)  # atomic, xdist workers may race here
+        except OSError:
+            pass  # read-only home: just don't cache
+    _dars[digest] = info
+    return info
+
+def find_dar(start: str | None = None) -> str:
+    # $DAML_PBT_DAR, else the newest .daml/dist/*.dar of the Daml project
+    # `start` (a file or directory, default the cwd) is in: looked for from
+    # `start` up to the nearest directory with a daml.yaml, never above it.
+    if os.environ.get("DAML_PBT_DAR"):
+        return os.environ["DAML_PBT_DAR"]
+    d = os.path.abspath(start or os.getcwd())
+    if os.path.isfile(d):
+        d = os.path.dirname(d)
+    while True:
+        dars = glob.glob(os.path.join(d, ".daml", "dist", "*.dar"))
+        if dars:
+            return max(dars, key=os.path.getmtime)
+        if os.path.isfile(os.path.join(d, "daml.yaml")):
+            raise FileNotFoundError(f"no .daml/dist/*.dar in the Daml project {d}; run `daml build` there")
+        parent = os.path.dirname(d)
+        if parent == d:
+            raise FileNotFoundError(f"no daml.yaml or .daml/dist/*.dar above {start or os.getcwd()}")
+        d = parent
+
+def package_id(start: str | None = None) -> str:
+    # PKG = package_id(__file__)
+    return read_dar(find_dar(start))["package_id"]
+
+def template_id(name: str, start: str | None = None) -> str:
+    # "Module:Entity" (or just "Entity" when unambiguous) -> "<pkg>:Module:Entity"
+    info = read_dar(find_dar(start))
+    matches = [t for t in info["templates"] if t == name or t.split(":", 1)[1] == name]
+    if len(matches) != 1:
+        raise KeyError(f"template {name!r} {'is ambiguous' if matches else 'not found'} in "
+                       f"{info['name']}; templates: {sorted(info['templates'])}")
+    return f"{info['package_id']}:{matches[0]}"
+
+def check_package(pkg: str) -> None:
+    # Raise StalePackageError if a ledger the tests run on (every endpoint of
+    # the pool) does not have `pkg`; see DamlClient.check_package.
+    for client in (_ledger_pool.clients if _ledger_pool is not None else [_global_client()]):
+        client.check_package(pkg)
+
+# Pure-Python projections of nonconsuming getter choices, keyed by
+# ("Module:Entity", choice). A projection takes (payload, argument) and must
+# return the choice result in JSON API encoding.
+_views: dict[tuple[str, str], object] = {}
+
+def register_view(template_id: str, choice: str, projection) -> None:
+    _views[(_template_key(template_id), choice)] = projection
+
+def view(template_id: str, choice: str):
+    def deco(fn):
+        register_view(template_id, choice, fn)
+        return fn
+    return deco
+
+# Client-side pre-validation of create/exercise commands, opt-in: the
+# schema from the DAR (types, Numeric scale, record fields, enum
+# constructors) and declared preconditions mirroring simple `ensure`/
+# `assertMsg` checks, keyed by ("Module:Entity", choice), choice None for the
+# template's `ensure`. Where it is on, a command bound to fail never reaches
+# the ledger: inside a Hypothesis example the example is rejected, elsewhere
+# PreconditionFailed/CommandRejected is raised locally. That also means the
+# ledger's own rejection goes untested, and a wrong precondition hides what
+# the ledger would do, so it is off unless a test asks for it with
+# prevalidated(), a client with `client.prevalidate = True`, or the whole run
+# with use_prevalidation(True) (`pytest --daml-prevalidate`). Tests asserting
+# that the ledger refuses a command opt out again with expect_rejection().
+_preconditions: dict[tuple[str, str | None], list] = defaultdict(list)
+_prevalidation = False
+
+def use_prevalidation(on: bool) -> bool:
+    # Pre-validate every client's commands (see above) unless a test or
+    # client says otherwise; returns the previous setting.
+    global _prevalidation
+    prev, _prevalidation = _prevalidation, on
+    return prev
+
+def register_precondition(template_id: str, choice: str | None, check, message: str | None = None) -> None:
+    # check(payload) for a template, check(payload, argument) for a choice
+    # (payload None when the contract was not created through this client);
+    # a falsy result means the ledger would reject the command with `message`.
+    _preconditions[(_template_key(template_id), choice)].append((check, message or check.__name__))
+
+def precondition(template_id: str, choice: str | None = None, message: str | None = None):
+    def deco(fn):
+        register_precondition(template_id, choice, fn, message)
+        return fn
+    return deco
+
+@contextlib.contextmanager
+def _prevalidating(on: bool):
+    prev = getattr(_scope, "prevalidate", None)
+    _scope.prevalidate = on
+    try:
+        yield
+    finally:
+        _scope.prevalidate = prev
+
+def prevalidated():
+    # `with prevalidated():` or `@prevalidated()`: drop commands that
+    # pre-validation says the ledger will refuse, instead of sending them
+    return _prevalidating(True)
+
+def expect_rejection():
+    # `with expect_rejection():` or `@expect_rejection()`: send commands to
+    # the ledger even when pre-validation says they will be refused
+    return _prevalidating(False)
+
+def _doomed(error: LedgerError):
+    if currently_in_test_context():
+        reject()
+    if getattr(_scope, "example", False):  # a StepGraph/parallel_given worker of an example
+        raise UnsatisfiedAssumption(str(error))
+    raise error
+
+def _prevalidate(context: str, template_id: str, payload, choice=None, argument=None, existing: bool = False) -> None:
+    # payload: of the contract being created, or with existing=True of the
+    # contract the choice is exercised on (None if unknown)
+    key = _template_key(template_id)
+    schema = schema_for(template_id)
+    try:
+        if schema is not None and not existing:
+            schema.checker(schema.payload_type(template_id))(payload)
+        if schema is not None and choice is not None:
+            schema.checker(schema.argument_type(template_id, choice))(argument or {})
+    except (SchemaMismatch, KeyError) as e:
+        _doomed(CommandRejected(f"{context} (pre-validation)", 0, str(e)))
+    checks = []
+    if not existing:
+        checks += [(fn, msg, (payload,)) for fn, msg in _preconditions.get((key, None), ())]
+    if choice is not None:
+        checks += [(fn, msg, (payload, argument or {})) for fn, msg in _preconditions.get((key, choice), ())]
+    for fn, msg, args in checks:
+        if not fn(*args):
+            _doomed(PreconditionFailed(f"{context} (pre-validation)", 0, msg))
+
+# Ledger time per JSON API path in this process: path -> [calls, seconds].
+# Written out per xdist worker and merged by the pytest plugin.
+_timings: dict[str, list] = defaultdict(lambda: [0, 0.0])
+_timings_lock = threading.Lock()
+
+def _record_timing(path: str, seconds: float) -> None:
+    with _timings_lock:
+        t = _timings[path]
+        t[0] += 1
+        t[1] += seconds
+
+def timing_report() -> dict:
+    with _timings_lock:
+        return {path: {"calls": n, "seconds": s} for path, (n, s) in _timings.items()}
+
+class LedgerSlots:
+    # Cross-process cap on in-flight requests to one ledger: `limit` lock files
+    # in a directory keyed by the ledger URL, one held (flock) per request.
+    # Every process and thread pointing at the same ledger shares the cap, so
+    # xdist workers queue here instead of piling onto a saturated sandbox.
+    def __init__(self, base: str, limit: int, directory: str | None = None, poll: float = 0.002):
+        if fcntl is None:
+            raise RuntimeError("LedgerSlots needs fcntl (POSIX only)")
+        key = hashlib.sha256(base.encode()).hexdigest()[:12]
+        self.dir = os.path.join(directory or tempfile.gettempdir(), f"daml-pbt-slots-{key}")
+        os.makedirs(self.dir, exist_ok=True)
+        self.limit = limit
+        self.poll = poll
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def _try(self) -> int | None:
+        for i in range(self.limit):
+            fd = os.open(os.path.join(self.dir, str(i)), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    @contextlib.contextmanager
+    def held(self):
+        t0 = time.perf_counter()
+        while (fd := self._try()) is None:
+            time.sleep(self.poll)
+        with self._lock:
+            self.waited += time.perf_counter() - t0
+        try:
+            yield
+        finally:
+            os.close(fd)  # closing the descriptor drops the flock
+
+class AimdLimiter:
+    # Adaptive cap on requests in flight to one ledger. Every success adds
+    # 1/limit (about +1 per round trip at full load); overload (429/503,
+    # connection errors) or latency beyond `tolerance` x the best recently seen
+    # for that endpoint cuts the limit by `backoff`, at most once per round
+    # trip so one burst of slow replies counts as one signal.
+    def __init__(self, initial: int = 16, min_limit: int = 1, max_limit: int = 256,
+                 backoff: float = 0.7, tolerance: float = 2.5):
+        self.limit = float(initial)
+        self.min_limit, self.max_limit = min_limit, max_limit
+        self.backoff, self.tolerance = backoff, tolerance
+        self.inflight = 0
+        self.min_latency: dict[str, float] = {}
+        self.drops = 0
+        self._last_drop = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._cond:
+            self._cond.wait_for(lambda: self.inflight < int(self.limit))
+            self.inflight += 1
+
+    def release(self, path: str, latency: float, overloaded: bool) -> None:
+        with self._cond:
+            self.inflight -= 1
+            now = time.monotonic()
+            # baseline creeps up slowly so a ledger that got slower for good
+            # does not keep the limit pinned at the floor
+            best = self.min_latency.get(path)
+            if not overloaded:  # a fast 503 says nothing about the healthy latency
+                best = self.min_latency[path] = latency if best is None else min(latency, best * 1.01)
+            if overloaded or (best is not None and latency > self.tolerance * best):
+                if now - self._last_drop > latency:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self.drops += 1
+                    self._last_drop = now
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+class TokenBucket:
+    # At most `rate` requests/second on average, bursts of up to `burst`.
+    def __init__(self, rate: float, burst: int | None = None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.tokens = float(self.burst)
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self._stamp) * self.rate)
+                self._stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_s = (1 - self.tokens) / self.rate
+            time.sleep(wait_s)
+
+# Only these are retried: the ledger or JSON API refused the request before
+# doing anything with it. Business rejections (400/404/409, 500 with a Daml
+# error) are never retried.
+TRANSIENT_STATUS = frozenset({429, 503})
+# Requests that are safe to repeat even if the first attempt may have reached the ledger.
+_IDEMPOTENT_PATHS = frozenset({"/fetch", "/query", "/packages"})
+
+def _not_sent(e: requests.RequestException) -> bool:
+    # True when the request never reached the server (refused, DNS, connect timeout).
+    if isinstance(e, requests.ConnectTimeout):
+        return True
+    reason = e.args[0] if e.args else None
+    return isinstance(reason, MaxRetryError) and isinstance(reason.reason, NewConnectionError)
+
+class RetryPolicy:
+    # Bounded retries with full jitter for transient failures. Commands are
+    # only retried when they provably did not reach the ledger (or got a
+    # 429/503), so a retry never submits the same command twice.
+    def __init__(self, attempts: int = 5, base_delay: float = 0.05, max_delay: float = 2.0):
+        self.attempts, self.base_delay, self.max_delay = attempts, base_delay, max_delay
+        self.retries = 0
+        self._lock = threading.Lock()  # one policy serves every thread of its client
+
+    def retryable(self, path: str, attempt: int, response: requests.Response | None = None,
+                  error: requests.RequestException | None = None) -> bool:
+        if attempt + 1 >= self.attempts:
+            return False
+        if error is not None:
+            return path in _IDEMPOTENT_PATHS or _not_sent(error)
+        return response is not None and response.status_code in TRANSIENT_STATUS
+
+    def delay(self, attempt: int, response: requests.Response | None = None) -> float:
+        after = response.headers.get("Retry-After") if response is not None else None
+        if after and after.isdigit():
+            return min(float(after), self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def retried(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+# (limit, directory) applied to every DamlClient created afterwards; see set_max_inflight
+_inflight: tuple[int, str | None] = (0, None)
+
+def set_max_inflight(limit: int, directory: str | None = None) -> None:
+    # Share at most `limit` concurrent requests per ledger across all local
+    # processes (0 turns the cap off). Also applies to the default client.
+    global _inflight
+    _inflight = (limit, directory)
+    live = {id(c): c for c in ([_default_client] + (_ledger_pool.clients if _ledger_pool else [])) if c is not None}
+    for c in live.values():
+        c.slots = LedgerSlots(c.base, limit, directory) if limit else None
+
+# cassette every DamlClient records to or replays from; see daml_pbt.cassette
+_cassette: "Cassette | None" = None
+# where failing examples are written as Daml Script; see daml_pbt.script
+_scripts: "ScriptExporter | None" = None
+# models failing parallel_given and plain @given tests are shrunk on first; see daml_pbt.shrink
+_shrink_models: "Registry | None" = None
+
+def use_cassette(cassette: "Cassette | None") -> "Cassette | None":
+    # Record all ledger traffic to / serve it from `cassette` (None turns it off).
+    global _cassette
+    prev, _cassette = _cassette, cassette
+    return prev
+
+def use_script_exporter(exporter: "ScriptExporter | None") -> "ScriptExporter | None":
+    # Log every example's commands for `exporter` (None turns it off).
+    global _scripts
+    prev, _scripts = _scripts, exporter
+    return prev
+
+def use_model_shrinking(registry: "Registry | None") -> "Registry | None":
+    # Shrink failures on the models in `registry` before the ledger (None turns it off).
+    global _shrink_models
+    prev, _shrink_models = _shrink_models, registry
+    return prev
+
+class DamlClient:
+    # Keep-alive HTTP client for the JSON API. Each thread gets its own
+    # requests.Session (Session objects are not thread-safe); every session
+    # keeps up to `pool_size` connections open to `base`. `adapter` replaces
+    # the HTTP transport (FakeLedger.adapter() for an in-process ledger).
+    def __init__(self, base: str = BASE, pool_size: int = 10, timeout: float | None = None,
+                 rate: float | None = None, retry: RetryPolicy | None = None, adapter=None):
+        self.base = base
+        self.adapter = adapter
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sessions: list[requests.Session] = []
+        self._closed = False
+        self._own: dict[str, dict[str, dict]] = {}
+        self._own_tid: dict[str, str] = {}
+        self.last_offset: str | None = None
+        self.mirror: "AcsMirror | None" = None
+        self.check_views = False
+        self._payloads: OrderedDict[str, dict] = OrderedDict()
+        limit, directory = _inflight
+        self.slots = LedgerSlots(base, limit, directory) if limit else None
+        # load signals for LedgerPool: requests in flight, smoothed latency (s)
+        self.inflight = 0
+        self.latency: float | None = None
+        self._stats_lock = threading.Lock()
+        # backpressure: adaptive in-flight cap, optional rate limit, transient retries
+        self.limiter = AimdLimiter()
+        self.bucket = TokenBucket(rate) if rate else None
+        self.retry = retry or RetryPolicy()
+        # package id -> uploaded?, filled lazily from GET /packages
+        self.check_packages = True
+        # check commands against the schema and declared preconditions first:
+        # None as the test (prevalidated/expect_rejection) or use_prevalidation says
+        self.prevalidate: bool | None = None
+        self._packages: dict[str, bool] = {}
+
+    def _session(self) -> requests.Session:
+        s = getattr(self._local, "session", None)
+        if s is None:
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError("DamlClient is closed")
+                s = requests.Session()
+                adapter = self.adapter or HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                s.trust_env = self.adapter is None  # proxies and .netrc mean nothing in-process
+                s.mount("http://", adapter)
+                s.mount("https://", adapter)
+                self._sessions.append(s)
+            self._local.session = s
+        return s
+
+    def post(self, path: str, body: dict, headers: dict) -> requests.Response:
+        cassette = _cassette
+        if cassette is not None and cassette.replaying:
+            r = cassette.replay(path, body, headers)
+        else:
+            r = self._post(path, body, headers)
+            if cassette is not None:
+                cassette.record(path, body, headers, r)
+        if _scripts is not None:
+            _scripts.note(path, body, headers, r)
+        return r
+
+    def _post(self, path: str, body: dict, headers: dict) -> requests.Response:
+        attempt = 0
+        while True:
+            try:
+                r = self._send(path, body, headers)
+            except requests.RequestException as e:
+                if not self.retry.retryable(path, attempt, error=e):
+                    raise TransientError(path, 0, f"{type(e).__name__}: {e}") from e
+                r = None
+            else:
+                if not self.retry.retryable(path, attempt, response=r):
+                    return r
+            self.retry.retried()
+            time.sleep(self.retry.delay(attempt, r))
+            attempt += 1
+
+    def _send(self, path: str, body: dict, headers: dict) -> requests.Response:
+        if self.bucket is not None:
+            self.bucket.take()
+        self.limiter.acquire()
+        dt, overloaded = 0.0, True
+        try:
+            with self.slots.held() if self.slots else contextlib.nullcontext():
+                with self._stats_lock:
+                    self.inflight += 1
+                t0 = time.perf_counter()
+                try:
+                    r = self._session().post(f"{self.base}{path}", json=body, headers=headers, timeout=self.timeout)
+                    overloaded = r.status_code in TRANSIENT_STATUS
+                    return r
+                finally:
+                    dt = time.perf_counter() - t0
+                    _record_timing(path, dt)
+                    with self._stats_lock:
+                        self.inflight -= 1
+                        self.latency = dt if self.latency is None else 0.8 * self.latency + 0.2 * dt
+        finally:
+            self.limiter.release(path, dt, overloaded)
+
+    def packages(self) -> list[str]:
+        r = self._session().get(f"{self.base}/packages", headers=make_admin_auth(), timeout=self.timeout)
+        return ensure_ok(r, "/packages")
+
+    def _check_package(self, template_id: str | None) -> None:
+        # Fail fast on a package the ledger does not have, instead of a 400 per example.
+        if template_id and template_id.count(":") == 2:
+            self.check_package(template_id.split(":", 1)[0])
+
+    def check_package(self, pkg: str) -> None:
+        # Raise StalePackageError unless GET /packages lists `pkg`. Skipped
+        # where the ledger does not say (listing refused or unsupported, as on
+        # a FakeLedger without a DAR) and while a cassette replays.
+        if not self.check_packages or (_cassette is not None and _cassette.replaying):
+            return
+        known = self._packages.get(pkg)
+        if known is None:
+            try:
+                uploaded = set(self.packages())
+            except (LedgerError, requests.RequestException):
+                self.check_packages = False  # listing not allowed/supported here: skip the check
+                return
+            known = self._packages[pkg] = pkg in uploaded
+        if not known:
+            try:
+                built = package_id()
+                hint = f"; {find_dar()} has {built}" if built != pkg else "; upload the DAR"
+            except FileNotFoundError:
+                hint = ""
+            raise StalePackageError("/packages", 0, f"package {pkg} is not on {self.base}{hint}")
+
+    def _prevalidates(self) -> bool:
+        scoped = getattr(_scope, "prevalidate", None)
+        if scoped is not None:
+            return scoped
+        return _prevalidation if self.prevalidate is None else self.prevalidate
+
+    def make_request(
+        self,
+        op: str,
+        *,
+        act_as=None,
+        read_as=None,
+        template_id=None,
+        payload=None,
+        contract_id=None,
+        choice=None,
+        argument=None,
+        template_ids=None,
+        query=None,
+    ) -> dict:
+        self._check_package(template_id)
+        for tid in template_ids or ():
+            self._check_package(tid)
+        if op in ("create", "exercise", "create_and_exercise") and self._prevalidates():
+            if op == "exercise":
+                with self._lock:
+                    current = self._own.get(_template_key(template_id), {}).get(contract_id)
+                _prevalidate("/exercise", template_id, current, choice, argument, existing=True)
+            else:
+                _prevalidate(f"/{op.replace('_', '-')}", template_id, payload, choice if op != "create" else None, argument)
+        headers = make_auth(act_as, read_as)
+        if op == "create":
+            body = {"templateId": template_id, "payload": payload}
+            res = ensure_ok(self.post("/create", body, headers), "/create")
+            self._note_offset(res)
+            self._index_created(res, template_id)
+            return res
+        elif op == "exercise":
+            body = {"templateId": template_id, "contractId": contract_id, "choice": choice, "argument": argument or {}}
+            res = ensure_ok(self.post("/exercise", body, headers), "/exercise")
+            self._note_offset(res)
+            self._index_events(res)
+            return res
+        elif op == "create_and_exercise":
+            body = {"templateId": template_id, "payload": payload, "choice": choice, "argument": argument or {}}
+            res = ensure_ok(self.post("/create-and-exercise", body, headers), "/create-and-exercise")
+            self._note_offset(res)
+            self._index_events(res)
+            return res
+        elif op == "fetch":
+            body = {"templateId": template_id, "contractId": contract_id}
+            return ensure_ok(self.post("/fetch", body, headers), "/fetch")
+        elif op == "query":
+            body = {"templateIds": template_ids or [], "query": query or {}}
+            return ensure_ok(self.post("/query", body, headers), "/query")
+        else:
+            raise ValueError(f"Unsupported op '{op}'")
+
+    # Index of the active contracts this client created, per template:
+    # {"Module:Entity": {contractId: payload}}. Fed from create results and
+    # exercise events, so it never needs a ledger scan.
+    def _note_offset(self, res: dict) -> None:
+        off = res.get("completionOffset")
+        if off:
+            with self._lock:
+                if self.last_offset is None or off > self.last_offset:
+                    self.last_offset = off
+
+    def _index_created(self, res: dict, template_id: str | None = None) -> None:
+        key = _template_key(res.get("templateId") or template_id)
+        with self._lock:
+            self._own.setdefault(key, {})[res["contractId"]] = res.get("payload")
+            self._own_tid[res["contractId"]] = res.get("templateId") or template_id
+
+    def _index_events(self, res: dict) -> None:
+        for e in res.get("events") or []:
+            if "created" in e:
+                self._index_created(e["created"])
+            elif "archived" in e:
+                a = e["archived"]
+                with self._lock:
+                    self._own.get(_template_key(a.get("templateId")), {}).pop(a["contractId"], None)
+                    self._own_tid.pop(a["contractId"], None)
+
+    def own_contracts(self, template_id: str) -> dict[str, dict]:
+        with self._lock:
+            return dict(self._own.get(_template_key(template_id), {}))
+
+    def lookup(self, contract_id: str, template_id: str | None = None, *, reader=None, act_as=None) -> dict | None:
+        # One contract by id via /v1/fetch; the template may be omitted for
+        # contracts this client created. None if not visible to the reader.
+        if template_id is None:
+            with self._lock:
+                template_id = self._own_tid.get(contract_id)
+            if template_id is None:
+                raise ValueError(f"template of {contract_id} unknown; pass template_id")
+        if self.mirror is not None:
+            found, c = self.mirror.lookup(contract_id, template_id, _parties(reader) + _parties(act_as), self.last_offset)
+            if found:
+                return c
+        return self.make_request("fetch", act_as=act_as, read_as=reader, template_id=template_id, contract_id=contract_id)
+
+    def search(self, template_id: str, query: dict | None = None, *, reader=None, act_as=None) -> list[dict]:
+        # Contracts of one template matching `query`, filtered by the JSON API
+        # query language on the server instead of scanning the ACS here.
+        return self.make_request("query", act_as=act_as, read_as=reader, template_ids=[template_id], query=query)
+
+    def _payload_of(self, contract_id: str, template_id: str, reader) -> dict:
+        # Contracts are immutable, so a payload read once is valid for the
+        # lifetime of the contract id.
+        with self._lock:
+            p = self._own.get(_template_key(template_id), {}).get(contract_id)
+            if p is None:
+                p = self._payloads.get(contract_id)
+        if p is None:
+            c = self.lookup(contract_id, template_id, act_as=reader)
+            if c is None:
+                raise AssertionError(f"{contract_id} not visible to {reader}")
+            p = c["payload"]
+            with self._lock:
+                self._payloads[contract_id] = p
+                if len(self._payloads) > 4096:
+                    self._payloads.popitem(last=False)
+        return p
+
+    def exercise_view(self, act_as, template_id: str, contract_id: str, choice: str, argument=None,
+                      check: bool | None = None):
+        # Answer a nonconsuming getter choice with its registered projection
+        # over the payload instead of submitting a transaction. Projections do
+        # not check authorization; with check=True (or client.check_views) the
+        # real choice is exercised too and the results must agree.
+        proj = _views.get((_template_key(template_id), choice))
+        if proj is None:
+            raise KeyError(f"no view registered for {_template_key(template_id)} {choice}")
+        result = proj(self._payload_of(contract_id, template_id, act_as), argument or {})
+        if self.check_views if check is None else check:
+            real = self.make_request("exercise", act_as=act_as, template_id=template_id, contract_id=contract_id,
+                                     choice=choice, argument=argument)["exerciseResult"]
+            if real != result:
+                raise AssertionError(f"view {choice} on {contract_id} returned {result!r}, ledger returned {real!r}")
+        return result
+
+    def batch(self) -> "CommandBatch":
+        return CommandBatch(self)
+
+    def allocate_party(self, identifier_hint: str, display_name: str | None = None, is_local: bool = True) -> str:
+        body = {"identifierHint": identifier_hint, "displayName": display_name or identifier_hint, "isLocal": is_local}
+        return _party_of(ensure_ok(self.post("/parties/allocate", body, make_admin_auth()), "/parties/allocate"))
+
+    def upload_dar(self, path: str) -> None:
+        with open(path, "rb") as f:
+            dar = f.read()
+        headers = {**make_admin_auth(), "Content-Type": "application/octet-stream"}
+        r = self._session().post(f"{self.base}/packages", data=dar, headers=headers, timeout=self.timeout)
+        ensure_ok(r, "/packages")
+
+    def allocate_unique_party(self, prefix: str = "Operator") -> str:
+        ns = f"{PARTY_NAMESPACE}-" if PARTY_NAMESPACE else ""
+        hint = f"{prefix}-{ns}{uuid.uuid4().hex[:12]}"
+        return self.allocate_party(hint, display_name=hint)
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            sessions, self._sessions = self._sessions, []
+        for s in sessions:
+            s.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _websocket():
+    try:
+        import websocket
+    except ImportError as e:
+        raise ImportError("AcsMirror needs the websocket-client package (pip install websocket-client)") from e
+    return websocket
+
+class AcsMirror:
+    # Local copy of the active contracts of `template_ids` visible to
+    # `parties`, fed by the JSON API /v1/stream/query websocket on a
+    # background thread and indexed by contract id and by stakeholder.
+    # Attached to a DamlClient, lookup() is answered from the mirror once it
+    # has caught up to the completion offset of the client's last command.
+    # Needs the optional websocket-client package.
+    def __init__(self, template_ids: list[str], parties=(), client: DamlClient | None = None,
+                 catch_up_timeout: float = 5.0):
+        self.template_ids = list(template_ids)
+        self.parties: tuple = _parties(parties)
+        self.client = client or default_client()
+        self.catch_up_timeout = catch_up_timeout
+        self.offset: str | None = None
+        self.by_cid: dict[str, dict] = {}
+        self.by_party: dict[str, set[str]] = defaultdict(set)
+        self.errors: list = []
+        self._keys = {_template_key(t) for t in self.template_ids}
+        self._cond = threading.Condition()
+        self._ws = None
+        self._closed = False
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        base = self.client.base
+        return ("wss" + base[5:] if base.startswith("https") else "ws" + base[4:]) + "/stream/query"
+
+    def start(self) -> "AcsMirror":
+        _websocket()  # fail here, not in the reader thread, if it is missing
+        self.client.mirror = self
+        if self.parties:
+            self._restart()
+        return self
+
+    def watch(self, *parties: str) -> None:
+        # Adding parties re-subscribes from a fresh ACS snapshot, so contracts
+        # they could already see are not missed.
+        new = tuple(p for p in parties if p not in self.parties)
+        if new:
+            self.parties += new
+            self._restart()
+
+    def _restart(self) -> None:
+        with self._cond:
+            ws, self._ws = self._ws, None
+            self.offset = None
+        if ws is not None:
+            ws.close()  # wakes the old reader thread, which then exits
+        self._thread = threading.Thread(target=self._run, args=(self.parties,), daemon=True, name="daml-pbt-acs")
+        self._thread.start()
+
+    def _run(self, parties: tuple) -> None:
+        tok = _token_cache.token(read_as=parties)
+        try:
+            ws = _websocket().create_connection(self.url, subprotocols=[f"jwt.token.{tok}", "daml.ws.auth"])
+        except Exception as e:
+            with self._cond:
+                self.errors.append(e)
+                self._cond.notify_all()
+            return
+        with self._cond:
+            if self._closed or parties != self.parties:
+                ws.close()
+                return
+            self._ws = ws
+            self.by_cid.clear()
+            self.by_party.clear()
+        ws.send(json.dumps([{"templateIds": self.template_ids}]))
+        while True:
+            try:
+                msg = json.loads(ws.recv())
+            except Exception as e:
+                with self._cond:
+                    if self._ws is ws and not self._closed:
+                        self.errors.append(e)
+                        self._ws = None
+                    self._cond.notify_all()
+                return
+            if self._ws is not ws:
+                return
+            self.apply(msg)
+
+    def apply(self, msg: dict) -> None:
+        with self._cond:
+            for e in msg.get("events") or []:
+                if "created" in e:
+                    c = e["created"]
+                    self.by_cid[c["contractId"]] = c
+                    for p in c.get("signatories", []) + c.get("observers", []):
+                        self.by_party[p].add(c["contractId"])
+                elif "archived" in e:
+                    c = self.by_cid.pop(e["archived"]["contractId"], None)
+                    for p in (c or {}).get("signatories", []) + (c or {}).get("observers", []):
+                        self.by_party[p].discard(e["archived"]["contractId"])
+            if "errors" in msg:
+                self.errors.append(msg["errors"])
+            if msg.get("offset"):
+                self.offset = msg["offset"]
+            self._cond.notify_all()
+
+    def _streaming(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def caught_up(self, offset: str | None) -> bool:
+        return self.offset is not None and (offset is None or self.offset >= offset)
+
+    def wait_for(self, offset: str | None, timeout: float | None = None) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self.caught_up(offset) or not self._streaming(),
+                                       self.catch_up_timeout if timeout is None else timeout) and self.caught_up(offset)
+
+    def lookup(self, contract_id: str, template_id: str, readers: tuple, offset: str | None) -> tuple[bool, dict | None]:
+        # (True, contract or None) if the mirror can answer for these readers,
+        # (False, None) if the caller has to go to the ledger.
+        if _template_key(template_id) not in self._keys or not readers or not set(readers) <= set(self.parties):
+            return False, None
+        if not self.wait_for(offset):
+            return False, None
+        with self._cond:
+            c = self.by_cid.get(contract_id)
+            if c is None or not any(contract_id in self.by_party.get(r, ()) for r in readers):
+                return True, None
+            return True, c
+
+    def contracts_of(self, party: str) -> list[dict]:
+        with self._cond:
+            return [self.by_cid[cid] for cid in self.by_party.get(party, ())]
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            ws, self._ws = self._ws, None
+            self._cond.notify_all()
+        if ws is not None:
+            ws.close()
+        if self.client.mirror is self:
+            self.client.mirror = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+class CommandBatch:
+    # A create followed by a chain of exercises, each on the contract id
+    # returned by the previous step (as consuming choices do). When the same
+    # parties create and exercise, the create and the first exercise go out
+    # as one /v1/create-and-exercise submission. Otherwise they are two
+    # submissions: one acting as both parties would lend the exerciser the
+    # creator's authority, and pass where separate commands are rejected.
+    # Later exercises are submitted one by one.
+    #
+    #   cid = client.batch().create(owner, AT_TID, payload) \
+    #                       .exercise(buyer, "MakeOffer", {...}).submit()["exerciseResult"]
+    def __init__(self, client: DamlClient):
+        self.client = client
+        self.steps: list[dict] = []
+
+    def create(self, act_as, template_id, payload) -> "CommandBatch":
+        if self.steps:
+            raise ValueError("create must be the first command of a batch")
+        self.steps.append({"act_as": act_as, "template_id": template_id, "payload": payload})
+        return self
+
+    def exercise(self, act_as, choice, argument=None, template_id=None) -> "CommandBatch":
+        if not self.steps:
+            raise ValueError("a batch must start with create")
+        tid = template_id or self.steps[-1]["template_id"]
+        self.steps.append({"act_as": act_as, "template_id": tid, "choice": choice, "argument": argument})
+        return self
+
+    def submit(self) -> dict:
+        if not self.steps:
+            raise ValueError("empty batch")
+        first, rest = self.steps[0], self.steps[1:]
+        if not rest:
+            return self.client.make_request("create", act_as=first["act_as"], template_id=first["template_id"],
+                                            payload=first["payload"])
+        ex, rest = rest[0], rest[1:]
+        if set(_parties(first["act_as"])) == set(_parties(ex["act_as"])):
+            res = self.client.make_request("create_and_exercise", act_as=first["act_as"],
+                                           template_id=first["template_id"], payload=first["payload"],
+                                           choice=ex["choice"], argument=ex["argument"])
+        else:
+            cid = self.client.make_request("create", act_as=first["act_as"], template_id=first["template_id"],
+                                           payload=first["payload"])["contractId"]
+            res = self.client.make_request("exercise", act_as=ex["act_as"], template_id=ex["template_id"],
+                                           contract_id=cid, choice=ex["choice"], argument=ex["argument"])
+        for ex in rest:
+            res = self.client.make_request("exercise", act_as=ex["act_as"], template_id=ex["template_id"],
+                                           contract_id=res["exerciseResult"], choice=ex["choice"], argument=ex["argument"])
+        return res
+
+class ContractHandle:
+    # Follows one contract through consuming choices. The payload is taken
+    # from the create result and from the `created` events of each exercise
+    # response, so reading it back needs no extra round-trip. With
+    # verify=True every read is also fetched from the ledger and compared.
+    def __init__(self, template_id: str, contract_id: str, payload: dict | None = None,
+                 reader=None, client: DamlClient | None = None, verify: bool = False):
+        self.template_id = template_id
+        self.contract_id = contract_id
+        self.reader = reader
+        self.client = client or default_client()
+        self.verify = verify
+        self.archived = False
+        self._payload = payload
+
+    @classmethod
+    def create(cls, act_as, template_id: str, payload: dict, client: DamlClient | None = None,
+               verify: bool = False) -> "ContractHandle":
+        client = client or default_client()
+        res = client.make_request("create", act_as=act_as, template_id=template_id, payload=payload)
+        return cls(template_id, res["contractId"], res.get("payload"), act_as, client, verify)
+
+    def exercise(self, act_as, choice: str, argument=None):
+        if self.archived:
+            raise ContractNotFound(f"/exercise {choice}", 0, f"{self.contract_id} was archived")
+        res = self.client.make_request("exercise", act_as=act_as, template_id=self.template_id,
+                                       contract_id=self.contract_id, choice=choice, argument=argument)
+        self._follow(res)
+        return res["exerciseResult"]
+
+    def _follow(self, res: dict) -> None:
+        events = res.get("events") or []
+        if not any(e.get("archived", {}).get("contractId") == self.contract_id for e in events):
+            return  # nonconsuming
+        same = [e["created"] for e in events
+                if "created" in e and _template_key(e["created"].get("templateId")) == _template_key(self.template_id)]
+        nxt = [c for c in same if c["contractId"] == res.get("exerciseResult")] or same
+        if len(nxt) == 1:
+            self.contract_id, self._payload = nxt[0]["contractId"], nxt[0].get("payload")
+        else:
+            self.archived, self._payload = True, None
+
+    @property
+    def cid(self) -> str:
+        return self.contract_id
+
+    def payload(self, reader=None) -> dict:
+        if self.archived:
+            raise ContractNotFound("/fetch", 0, f"{self.contract_id} was archived")
+        if self._payload is not None and not self.verify:
+            return self._payload
+        res = self.client.make_request("fetch", act_as=reader or self.reader, template_id=self.template_id,
+                                       contract_id=self.contract_id)
+        if res is None:
+            raise AssertionError(f"{self.contract_id} not visible to {reader or self.reader}")
+        if self._payload is not None and res["payload"] != self._payload:
+            raise AssertionError(f"cached payload of {self.contract_id} differs from ledger: "
+                                 f"{self._payload} != {res['payload']}")
+        self._payload = res["payload"]
+        return self._payload
+
+class AsyncDamlClient:
+    # asyncio front-end over a DamlClient so independent ledger calls can be
+    # awaited together with asyncio.gather. Calls run on a private thread pool
+    # of `max_concurrency` workers, which bounds the requests in flight.
+    def __init__(self, client: DamlClient | None = None, max_concurrency: int = 8):
+        self.client = client or default_client()
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="daml-pbt")
+
+    async def _call(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    async def make_request(self, op: str, **kwargs) -> dict:
+        return await self._call(self.client.make_request, op, **kwargs)
+
+    async def create(self, act_as, template_id, payload) -> dict:
+        return await self.make_request("create", act_as=act_as, template_id=template_id, payload=payload)
+
+    async def exercise(self, act_as, template_id, contract_id, choice, argument=None) -> dict:
+        return await self.make_request("exercise", act_as=act_as, template_id=template_id,
+                                       contract_id=contract_id, choice=choice, argument=argument)
+
+    async def create_and_exercise(self, act_as, template_id, payload, choice, argument=None) -> dict:
+        return await self.make_request("create_and_exercise", act_as=act_as, template_id=template_id,
+                                       payload=payload, choice=choice, argument=argument)
+
+    async def fetch(self, act_as, template_id, contract_id) -> dict:
+        return await self.make_request("fetch", act_as=act_as, template_id=template_id, contract_id=contract_id)
+
+    async def query(self, template_ids, query=None, act_as=None, read_as=None) -> list:
+        return await self.make_request("query", act_as=act_as, read_as=read_as, template_ids=template_ids, query=query)
+
+    async def allocate_party(self, identifier_hint: str, display_name: str | None = None, is_local: bool = True) -> str:
+        return await self._call(self.client.allocate_party, identifier_hint, display_name, is_local)
+
+    async def allocate_unique_party(self, prefix: str = "Operator") -> str:
+        return await self._call(self.client.allocate_unique_party, prefix)
+
+    async def allocate_unique_parties(self, *prefixes: str) -> list[str]:
+        return list(await asyncio.gather(*(self.allocate_unique_party(p) for p in prefixes)))
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+class PartyPool:
+    # Keeps up to `high_water` freshly allocated parties ready per prefix,
+    # refilled concurrently in the background. Every party is handed out at
+    # most once, so examples stay isolated; only allocation latency moves off
+    # the test's critical path. A take() on an empty prefix is a starvation:
+    # it waits for an in-flight allocation, or allocates inline if none.
+    def __init__(self, client: DamlClient | None = None, high_water: int = 8, workers: int = 4):
+        self.client = client or default_client()
+        self.high_water = high_water
+        self._ready: dict[str, deque] = defaultdict(deque)
+        self._pending: dict[str, int] = defaultdict(int)
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="daml-pbt-parties")
+        self._closed = False
+        self.served = 0
+        self.starved = 0
+        self.starved_wait = 0.0
+        self.errors = 0
+        self.last_error: Exception | None = None
+
+    def warm(self, *prefixes: str) -> None:
+        with self._cond:
+            for p in prefixes:
+                self._refill(p)
+
+    def _refill(self, prefix: str) -> None:
+        # caller holds self._cond
+        if self._closed:
+            return
+        need = self.high_water - len(self._ready[prefix]) - self._pending[prefix]
+        for _ in range(max(need, 0)):
+            self._pending[prefix] += 1
+            self._executor.submit(self._allocate, prefix)
+
+    def _allocate(self, prefix: str) -> None:
+        try:
+            party = self.client.allocate_unique_party(prefix)
+        except Exception as e:
+            with self._cond:
+                self._pending[prefix] -= 1
+                self.errors += 1
+                self.last_error = e
+                self._cond.notify_all()
+            return
+        with self._cond:
+            self._pending[prefix] -= 1
+            self._ready[prefix].append(party)
+            self._cond.notify_all()
+
+    def take(self, prefix: str = "Operator") -> str:
+        with self._cond:
+            q = self._ready[prefix]
+            if not q:
+                self.starved += 1
+                t0 = time.perf_counter()
+                self._refill(prefix)
+                self._cond.wait_for(lambda: q or not self._pending[prefix] or self._closed)
+                self.starved_wait += time.perf_counter() - t0
+            party = q.popleft() if q else None
+            self.served += 1
+            self._refill(prefix)
+        # background allocation failed: surface the real error inline
+        return party if party is not None else self.client.allocate_unique_party(prefix)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "served": self.served,
+                "starved": self.starved,
+                "starved_wait_s": self.starved_wait,
+                "errors": self.errors,
+                "ready": {p: len(q) for p, q in self._ready.items()},
+                "pending": {p: n for p, n in self._pending.items() if n},
+            }
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+_default_client: DamlClient | None = None
+_default_lock = threading.Lock()
+
+def _global_client() -> DamlClient:
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = DamlClient(LEDGERS[0])
+        return _default_client
+
+def default_client() -> DamlClient:
+    # The client pinned to this thread by LedgerPool.pin(), else the global one.
+    pinned = getattr(_scope, "client", None)
+    return pinned if pinned is not None else _global_client()
+
+def set_default_client(client: DamlClient | None) -> DamlClient | None:
+    # Swap the client used by the module-level helpers; returns the previous one
+    # (not closed, so callers can restore it).
+    global _default_client
+    with _default_lock:
+        prev, _default_client = _default_client, client
+    return prev
+
+@atexit.register
+def _close_default_client() -> None:
+    if _default_client is not None:
+        _default_client.close()
+
+class LedgerPool:
+    # One DamlClient per JSON API endpoint. Parties and contracts are
+    # ledger-local, so a whole example (or test) must run against one ledger:
+    # pin() picks the endpoint with the least expected wait, (requests in
+    # flight + 1) * smoothed latency, and routes the module-level helpers on
+    # this thread (and StepGraph / parallel_given workers) to it.
+    def __init__(self, clients: list[DamlClient]):
+        if not clients:
+            raise ValueError("LedgerPool needs at least one client")
+        self.clients = list(clients)
+        self.picks = [0] * len(self.clients)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_bases(cls, bases: list[str], **kwargs) -> "LedgerPool":
+        return cls([DamlClient(b, **kwargs) for b in bases])
+
+    def pick(self) -> DamlClient:
+        def cost(i: int):
+            c = self.clients[i]
+            # unmeasured ledgers first, then least expected wait, then least used
+            return (c.inflight + 1) * (c.latency or 0.0), c.inflight, self.picks[i]
+        with self._lock:
+            i = min(range(len(self.clients)), key=cost)
+            self.picks[i] += 1
+            return self.clients[i]
+
+    @contextlib.contextmanager
+    def pin(self, client: DamlClient | None = None):
+        prev = getattr(_scope, "client", None)
+        _scope.client = client or self.pick()
+        try:
+            yield _scope.client
+        finally:
+            _scope.client = prev
+
+    def upload_dar(self, path: str) -> None:
+        for c in self.clients:
+            c.upload_dar(path)
+
+    def stats(self) -> list[dict]:
+        return [{"base": c.base, "picks": n, "inflight": c.inflight, "latency_s": c.latency,
+                 "limit": int(c.limiter.limit), "retries": c.retry.retries}
+                for c, n in zip(self.clients, self.picks)]
+
+    def close(self) -> None:
+        for c in self.clients:
+            if c is not _default_client:
+                c.close()
+
+_ledger_pool: LedgerPool | None = None
+
+def ledger_pool() -> LedgerPool:
+    global _ledger_pool
+    if _ledger_pool is None:
+        first = _global_client()
+        _ledger_pool = LedgerPool([first] + [DamlClient(b) for b in LEDGERS if b != first.base])
+    return _ledger_pool
+
+def set_ledgers(bases: list[str]) -> None:
+    # Replace the endpoint list; the default client becomes the first one.
+    global LEDGERS, _ledger_pool
+    if _ledger_pool is not None:
+        _ledger_pool.close()
+        _ledger_pool = None
+    LEDGERS = list(bases)
+    prev = set_default_client(DamlClient(LEDGERS[0]))
+    if prev is not None:
+        prev.close()
+
+def sharded(fn):
+    # Place under @given: each example runs on the least loaded ledger.
+    # Without it the pytest plugin pins whole tests instead.
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        pool = ledger_pool()
+        if len(pool.clients) == 1:
+            return fn(*args, **kwargs)
+        with pool.pin():
+            return fn(*args, **kwargs)
+    return wrapper
+
+def make_request(op: str, **kwargs) -> dict:
+    return default_client().make_request(op, **kwargs)
+
+def lookup_contract(contract_id: str, template_id: str | None = None, *, reader=None, act_as=None) -> dict | None:
+    return default_client().lookup(contract_id, template_id, reader=reader, act_as=act_as)
+
+def search_contracts(template_id: str, query: dict | None = None, *, reader=None, act_as=None) -> list[dict]:
+    return default_client().search(template_id, query, reader=reader, act_as=act_as)
+
+def exercise_view(act_as, template_id: str, contract_id: str, choice: str, argument=None, check: bool | None = None):
+    return default_client().exercise_view(act_as, template_id, contract_id, choice, argument, check)
+
+def command_batch() -> CommandBatch:
+    return default_client().batch()
+
+def allocate_party(identifier_hint: str, display_name: str | None = None, is_local: bool = True) -> str:
+    return default_client().allocate_party(identifier_hint, display_name, is_local)
+
+_party_pool: PartyPool | None = None
+
+def set_party_pool(pool: PartyPool | None) -> PartyPool | None:
+    # Route allocate_unique_party through `pool` (None turns it off).
+    global _party_pool
+    prev, _party_pool = _party_pool, pool
+    return prev
+
+def _fresh_party(prefix: str) -> str:
+    client = default_client()
+    if _party_pool is not None and _party_pool.client is client:
+        return _party_pool.take(prefix)
+    return client.allocate_unique_party(prefix)
+
+def allocate_unique_party(prefix: str = "Operator") -> str:
+    scope = getattr(_scope, "current", None)
+    if scope is not None:
+        return scope.party(prefix)
+    return _fresh_party(prefix)
+
+# Party isolation levels. "example" (the default) allocates new parties for
+# every Hypothesis example. "test" hands the same parties back to later
+# examples of the decorated test, "session" to every "session" test in the
+# same test module (tests in other modules never share them): the n-th
+# allocate_unique_party(prefix) of an example always gets the n-th party for
+# that prefix. Only safe for tests that read their own contracts by id.
+ISOLATION_LEVELS = ("example", "test", "session")
+
+_scope = threading.local()
+# test module -> parties of its "session" tests
+_session_parties: dict[str, dict[tuple[str, str, int], str]] = {}
+_parties_lock = threading.Lock()
+
+class _PartyScope:
+    def __init__(self, parties: dict[tuple[str, str, int], str]):
+        self.parties = parties
+        self.counts: dict[str, int] = defaultdict(int)
+
+    def party(self, prefix: str) -> str:
+        with _parties_lock:
+            key = (default_client().base, prefix, self.counts[prefix])  # parties are ledger-local
+            self.counts[prefix] += 1
+            p = self.parties.get(key)
+        if p is None:
+            p = _fresh_party(prefix)
+            with _parties_lock:
+                p = self.parties.setdefault(key, p)
+        return p
+
+def isolation(level: str):
+    if level not in ISOLATION_LEVELS:
+        raise ValueError(f"Unsupported isolation level '{level}', expected one of {ISOLATION_LEVELS}")
+    def deco(fn):
+        if level == "example":
+            return fn
+        with _parties_lock:
+            parties = _session_parties.setdefault(fn.__module__, {}) if level == "session" else {}
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            prev = getattr(_scope, "current", None)
+            _scope.current = _PartyScope(parties)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _scope.current = prev
+        return wrapper
+    return deco
+
+# What the cassette and the script exporter keep per example lives in one
+# dict per example run: on the Hypothesis build context, on a parallel_given
+# input, or (outside any example) per test. _context() hands it to workers.
+_test_id = ""
+_test_state: dict = {"test": ""}
+_state_lock = threading.Lock()
+
+def _begin_test(test_id: str, seed=None):
+    # the Hypothesis seed the cassette pins for the test, else `seed`
+    # (--hypothesis-seed), if any
+    global _test_id, _test_state
+    if _cassette is not None:
+        seed = _cassette.begin(test_id)
+    _test_id, _test_state = test_id, {"test": test_id, "seed": seed}
+    return seed
+
+def _example_state() -> dict:
+    state = getattr(_scope, "state", None)
+    if state is not None:
+        return state
+    try:
+        ctx = current_build_context()
+    except InvalidArgument:  # not inside a Hypothesis example
+        return _test_state
+    with _state_lock:
+        state = getattr(ctx, "_daml_pbt_state", None)
+        if state is None:
+            state = ctx._daml_pbt_state = {"test": _test_id}
+    return state
+
+def _example_key(state: dict) -> str:
+    # names an example the same way in every run: by its drawn inputs (see
+    # _track_examples; "" for the test outside its examples)
+    if "label" in state:
+        return "p" + hashlib.sha1(state["label"].encode()).hexdigest()[:15]
+    return ""
+
+def _track_examples(test, fixtures=()):
+    # Label every example of the @given test `test` with its drawn arguments
+    # (all but `fixtures`), as parallel_given labels its own, and tell the
+    # script exporter which examples failed. Wraps test.hypothesis.inner_test,
+    # which Hypothesis lets plugins replace. Returns `test`.
+    hyp = getattr(test, "hypothesis", None)
+    if hyp is None or getattr(hyp.inner_test, "_daml_pbt_tracked", False):
+        return test
+    inner = hyp.inner_test
+
+    @functools.wraps(inner)
+    def tracked(*args, **kwargs):
+        state = _example_state()
+        state["label"] = repr({k: v for k, v in kwargs.items() if k not in fixtures})
+        try:
+            return inner(*args, **kwargs)
+        except BaseException:
+            if _scripts is not None:
+                _scripts.failed(state)
+            raise
+    tracked._daml_pbt_tracked = True
+    hyp.inner_test = tracked
+    return test
+
+class Ref:
+    # Placeholder for the result of an earlier StepGraph step.
+    __slots__ = ("index", "name")
+
+    def __init__(self, index: int, name: str | None):
+        self.index, self.name = index, name
+
+    def __repr__(self):
+        return f"Ref({self.name or self.index})"
+
+def _refs(x) -> set[int]:
+    if isinstance(x, Ref):
+        return {x.index}
+    if isinstance(x, (list, tuple, set)):
+        return set().union(*map(_refs, x)) if x else set()
+    if isinstance(x, dict):
+        return _refs(list(x.values()))
+    return set()
+
+def _resolve(x, results: list):
+    if isinstance(x, Ref):
+        return results[x.index]
+    if isinstance(x, (list, tuple, set)):
+        return type(x)(_resolve(v, results) for v in x)
+    if isinstance(x, dict):
+        return {k: _resolve(v, results) for k, v in x.items()}
+    return x
+
+def _context() -> tuple:
+    # isolation scope, pinned ledger, pre-validation switch, "inside an
+    # example" flag and example state of this thread, for handing to workers
+    return (getattr(_scope, "current", None), getattr(_scope, "client", None),
+            getattr(_scope, "prevalidate", None), getattr(_scope, "example", False) or currently_in_test_context(),
+            _example_state())
+
+def _in_scope(ctx: tuple, fn, *args, **kwargs):
+    # restores what this thread had set, not what _context() derives from it
+    prev = (getattr(_scope, "current", None), getattr(_scope, "client", None), getattr(_scope, "prevalidate", None),
+            getattr(_scope, "example", False), getattr(_scope, "state", None))
+    _scope.current, _scope.client, _scope.prevalidate, _scope.example, _scope.state = ctx
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _scope.current, _scope.client, _scope.prevalidate, _scope.example, _scope.state = prev
+
+class StepGraph:
+    # Runs the steps of one example as a dependency graph: a step starts as
+    # soon as every Ref in its arguments (and every step in `after`) has
+    # finished, so independent calls overlap and the example takes about as
+    # long as its critical path. Consuming choices on the same contract are
+    # dependent even without a data edge; order them with `after`.
+    #
+    #   g = StepGraph()
+    #   owner = g.step(allocate_unique_party, "Seller")
+    #   b1    = g.step(allocate_unique_party, "Buyer1")
+    #   cid   = g.step(create_asset, owner, [b1], desc, asking)
+    #   owner, b1, cid = g.run()
+    def __init__(self, workers: int = 8):
+        self.workers = workers
+        self._steps: list[tuple] = []
+        self.results: list | None = None
+
+    def step(self, fn, *args, after=(), name: str | None = None, **kwargs) -> Ref:
+        deps = _refs(args) | _refs(kwargs) | {r.index for r in after}
+        self._steps.append((fn, args, kwargs, deps))
+        return Ref(len(self._steps) - 1, name or getattr(fn, "__name__", None))
+
+    def run(self) -> list:
+        n = len(self._steps)
+        results: list = [None] * n
+        waiting = {i: set(deps) for i, (_, _, _, deps) in enumerate(self._steps)}
+        dependents: dict[int, list[int]] = defaultdict(list)
+        for i, deps in waiting.items():
+            for d in deps:
+                dependents[d].append(i)
+        running = {}
+        ctx = _context()  # keep the test's isolation level and ledger in the workers
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="daml-pbt-steps") as ex:
+            def submit_ready():
+                for i in [i for i, deps in waiting.items() if not deps]:
+                    del waiting[i]
+                    fn, args, kwargs, _ = self._steps[i]
+                    running[ex.submit(_in_scope, ctx, fn, *_resolve(args, results), **_resolve(kwargs, results))] = i
+            submit_ready()
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for f in done:
+                    i = running.pop(f)
+                    if f.exception() is not None:
+                        for other in running:
+                            other.cancel()
+                        raise f.exception()
+                    results[i] = f.result()
+                    for j in dependents[i]:
+                        waiting[j].discard(i)
+                submit_ready()
+        if waiting:
+            raise ValueError(f"StepGraph has steps with unsatisfiable dependencies: {sorted(waiting)}")
+        self.results = results
+        return results
+
+    def __getitem__(self, ref: Ref):
+        if self.results is None:
+            raise RuntimeError("StepGraph has not run yet")
+        return self.results[ref.index]
+
+def _draw_inputs(strategies: dict, max_examples: int, seed: int) -> list[dict]:
+    # the inputs Hypothesis generates for `strategies` under `seed`, without running anything
+    drawn = []
+    @hseed(seed)
+    @settings(max_examples=max_examples, database=None, deadline=None,
+              phases=[Phase.generate], suppress_health_check=list(HealthCheck))
+    @given(**strategies)
+    def collect(**kwargs):
+        drawn.append(kwargs)
+    collect()
+    return drawn
+
+def _run_seed(seed: int | None) -> int:
+    # the seed parallel_given and friends draw with: `seed`, else the test's
+    # pinned one (_begin_test), else a fresh random one
+    if seed is not None:
+        return seed
+    pinned = _test_state.get("seed")
+    return pinned if pinned is not None else random.getrandbits(32)
+
+@contextlib.contextmanager
+def _noting_seed(decorator: str, seed: int):
+    # a failure says which seed drew its examples, to draw them again
+    try:
+        yield
+    except Exception as e:
+        e.add_note(f"daml_pbt: examples drawn with seed {seed}; @{decorator}(seed={seed}, ...) draws them again")
+        raise
+
+def _drawn_only(fn, strategies: dict, decorator: str) -> None:
+    # parallel_given and friends call `fn` with drawn inputs only
+    extra = [p for p in inspect.signature(fn).parameters if p not in strategies]
+    if extra:
+        raise TypeError(f"{fn.__qualname__} asks for {', '.join(extra)}, which @{decorator} does not draw; "
+                        f"it cannot pass pytest fixtures, use @given for a test that needs them")
+
+def _replay_failures(fn, strategies: dict, failures: list, *, max_examples: int, seed: int, where: str,
+                     shrink=None) -> None:
+    # The serial rerun of a test whose drawn examples `failures` [(inputs,
+    # exception)] failed `where`: replays those inputs under Hypothesis as
+    # explicit examples, and if one still fails, reruns the test with `seed`
+    # to shrink it (by `shrink(test)`; calling it by default). That rerun
+    # only regenerates the input if Hypothesis draws the same way it did up
+    # front, so when it passes the replayed failure is raised as it is.
+    # Always raises.
+    replay = _track_examples(given(**strategies)(fn))
+    for kw, _ in reversed(failures):
+        replay = example(**kw)(replay)
+    replay = settings(database=None, deadline=None, phases=[Phase.explicit], report_multiple_bugs=False)(replay)
+    try:
+        replay()
+    except Exception as e:
+        failure = e
+    else:
+        kw, err = failures[0]
+        raise AssertionError(f"{len(failures)} example(s) failed {where} but passed when replayed serially; "
+                             f"first failing input: {kw!r}") from err
+    if isinstance(failure, TransientError):
+        raise failure  # infrastructure, not a counterexample: nothing to shrink
+    serial = hseed(seed)(settings(max_examples=max_examples, database=None, deadline=None,
+                                  phases=[Phase.generate, Phase.shrink])(_track_examples(given(**strategies)(fn))))
+    (shrink or (lambda test: test()))(serial)  # raises the shrunk counterexample
+    failure.add_note("daml_pbt: not shrunk, the seeded rerun did not come across this input")
+    raise failure
+
+def parallel_given(*, max_examples: int = 12, workers: int = 8, seed: int | None = None, **strategies):
+    # Drop-in for @given + @settings on ledger tests whose examples are
+    # independent (fresh parties). Draws `max_examples` inputs up front, runs
+    # them on a thread pool, and if any fail replays the failing inputs
+    # serially and shrinks the first that still fails under Hypothesis with
+    # the same seed (on the contract models first under --daml-shrink=model;
+    # see daml_pbt.shrink). `fn` takes drawn arguments only, no fixtures.
+    # The seed is random per run unless given or pinned by a cassette; a
+    # failure notes it.
+    def deco(fn):
+        _drawn_only(fn, strategies, "parallel_given")
+
+        def draw(run_seed: int | None = None) -> list[dict]:
+            return _draw_inputs(strategies, max_examples, _run_seed(seed) if run_seed is None else run_seed)
+
+        def test():
+            ctx = _context()[:3] + (True,)
+            run_seed = _run_seed(seed)
+            with _noting_seed("parallel_given", run_seed):
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="daml-pbt-examples") as ex:
+                    futures = [(kw, ex.submit(_in_scope, ctx + ({"test": _test_id, "label": repr(kw)},), fn, **kw))
+                               for kw in draw(run_seed)]
+                # examples dropped by pre-validation are not failures
+                failures = [(kw, f.exception()) for kw, f in futures
+                            if f.exception() is not None and not isinstance(f.exception(), UnsatisfiedAssumption)]
+                if not failures:
+                    return
+                if all(isinstance(e, TransientError) for _, e in failures):
+                    raise failures[0][1]  # infrastructure, not a counterexample: nothing to shrink
+                _replay_failures(fn, strategies, failures, max_examples=max_examples, seed=run_seed,
+                                 where="in parallel", shrink=None if _shrink_models is None else
+                                 functools.partial(shrink_on_model, registry=_shrink_models, explore=True))
+
+        # no __wrapped__: pytest must not mistake fn's arguments for fixtures
+        test.__name__, test.__qualname__, test.__doc__, test.__module__ = fn.__name__, fn.__qualname__, fn.__doc__, fn.__module__
+        test.__signature__ = inspect.Signature()
+        test.parallel_inputs = draw
+        return test
+    return deco
+
+from .schema import Schema, SchemaMismatch, Some, load_schema, schema_for  # noqa: E402  (needs the DAR helpers above)
+from .fake import FakeLedger, Registry, Transaction  # noqa: E402
+from .cassette import Cassette, CassetteMiss  # noqa: E402
+from .script import CommandLog, ScriptExporter, ScriptExportError, render_batch, render_script  # noqa: E402
+from .batch import DamlScriptRunner, ScriptFailure, ScriptRunError, parse_script_output, script_given  # noqa: E402
+from .differential import ModelMismatch, differential_given  # noqa: E402
+from .shrink import model_shrink, shrink_on_model  # noqa: E402
+from . import models  # noqa: E402
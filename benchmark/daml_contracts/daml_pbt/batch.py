@@ -0,0 +1,166 @@
+# Script mode: check a property's examples with one `daml script` run on the
+# IDE ledger instead of one JSON API round trip per command:
+#
+#   @script_given(max_examples=200, amount=st.decimals(0, 100, places=2))
+#   def test_deposit(amount): ...
+#
+# Test bodies are Python and read results as they go, so they cannot be
+# compiled to Daml as a whole. Instead every drawn example first runs on an
+# in-process FakeLedger (contracts from fake.REGISTRY, or `registry=`),
+# which logs its commands and results like --daml-export-scripts does. The
+# logs then become one module, DamlPbtBatch, with a script per example that
+# replays the commands and asserts every result, rejection and created
+# payload the fake produced (script.render_batch). DamlScriptRunner builds
+# it against the suite's DAR and runs all scripts with one
+# `daml script --all --ide-ledger`: a single JVM start and compile for the
+# whole batch, no sandbox and no JSON API.
+#
+# A script that fails means the fake's model of a contract is wrong, and
+# the test fails with ScriptFailure naming the examples and the Daml error.
+# If the scripts agree, the Python assertions saw what the ledger would have
+# returned, so an example they failed is a real counterexample: its inputs
+# are replayed serially on the fake and shrunk under Hypothesis with the
+# same seed, as parallel_given does. Anything with a `run(module, source,
+# scripts)` method can stand in for the runner, e.g. in tests of daml_pbt.
+import inspect, os, re, subprocess, tempfile
+
+from hypothesis.errors import UnsatisfiedAssumption
+
+from . import (DamlClient, _context, _draw_inputs, _drawn_only, _example_state, _in_scope, _noting_seed,
+               _replay_failures, _run_seed, find_dar, read_dar, use_script_exporter)
+from .fake import FakeLedger
+from .script import ScriptExporter, render_batch, script_project
+
+class ScriptRunError(RuntimeError):
+    # `daml build` or `daml script` could not run the batch at all
+    pass
+
+class ScriptFailure(AssertionError):
+    # scripts failed on the IDE ledger where the fake ledger had succeeded
+    def __init__(self, message: str, failures: dict[str, str]):
+        super().__init__(message)
+        self.failures = failures
+
+_RESULT = re.compile(r"^(?:[\w.]+:)?(\w+) (SUCCESS|FAILURE)(?: \((.*))?$")
+
+def parse_script_output(text: str, scripts) -> dict[str, str | None]:
+    # `daml script --all` prints "Module:name SUCCESS" or "Module:name FAILURE (error)",
+    # the error possibly running on over several lines; None means success.
+    results: dict[str, str | None] = {}
+    current = None
+    for line in text.splitlines():
+        m = _RESULT.match(line.strip())
+        if m:  # a result ends the error before it, whether or not the script is ours
+            current = m.group(1) if m.group(2) == "FAILURE" and m.group(1) in scripts else None
+            if m.group(1) in scripts:
+                results[m.group(1)] = (m.group(3) or "") if current else None
+        elif current is not None:
+            results[current] += "\n" + line
+    for name, err in results.items():
+        if err is not None and err.rstrip().endswith(")"):
+            results[name] = err.rstrip()[:-1]
+    for name in scripts:
+        results.setdefault(name, "no result from daml script")
+    return results
+
+class DamlScriptRunner:
+    # Builds a module against `dar` (a data-dependency, so its modules can be
+    # imported) and runs every script in it on the IDE ledger.
+    def __init__(self, dar: str | None = None, daml: str = "daml", timeout: float = 600):
+        self.dar = dar
+        self.daml = daml
+        self.timeout = timeout
+
+    def _call(self, args: list[str], cwd: str) -> tuple[int, str]:
+        try:
+            p = subprocess.run([self.daml, *args], cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               text=True, timeout=self.timeout)
+        except FileNotFoundError as e:
+            raise ScriptRunError(f"{self.daml} not found; install the Daml SDK or pass runner=") from e
+        except subprocess.TimeoutExpired as e:
+            raise ScriptRunError(f"{self.daml} {args[0]} took more than {self.timeout}s") from e
+        return p.returncode, p.stdout
+
+    def run(self, module: str, source: str, scripts) -> dict[str, str | None]:
+        dar = os.path.abspath(self.dar or find_dar())
+        sdk = read_dar(dar)["sdk_version"]
+        if not sdk:
+            raise ScriptRunError(f"{dar} does not name its SDK version")
+        with tempfile.TemporaryDirectory(prefix="daml-pbt-batch-") as d:
+            os.makedirs(os.path.join(d, "daml"))
+            with open(os.path.join(d, "daml", *module.split(".")) + ".daml", "w") as f:
+                f.write(source)
+            with open(os.path.join(d, "daml.yaml"), "w") as f:
+                f.write(script_project("daml-pbt-batch", sdk, dar))
+            code, out = self._call(["build", "-o", "batch.dar"], d)
+            if code != 0:
+                raise ScriptRunError(f"daml build of {module} failed:\n{out}")
+            _, out = self._call(["script", "--dar", "batch.dar", "--all", "--ide-ledger"], d)
+        return parse_script_output(out, scripts)
+
+def script_given(*, max_examples: int = 100, seed: int | None = None, runner=None, registry=None, **strategies):
+    # Drop-in for @given + @settings on ledger tests, checked in script mode
+    # (see above). `runner` defaults to a DamlScriptRunner on the test's DAR;
+    # `seed` as for parallel_given.
+    def deco(fn):
+        _drawn_only(fn, strategies, "script_given")
+
+        def draw(run_seed: int | None = None) -> list[dict]:
+            return _draw_inputs(strategies, max_examples, _run_seed(seed) if run_seed is None else run_seed)
+
+        def test():
+            current, _, prevalidate = _context()[:3]
+            name = _example_state()["test"]
+            run_seed = _run_seed(seed)
+            prev = use_script_exporter(None)
+            use_script_exporter(prev or ScriptExporter())
+            with _noting_seed("script_given", run_seed):
+                try:
+                    with FakeLedger(registry) as fake, DamlClient(fake.base) as client:
+                        logs, failures = {}, []
+                        for i, kw in enumerate(draw(run_seed)):
+                            state = {"test": name, "label": repr(kw)}
+                            try:
+                                _in_scope((current, client, prevalidate, True, state), fn, **kw)
+                            except UnsatisfiedAssumption:
+                                continue
+                            except Exception as e:
+                                failures.append((kw, e))
+                            if state.get("script") is not None and state["script"].entries:
+                                logs[f"example{i}"] = (kw, state["script"])
+                        if logs:
+                            _check(runner or DamlScriptRunner(find_dar(inspect.getfile(fn))), logs)
+                        if not failures:
+                            return
+
+                        def on_fake(**kw):
+                            ctx = _context()
+                            return _in_scope((ctx[0], client, *ctx[2:]), fn, **kw)
+                        on_fake.__name__ = on_fake.__qualname__ = fn.__name__
+                        _replay_failures(on_fake, strategies, failures, max_examples=max_examples, seed=run_seed,
+                                         where="in the batch")
+                finally:
+                    use_script_exporter(prev)
+
+        # no __wrapped__: pytest must not mistake fn's arguments for fixtures
+        test.__name__, test.__qualname__, test.__doc__, test.__module__ = fn.__name__, fn.__qualname__, fn.__doc__, fn.__module__
+        test.__signature__ = inspect.Signature()
+        test.parallel_inputs = draw
+        return test
+    return deco
+
+def _check(runner, logs: dict[str, tuple]) -> None:
+    module = "DamlPbtBatch"
+    source = render_batch({k: log for k, (_, log) in logs.items()}, module)
+    results = runner.run(module, source, list(logs))
+    failed = {k: err for k, err in results.items() if err is not None}
+    if not failed:
+        return
+    first = next(iter(failed))
+    lines = [f"{len(failed)} of {len(logs)} example(s) went differently on the IDE ledger than on the fake "
+             f"ledger, whose model of the contracts is wrong:"]
+    for k, err in failed.items():
+        lines.append(f"  {k} {logs[k][0]!r}:")
+        lines += [f"    {line}" for line in (err or "(no message)").splitlines()[:8]]
+    lines += ["", f"script of {first}:", render_batch({first: logs[first][1]}, module)]
+    raise ScriptFailure("\n".join(lines), failed)
@@ -0,0 +1,217 @@
+# Record/replay of JSON API traffic, to re-run a counterexample found in CI
+# without a sandbox, a JSON API or a DAR upload:
+#
+#   pytest tests/ --daml-record=ci.cassette                    # CI, against a ledger
+#   pytest tests/test_x.py::test_y --daml-replay=ci.cassette   # locally, no ledger
+#
+# Recording appends every DamlClient.post (commands, fetch, query, party
+# allocation) to the cassette as one JSON line, under the pytest node id and
+# the Hypothesis example that sent it. An example is named by a hash of its
+# drawn arguments, as parallel_given names its examples. Recording also pins
+# Hypothesis's seed per test, with @seed (the run's --hypothesis-seed if
+# given, else a random one), and writes it down, so the replay generates the
+# same examples, fails on the same one and shrinks along the same path.
+#
+# Replaying sends nothing. Each request is answered by the earliest unused
+# recorded request of its example with the same path, acting parties and
+# body (concurrent steps may arrive in any order). Party and contract ids
+# are remapped on the way: an id the replay did not get from this example's
+# recording (a party handed over from an earlier example by isolation("test"),
+# one allocated by a PartyPool thread, another xdist namespace) is bound to
+# the recorded id in the same position the first time it is sent, and
+# translated back in responses. Allocations are matched on the hint prefix;
+# ones the recording does not have get a made-up party. Anything else that
+# was not recorded raises CassetteMiss.
+#
+# Lines are appended with one write(2) each, so xdist workers can share a
+# cassette; a later recording of the same example replaces the earlier one.
+import json, os, random, threading
+
+import requests
+
+from . import LedgerError, _example_key, _example_state, _party_of
+from .fake import _claims
+
+class CassetteMiss(LedgerError):
+    # the replayed test sent a request its recording does not have: the test,
+    # the contracts or the inputs changed since it was recorded
+    pass
+
+def _normal(x):
+    # what the server saw: tuples as lists, Decimals as strings
+    return json.loads(json.dumps(x, default=str))
+
+def _contract_ids(x, out: set) -> None:
+    if isinstance(x, dict):
+        for k, v in x.items():
+            if k == "contractId" and isinstance(v, str):
+                out.add(v)
+            else:
+                _contract_ids(v, out)
+    elif isinstance(x, list):
+        for v in x:
+            _contract_ids(v, out)
+
+def _hint(body: dict) -> str:
+    # "Seller-w1-3f2a..." -> "Seller": the uuid and worker namespace differ per run
+    return str(body.get("identifierHint", "")).split("-")[0]
+
+def _response(status: int, content: str) -> requests.Response:
+    r = requests.Response()
+    r.status_code = status
+    r._content = content.encode()
+    r.encoding = "utf-8"
+    r.headers["Content-Type"] = "application/json"
+    return r
+
+class _Tape:
+    # The requests of one run of one example, and its id mapping on replay.
+    def __init__(self, cassette: "Cassette", test: str, example: str):
+        self.cassette, self.test, self.example = cassette, test, example
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.entries = cassette._recorded.get((test, example))
+        self.used: set[int] = set()
+        self.fwd: dict[str, str] = {}  # live id -> recorded id
+        self.rev: dict[str, str] = {}  # recorded id -> live id
+
+    def unify(self, live, rec, binds: dict) -> bool:
+        if isinstance(rec, dict):
+            return isinstance(live, dict) and live.keys() == rec.keys() and \
+                all(self.unify(live[k], rec[k], binds) for k in rec)
+        if isinstance(rec, list):
+            return isinstance(live, list) and len(live) == len(rec) and \
+                all(self.unify(a, b, binds) for a, b in zip(live, rec))
+        if not (isinstance(live, str) and isinstance(rec, str)):
+            return live == rec
+        bound = binds.get(live, self.fwd.get(live))
+        if bound is not None:
+            return bound == rec
+        if rec not in self.cassette._ids:
+            return live == rec
+        if rec in self.rev or rec in binds.values():
+            return False
+        binds[live] = rec
+        return True
+
+    def to_live(self, x):
+        if isinstance(x, dict):
+            return {k: self.to_live(v) for k, v in x.items()}
+        if isinstance(x, list):
+            return [self.to_live(v) for v in x]
+        if isinstance(x, str):
+            return self.rev.get(x, x)
+        return x
+
+class Cassette:
+    def __init__(self, path: str, mode: str = "record", seed=None):
+        # seed: the Hypothesis seed recorded for every test (--hypothesis-seed),
+        # default a random one
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unsupported cassette mode '{mode}', expected 'record' or 'replay'")
+        self.path, self.mode = path, mode
+        self.seed = random.getrandbits(32) if seed is None else seed
+        self._lock = threading.Lock()
+        self._recorded: dict[tuple[str, str], list[dict]] = {}
+        self._seeds: dict[str, int] = {}
+        self._ids: set[str] = set()  # party and contract ids the recording knows
+        self._fd = None
+        if mode == "replay":
+            self._load()
+        else:
+            self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def _load(self) -> None:
+        with open(self.path) as f:
+            for line in f:
+                e = json.loads(line)
+                if "seed" in e:
+                    self._seeds[e["t"]] = e["seed"]
+                    continue
+                key = (e["t"], e["x"])
+                if e["i"] == 0 or key not in self._recorded:
+                    self._recorded[key] = []
+                self._recorded[key].append(e)
+                self._ids.update(e["a"], e["r"])
+                _contract_ids(e.get("b"), self._ids)
+                if e["p"] == "/parties/allocate" and e["s"] == 200:
+                    self._ids.add(_party_of(e["b"]["result"]))
+
+    def _write(self, entry: dict) -> None:
+        os.write(self._fd, (json.dumps(entry, separators=(",", ":")) + "\n").encode())
+
+    def begin(self, test: str):
+        # called before each test (the plugin's pytest_runtest_call); the seed
+        # its Hypothesis examples run under, None if it was not recorded
+        if self.replaying:
+            return self._seeds.get(test)
+        self._write({"t": test, "seed": self.seed})
+        return self.seed
+
+    def tape(self) -> _Tape:
+        # the tape of the example running on this thread
+        state = _example_state()
+        with self._lock:
+            tape = state.get("tape")
+            if tape is None or tape.cassette is not self:
+                tape = state["tape"] = _Tape(self, state["test"], _example_key(state))
+        return tape
+
+    def record(self, path: str, body: dict, headers: dict, r: requests.Response) -> None:
+        tape = self.tape()
+        claims = _claims(headers.get("Authorization"))
+        entry = {"t": tape.test, "x": tape.example, "i": 0, "p": path, "a": claims.get("actAs") or [],
+                 "r": claims.get("readAs") or [], "q": _normal(body), "s": r.status_code}
+        try:
+            entry["b"] = r.json()
+        except ValueError:
+            entry["text"] = r.text
+        with tape.lock:
+            entry["i"] = tape.seq
+            tape.seq += 1
+            self._write(entry)
+
+    def replay(self, path: str, body: dict, headers: dict) -> requests.Response:
+        tape = self.tape()
+        claims = _claims(headers.get("Authorization"))
+        live = {"a": claims.get("actAs") or [], "r": claims.get("readAs") or [], "q": _normal(body)}
+        with tape.lock:
+            for i, e in enumerate(tape.entries or ()):
+                if i in tape.used or e["p"] != path:
+                    continue
+                binds: dict[str, str] = {}
+                if path == "/parties/allocate" and _hint(e["q"]) == _hint(live["q"]):
+                    break
+                if path != "/parties/allocate" and all(tape.unify(live[k], e[k], binds) for k in live):
+                    break
+            else:
+                if path == "/parties/allocate":
+                    hint = live["q"].get("identifierHint", "")
+                    party = f"{hint}::replay"
+                    return _response(200, json.dumps({"status": 200, "result": {
+                        "identifier": party, "displayName": hint, "isLocal": True}}))
+                if tape.entries is None:
+                    raise CassetteMiss(path, 0, f"{tape.test}: example {tape.example or '(no Hypothesis)'} "
+                                                f"was not recorded in {self.path}")
+                raise CassetteMiss(path, 0, f"{tape.test}: example {tape.example or '(no Hypothesis)'} has no "
+                                            f"unused recorded {path} matching {json.dumps(live)[:500]}")
+            tape.used.add(i)
+            for k, v in binds.items():
+                tape.fwd[k], tape.rev[v] = v, k
+            content = json.dumps(tape.to_live(e["b"])) if "b" in e else e["text"]
+        return _response(e["s"], content)
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
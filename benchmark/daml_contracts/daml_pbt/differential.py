@@ -0,0 +1,195 @@
+# Differential pre-screening: explore a property against the contract
+# models (daml_pbt.models) in memory, and send only a few examples to the
+# ledger to confirm the models agree with it:
+#
+#   @differential_given(max_examples=2000, confirm=20, amount=st.decimals("0.01", "199.99", places=2))
+#   def test_deposit(amount): ...
+#
+# All `max_examples` inputs first run on a FakeLedger answering in-process
+# (no sockets), with the models registered (fake.REGISTRY by default, or
+# `registry=`). The examples are grouped by what they did: the command
+# sequence with the choice and outcome of each (the assertMsg that rejected
+# it, if any) and whether the Python assertions passed. Only these go to
+# the ledger: every example that failed on the model, then one example per
+# outcome sequence, rarest first, up to `confirm` in all. Hypothesis already
+# generates the ends of ranges often, so the rare sequences are where the
+# boundaries show up.
+#
+# Each chosen example reruns on the ledger (on threads, as parallel_given)
+# and its commands, results and created contracts are compared with the
+# model's run, party and contract ids matched by order of appearance. A
+# difference raises ModelMismatch naming the first command that went
+# differently. A failure that the ledger confirms is shrunk on the models
+# and the result confirmed on the ledger (daml_pbt.shrink), or, if they
+# disagree on it, rerun serially on the ledger under Hypothesis with the
+# same seed and shrunk there.
+import functools, inspect, re
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from hypothesis.errors import UnsatisfiedAssumption
+
+from . import (DamlClient, TransientError, _context, _draw_inputs, _drawn_only, _example_state, _in_scope, _noting_seed,
+               _replay_failures, _run_seed, _template_key, classify_error, use_script_exporter)
+from .cassette import _contract_ids, _hint
+from .fake import FakeLedger
+from .script import ScriptExporter
+from .shrink import shrink_on_model
+
+class ModelMismatch(AssertionError):
+    # the ledger did something else than the model predicted
+    def __init__(self, message: str, examples: list[dict]):
+        super().__init__(message)
+        self.examples = examples
+
+_MESSAGE = re.compile(r'message = "((?:[^"\\]|\\.)*)"')
+_VOLATILE = frozenset(("completionOffset", "signatories", "observers", "agreementText", "key"))
+
+def _outcome(e: dict) -> str:
+    # "ok", or the Daml error message (assertMsg, error) or kind of a rejection
+    if e["ok"]:
+        return "ok"
+    m = _MESSAGE.search(e.get("error") or "")
+    return m.group(1) if m else classify_error(400, e.get("error") or "").__name__
+
+def _signature(log, error: BaseException | None) -> tuple:
+    steps = tuple((e["path"], _template_key(e["body"].get("templateId")), e["body"].get("choice"), _outcome(e))
+                  for e in (log.entries if log is not None else ()))
+    return steps, type(error).__name__ if error is not None else None
+
+def _canonical(entries: list[dict]) -> list[dict]:
+    # the commands of one run with ids numbered by first appearance,
+    # numbers normalized and ledger bookkeeping dropped
+    ids: set[str] = set()
+    for e in entries:
+        ids.update(e["act_as"], e["read_as"])
+        if e["path"] == "/parties/allocate" and e["ok"]:
+            ids.add(e["result"])
+        _contract_ids(e["body"], ids)
+        _contract_ids(e["result"], ids)
+    names: dict[str, str] = {}
+
+    def canon(x, key=None):
+        if isinstance(x, dict):
+            return {k: canon(v, k) for k, v in sorted(x.items()) if k not in _VOLATILE}
+        if isinstance(x, list):
+            return [canon(v) for v in x]
+        if isinstance(x, bool) or x is None:
+            return x
+        if key == "templateId":
+            return _template_key(x)
+        if isinstance(x, str) and x in ids:
+            return names.setdefault(x, f"#{len(names)}")
+        if isinstance(x, (int, str)):
+            try:
+                return format(Decimal(str(x)).normalize(), "f")
+            except ArithmeticError:
+                return x
+        return x
+
+    return [canon({"path": e["path"], "act_as": e["act_as"], "read_as": e["read_as"],
+                   "body": {"identifierHint": _hint(e["body"])} if e["path"] == "/parties/allocate" else e["body"],
+                   "outcome": _outcome(e), "result": e["result"]}) for e in entries]
+
+def _difference(model, ledger) -> str | None:
+    a, b = _canonical(model.entries if model else []), _canonical(ledger.entries if ledger else [])
+    for i, (x, y) in enumerate(zip(a, b)):
+        if x != y:
+            return f"command {i + 1} ({x['path']} {x['body'].get('choice') or ''}): model {x} != ledger {y}"
+    if len(a) != len(b):
+        return f"the model sent {len(a)} command(s), the ledger run {len(b)}"
+    return None
+
+def differential_given(*, max_examples: int = 1000, confirm: int = 20, workers: int = 8, seed: int | None = None,
+                       registry=None, **strategies):
+    # Drop-in for @given + @settings on ledger tests whose examples are
+    # independent (fresh parties), pre-screened on the models (see above);
+    # `seed` as for parallel_given.
+    def deco(fn):
+        _drawn_only(fn, strategies, "differential_given")
+
+        def draw(run_seed: int | None = None) -> list[dict]:
+            return _draw_inputs(strategies, max_examples, _run_seed(seed) if run_seed is None else run_seed)
+
+        def test():
+            run_seed = _run_seed(seed)
+            with _noting_seed("differential_given", run_seed):
+                _differential(run_seed)
+
+        def _differential(run_seed: int) -> None:
+            ctx = _context()[:3] + (True,)
+            name = _example_state()["test"]
+            prev = use_script_exporter(None)
+            use_script_exporter(prev or ScriptExporter())
+            try:
+                inputs = draw(run_seed)
+                explored = _run_on_model(fn, inputs, ctx, name, registry)
+                picked = _pick(explored, confirm)
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="daml-pbt-examples") as ex:
+                    runs = [(i, ex.submit(_run, fn, inputs[i], ctx, {"test": name, "label": repr(inputs[i])}))
+                            for i in picked]
+                confirmed = [(i, *f.result()) for i, f in runs]
+            finally:
+                use_script_exporter(prev)
+            transient = [err for _, _, err in confirmed if isinstance(err, TransientError)]
+            if transient:
+                raise transient[0]  # infrastructure, not a counterexample: nothing to compare
+            mismatches = []
+            for i, log, err in confirmed:
+                model_log, model_err = explored[i]
+                diff = _difference(model_log, log)
+                if diff is None and (model_err is None) != (err is None):
+                    diff = f"the test {'failed' if model_err else 'passed'} on the model and " \
+                           f"{'failed' if err else 'passed'} on the ledger: {model_err or err!r}"
+                if diff is not None:
+                    mismatches.append({"input": inputs[i], "difference": diff})
+            if mismatches:
+                raise ModelMismatch(
+                    f"{len(mismatches)} of {len(confirmed)} confirmed example(s) went differently on the ledger "
+                    f"than on the model:\n" + "\n".join(f"  {m['input']!r}: {m['difference']}" for m in mismatches),
+                    mismatches)
+            failures = [(inputs[i], err) for i, _, err in confirmed if err is not None]
+            if not failures:
+                return
+            _replay_failures(fn, strategies, failures, max_examples=max_examples, seed=run_seed,
+                             where="on the model and the ledger",
+                             shrink=functools.partial(shrink_on_model, registry=registry, explore=True))
+
+        # no __wrapped__: pytest must not mistake fn's arguments for fixtures
+        test.__name__, test.__qualname__, test.__doc__, test.__module__ = fn.__name__, fn.__qualname__, fn.__doc__, fn.__module__
+        test.__signature__ = inspect.Signature()
+        test.parallel_inputs = draw
+        return test
+    return deco
+
+def _run(fn, kw: dict, ctx: tuple, state: dict) -> tuple:
+    # (command log, exception) of one example; skipped examples have neither
+    try:
+        _in_scope(ctx + (state,), fn, **kw)
+        err = None
+    except UnsatisfiedAssumption:
+        return None, None
+    except Exception as e:
+        err = e
+    return state.get("script"), err
+
+def _run_on_model(fn, inputs: list[dict], ctx: tuple, name: str, registry) -> list[tuple]:
+    fake = FakeLedger(registry)
+    try:
+        with DamlClient(fake.base, adapter=fake.adapter()) as client:
+            model_ctx = (ctx[0], client, *ctx[2:])
+            return [_run(fn, kw, model_ctx, {"test": name, "label": f"model {kw!r}"}) for kw in inputs]
+    finally:
+        fake.close()
+
+def _pick(explored: list[tuple], confirm: int) -> list[int]:
+    # model failures first, then one example per outcome sequence, rarest first
+    picked = [i for i, (_, err) in enumerate(explored) if err is not None]
+    groups: dict[tuple, list[int]] = {}
+    for i, (log, err) in enumerate(explored):
+        if log is not None or err is not None:
+            groups.setdefault(_signature(log, err), []).append(i)
+    for members in sorted(groups.values(), key=len):
+        if members[0] not in picked:
+            picked.append(members[0])
+    return picked[:confirm]
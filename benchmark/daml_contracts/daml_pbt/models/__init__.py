@@ -0,0 +1,66 @@
+# Executable Python models of the benchmark contracts, for FakeLedger:
+#
+#   from daml_pbt import models
+#   models.register("ZeroTokenBank")   # on fake.REGISTRY, or pass registry=
+#   models.register_all()
+#
+# One module per suite, mirroring its Daml module choice by choice: the same
+# signatories, observers and controllers, the same assertMsg/assert checks
+# in the same order with the same messages, and results in the JSON API
+# encoding (Numeric and Int64 as strings, enums as constructor names,
+# Optional as null or the value, tuples as {"_1", "_2"}). The deliberately
+# broken variants some suites ship (ZeroTokenBank2, WhitelistedRegistryTwo)
+# are modelled bugs included: a model predicts what the ledger will do,
+# deciding whether that is right is the tests' job.
+#
+# Template ids are registered without a package id ("ZeroTokenBank:Bank"),
+# so a model serves whatever build of the DAR the suite uses. `pytest
+# --daml-fake` registers all of them; differential_given uses them to
+# explore a property in memory before confirming it on the ledger.
+from decimal import ROUND_HALF_EVEN, Decimal
+
+from ..fake import REGISTRY, Registry, _daml_exception
+
+_SCALE = Decimal("1e-10")  # Daml's Decimal is Numeric 10
+
+def dec(v) -> Decimal:
+    # a Numeric as the JSON API sends it (string) or a test wrote it (str, int, Decimal)
+    return Decimal(str(v))
+
+def numeric(d: Decimal) -> str:
+    # Numeric 10 result, rounded half-even as Daml does, as the JSON API renders it
+    s = format(d.quantize(_SCALE, rounding=ROUND_HALF_EVEN).normalize(), "f")
+    return s if "." in s else s + ".0"
+
+def int64(n: int) -> str:
+    if not -2 ** 63 <= n < 2 ** 63:
+        raise _daml_exception("DA.Exception.ArithmeticError:ArithmeticError", f"Int64 overflow: {n}")
+    return str(n)
+
+def register(module: str, registry: Registry | None = None, replace: bool = True) -> Registry:
+    # Register the model of the Daml module `module` (its templates and
+    # choices); with replace=False, ones the registry already has are kept.
+    suite = MODELS.get(module)
+    if suite is None:
+        raise KeyError(f"no model of Daml module {module!r}; models: {sorted(MODELS)}")
+    registry = registry or REGISTRY
+    staged = Registry()
+    suite.register(staged, module)
+    for mine, theirs in ((registry.templates, staged.templates), (registry.choices, staged.choices)):
+        for key, value in theirs.items():
+            if replace or key not in mine:
+                mine[key] = value
+    return registry
+
+def register_all(registry: Registry | None = None, replace: bool = True) -> Registry:
+    registry = registry or REGISTRY
+    for module in MODELS:
+        register(module, registry, replace)
+    return registry
+
+from . import (asset_transfer, borrow_and_lending, component_counter, digital_locker,  # noqa: E402
+               frequent_flier, simple_market, whitelisted_registry, zero_token_bank)
+
+MODELS = {module: suite for suite in (asset_transfer, borrow_and_lending, component_counter, digital_locker,
+                                      frequent_flier, simple_market, whitelisted_registry, zero_token_bank)
+          for module in suite.MODULES}
@@ -0,0 +1,92 @@
+# AssetTransfer: the owner's asset moves Active -> OfferPlaced ->
+# PendingInspection -> Inspected/Appraised -> NotionalAcceptance ->
+# BuyerAccepted/SellerAccepted -> Accepted, with Reject/RescindOffer back to
+# Active and Terminate from anywhere before SellerAccepted. Every check is a
+# bare `assert`, so every rejection reads "Assertion failed".
+from ..fake import error
+from . import dec, numeric
+
+MODULES = ("AssetTransfer",)
+
+_FAILED = "Assertion failed"
+
+def _assigned(field: str, role: str):
+    # `controller (case buyer of Some p -> p; None -> error "No buyer assigned")`
+    def controllers(p, arg):
+        return p[field] if p.get(field) is not None else error(f"No {role} assigned")
+    return controllers
+
+def _withdrawn(p: dict) -> dict:
+    # Reject and RescindOffer
+    return {**p, "buyer": None, "offerPrice": None, "state": "Active", "inspector": None, "appraiser": None}
+
+def register(registry, module: str) -> None:
+    tid = f"{module}:AssetTransfer"
+    registry.template(tid, signatories=["owner"], observers=["potentialBuyers"])
+    buyer = _assigned("buyer", "buyer")
+    inspector = _assigned("inspector", "inspector")
+    appraiser = _assigned("appraiser", "appraiser")
+
+    @registry.choice(tid, "Terminate", controllers=["owner"])
+    def terminate(tx, p, arg):
+        tx.require(p["state"] not in ("SellerAccepted", "Accepted"), _FAILED)
+        return tx.create(tid, {**p, "state": "Terminated"})
+
+    @registry.choice(tid, "Modify", controllers=["owner"])
+    def modify(tx, p, arg):
+        tx.require(p["state"] == "Active", _FAILED)
+        return tx.create(tid, {**p, "description": arg["newDescription"],
+                               "askingPrice": numeric(dec(arg["newPrice"]))})
+
+    @registry.choice(tid, "MakeOffer", controllers=["arg.buyerParty"])
+    def make_offer(tx, p, arg):
+        tx.require(p["state"] == "Active", _FAILED)
+        return tx.create(tid, {**p, "buyer": arg["buyerParty"], "inspector": arg["newInspector"],
+                               "appraiser": arg["newAppraiser"], "offerPrice": numeric(dec(arg["newOfferPrice"])),
+                               "state": "OfferPlaced",
+                               "potentialBuyers": [*p["potentialBuyers"], arg["newAppraiser"], arg["newInspector"]]})
+
+    @registry.choice(tid, "ModifyOffer", controllers=buyer)
+    def modify_offer(tx, p, arg):
+        tx.require(p["state"] == "OfferPlaced", _FAILED)
+        return tx.create(tid, {**p, "offerPrice": numeric(dec(arg["newOfferPrice"]))})
+
+    @registry.choice(tid, "Reject", controllers=["owner"])
+    def reject(tx, p, arg):
+        tx.require(p["state"] in ("OfferPlaced", "PendingInspection", "Inspected", "Appraised",
+                                  "NotionalAcceptance", "BuyerAccepted"), _FAILED)
+        return tx.create(tid, _withdrawn(p))
+
+    @registry.choice(tid, "AcceptOffer", controllers=["owner"])
+    def accept_offer(tx, p, arg):
+        tx.require(p["state"] == "OfferPlaced", _FAILED)
+        return tx.create(tid, {**p, "state": "PendingInspection"})
+
+    @registry.choice(tid, "RescindOffer", controllers=buyer)
+    def rescind_offer(tx, p, arg):
+        tx.require(p["state"] in ("OfferPlaced", "PendingInspection", "Inspected", "Appraised",
+                                  "NotionalAcceptance", "SellerAccepted"), _FAILED)
+        return tx.create(tid, _withdrawn(p))
+
+    @registry.choice(tid, "MarkInspected", controllers=inspector)
+    def mark_inspected(tx, p, arg):
+        tx.require(p["state"] in ("PendingInspection", "Appraised"), _FAILED)
+        state = "Inspected" if p["state"] == "PendingInspection" else "NotionalAcceptance"
+        return tx.create(tid, {**p, "state": state})
+
+    @registry.choice(tid, "MarkAppraised", controllers=appraiser)
+    def mark_appraised(tx, p, arg):
+        tx.require(p["state"] in ("PendingInspection", "Inspected"), _FAILED)
+        state = "Appraised" if p["state"] == "PendingInspection" else "NotionalAcceptance"
+        return tx.create(tid, {**p, "state": state})
+
+    @registry.choice(tid, "Accept", controllers=["owner"])
+    def accept(tx, p, arg):
+        tx.require(p["state"] in ("NotionalAcceptance", "BuyerAccepted"), _FAILED)
+        return tx.create(tid, {**p, "state": "SellerAccepted"})
+
+    @registry.choice(tid, "AcceptByBuyer", controllers=buyer)
+    def accept_by_buyer(tx, p, arg):
+        tx.require(p["state"] in ("NotionalAcceptance", "SellerAccepted"), _FAILED)
+        state = "BuyerAccepted" if p["state"] == "NotionalAcceptance" else "Accepted"
+        return tx.create(tid, {**p, "state": state})
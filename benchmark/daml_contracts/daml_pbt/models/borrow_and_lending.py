@@ -0,0 +1,99 @@
+# BorrowAndLending: one pool contract per owner with per-token balances
+# ([(Text, Decimal)], {"_1", "_2"} in JSON). Users Lend into it, Withdraw
+# what they lent, Borrow against collateral worth at least twice the loan
+# (one loan per user, borrow token and collateral token) and Repay it.
+from . import dec, numeric
+
+MODULES = ("BorrowAndLending",)
+
+def _has_token(p: dict, token: str) -> bool:
+    return any(b["_1"] == token for b in p["balances"])
+
+def _credit(balances: list[dict], token: str, amount) -> list[dict]:
+    return [{**b, "_2": numeric(dec(b["_2"]) + amount)} if b["_1"] == token else b for b in balances]
+
+def _lent(lenders: list[dict], user: str, token: str, amount) -> list[dict]:
+    return [{**l, "balance": numeric(dec(l["balance"]) + amount)} if l["owner"] == user and l["token"] == token else l
+            for l in lenders]
+
+def _same_loan(b: dict, arg: dict) -> bool:
+    return b["owner"] == arg["user"] and b["borrowToken"] == arg["borrowToken"] \
+        and b["collateralToken"] == arg["collateralToken"]
+
+def register(registry, module: str) -> None:
+    tid = f"{module}:BorrowAndLending"
+    registry.template(tid, signatories=["owner"], observers=["users"])
+
+    @registry.choice(tid, "AddObserver", controllers=["owner"])
+    def add_observer(tx, p, arg):
+        users = p["users"] if arg["newObserver"] in p["users"] else [*p["users"], arg["newObserver"]]
+        return tx.create(tid, {**p, "users": users})
+
+    @registry.choice(tid, "Lend", controllers=["arg.user"])
+    def lend(tx, p, arg):
+        user, token, amount = arg["user"], arg["token"], dec(arg["amount"])
+        tx.require(amount > 0, "Amount must be positive")
+        tx.require(_has_token(p, token), "Token must be in the list of tokens")
+        if any(l["owner"] == user and l["token"] == token for l in p["lenders"]):
+            lenders = _lent(p["lenders"], user, token, amount)
+        else:
+            lenders = [*p["lenders"], {"owner": user, "token": token, "balance": numeric(amount)}]
+        return tx.create(tid, {**p, "lenders": lenders, "balances": _credit(p["balances"], token, amount)})
+
+    @registry.choice(tid, "Withdraw", controllers=["arg.user"])
+    def withdraw(tx, p, arg):
+        user, token, amount = arg["user"], arg["token"], dec(arg["amount"])
+        tx.require(amount > 0, "Amount must be positive")
+        tx.require(_has_token(p, token), "Token must be in the list of tokens")
+        tx.require(any(l["owner"] == user and l["token"] == token and dec(l["balance"]) >= amount
+                       for l in p["lenders"]), "In order to withdraw, user has to lend first")
+        tx.require(any(b["_1"] == token and dec(b["_2"]) >= amount for b in p["balances"]),
+                   "Contract has insufficient funds")
+        return tx.create(tid, {**p, "lenders": _lent(p["lenders"], user, token, -amount),
+                               "balances": _credit(p["balances"], token, -amount)})
+
+    @registry.choice(tid, "Borrow", controllers=["arg.user"])
+    def borrow(tx, p, arg):
+        user = arg["user"]
+        collateral, loan = dec(arg["collateralAmount"]), dec(arg["borrowAmount"])
+        tx.require(collateral > 0, "Collateral amount must be positive")
+        tx.require(loan > 0, "Borrow amount must be positive")
+        tx.require(collateral >= 2 * loan, "Collateral amount must be greater than twice the borrow amount")
+        tx.require(_has_token(p, arg["collateralToken"]), "Collateral token must be in the list of tokens")
+        tx.require(_has_token(p, arg["borrowToken"]), "Borrow token must be in the list of tokens")
+        tx.require(any(l["owner"] == user and l["token"] == arg["collateralToken"] and dec(l["balance"]) >= collateral
+                       for l in p["lenders"]), "Insufficient collateral")
+        tx.require(not any(_same_loan(b, arg) for b in p["borrowers"]),
+                   "User already has an active loan of this token using the same collateral token")
+        tx.require(any(b["_1"] == arg["borrowToken"] and dec(b["_2"]) >= loan for b in p["balances"]),
+                   "Contract has insufficient funds")
+        borrower = {"owner": user, "collateralToken": arg["collateralToken"], "collateralAmount": numeric(collateral),
+                    "borrowToken": arg["borrowToken"], "borrowAmount": numeric(loan)}
+        return tx.create(tid, {**p, "lenders": _lent(p["lenders"], user, arg["collateralToken"], -collateral),
+                               "balances": _credit(p["balances"], arg["borrowToken"], -loan),
+                               "borrowers": [*p["borrowers"], borrower]})
+
+    @registry.choice(tid, "Repay", controllers=["arg.user"])
+    def repay(tx, p, arg):
+        tx.require(_has_token(p, arg["collateralToken"]), "Collateral token must be in the list of tokens")
+        tx.require(_has_token(p, arg["borrowToken"]), "Borrow token must be in the list of tokens")
+        loans = [b for b in p["borrowers"] if _same_loan(b, arg)]
+        tx.require(loans, "User has to have an active loan of this token using the same collateral token")
+        loan = loans[0]
+        return tx.create(tid, {
+            **p,
+            "lenders": _lent(p["lenders"], arg["user"], arg["collateralToken"], dec(loan["collateralAmount"])),
+            "balances": _credit(p["balances"], arg["borrowToken"], dec(loan["borrowAmount"])),
+            "borrowers": [b for b in p["borrowers"] if not _same_loan(b, arg)]})
+
+    @registry.choice(tid, "GetCollaterals", controllers=["arg.user"], consuming=False)
+    def get_collaterals(tx, p, arg):
+        return [l for l in p["lenders"] if l["owner"] == arg["user"]]
+
+    @registry.choice(tid, "GetBorrowers", controllers=["arg.user"], consuming=False)
+    def get_borrowers(tx, p, arg):
+        return [b for b in p["borrowers"] if b["owner"] == arg["user"]]
+
+    @registry.choice(tid, "GetBalances", controllers=["arg.user"], consuming=False)
+    def get_balances(tx, p, arg):
+        return p["balances"]
@@ -0,0 +1,11 @@
+# DefectiveComponentCounter: ComputeTotal moves the counter to its final
+# state and leaves the count alone.
+MODULES = ("DefectiveComponentCounter",)
+
+def register(registry, module: str) -> None:
+    tid = f"{module}:DefectiveCounter"
+    registry.template(tid, signatories=["manufacturer"])
+
+    @registry.choice(tid, "ComputeTotal", controllers=["manufacturer"])
+    def compute_total(tx, p, arg):
+        return tx.create(tid, {**p, "state": "ComputeTotal"})
@@ -0,0 +1,65 @@
+# DigitalLocker: Requested -> DocumentReview -> AvailableToShare, then
+# SharingRequestPending / SharingWithThirdParty and back, Terminated by the
+# bank agent at any time. UploadDocuments and ShareWithThirdParty check no
+# state; the other checks are bare `assert`s ("Assertion failed").
+from ..fake import error
+
+MODULES = ("DigitalLocker",)
+
+_FAILED = "Assertion failed"
+
+def register(registry, module: str) -> None:
+    tid = f"{module}:DigitalLocker"
+    registry.template(tid, signatories=["owner"], observers=["bankAgent", "thirdParties"])
+
+    @registry.choice(tid, "BeginReviewProcess", controllers=["bankAgent"])
+    def begin_review(tx, p, arg):
+        tx.require(p["state"] == "Requested", _FAILED)
+        return tx.create(tid, {**p, "lockerStatus": "Pending", "state": "DocumentReview"})
+
+    @registry.choice(tid, "UploadDocuments", controllers=["bankAgent"])
+    def upload_documents(tx, p, arg):
+        return tx.create(tid, {**p, "state": "AvailableToShare", "lockerStatus": "Approved",
+                               "lockerIdentifier": arg["identifier"], "image": arg["img"]})
+
+    @registry.choice(tid, "RequestLockerAccess", controllers=["arg.requestor"])
+    def request_access(tx, p, arg):
+        tx.require(p["state"] == "AvailableToShare", _FAILED)
+        return tx.create(tid, {**p, "state": "SharingRequestPending", "thirdPartyRequestor": arg["requestor"],
+                               "currentAuthorizedUser": None, "intendedPurpose": arg["purpose"]})
+
+    @registry.choice(tid, "AcceptSharingRequest", controllers=["owner"])
+    def accept_request(tx, p, arg):
+        tx.require(p["state"] == "SharingRequestPending", _FAILED)
+        if p.get("thirdPartyRequestor") is None:
+            error("No third-party requestor found")
+        return tx.create(tid, {**p, "state": "SharingWithThirdParty",
+                               "currentAuthorizedUser": p["thirdPartyRequestor"]})
+
+    @registry.choice(tid, "RejectSharingRequest", controllers=["owner"])
+    def reject_request(tx, p, arg):
+        tx.require(p["state"] == "SharingRequestPending", _FAILED)
+        return tx.create(tid, {**p, "lockerStatus": "Available", "thirdPartyRequestor": None,
+                               "currentAuthorizedUser": None, "state": "AvailableToShare"})
+
+    @registry.choice(tid, "ShareWithThirdParty", controllers=["owner"])
+    def share(tx, p, arg):
+        return tx.create(tid, {**p, "thirdPartyRequestor": arg["recipient"], "currentAuthorizedUser": arg["recipient"],
+                               "expirationDate": arg["expDate"], "intendedPurpose": arg["purpose"],
+                               "lockerStatus": "Shared", "state": "SharingWithThirdParty"})
+
+    @registry.choice(tid, "ReleaseLockerAccess", controllers=["currentAuthorizedUser"])
+    def release(tx, p, arg):
+        tx.require(p["state"] == "SharingWithThirdParty", _FAILED)
+        return tx.create(tid, {**p, "lockerStatus": "Available", "thirdPartyRequestor": None,
+                               "currentAuthorizedUser": None, "intendedPurpose": None, "state": "AvailableToShare"})
+
+    @registry.choice(tid, "RevokeAccessFromThirdParty", controllers=["owner"])
+    def revoke(tx, p, arg):
+        tx.require(p["state"] == "SharingWithThirdParty", _FAILED)
+        return tx.create(tid, {**p, "lockerStatus": "Available", "intendedPurpose": None,
+                               "thirdPartyRequestor": None, "currentAuthorizedUser": None, "state": "AvailableToShare"})
+
+    @registry.choice(tid, "Terminate", controllers=["bankAgent"])
+    def terminate(tx, p, arg):
+        return tx.create(tid, {**p, "currentAuthorizedUser": None, "state": "Terminated"})
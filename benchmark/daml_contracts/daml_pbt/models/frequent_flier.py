@@ -0,0 +1,25 @@
+# FrequentFlier: the flier's AddMiles appends to the miles list and adds
+# rewardsPerMile * sum(newMiles) to totalRewards; anyone who sees the
+# contract can read both with GetMiles/GetRewards.
+from . import int64
+
+MODULES = ("FrequentFlier",)
+
+def register(registry, module: str) -> None:
+    tid = f"{module}:FrequentFlier"
+    registry.template(tid, signatories=["airlineRepresentative"], observers=["flier"])
+
+    @registry.choice(tid, "AddMiles", controllers=["flier"])
+    def add_miles(tx, p, arg):
+        rate = int(p["rewardsPerMile"])
+        earned = sum(int(int64(int(m) * rate)) for m in arg["newMiles"])
+        return tx.create(tid, {**p, "miles": [int64(int(m)) for m in [*p["miles"], *arg["newMiles"]]],
+                               "totalRewards": int64(int(p["totalRewards"]) + earned)})
+
+    @registry.choice(tid, "GetMiles", controllers=["arg.caller"], consuming=False)
+    def get_miles(tx, p, arg):
+        return [int64(int(m)) for m in p["miles"]]
+
+    @registry.choice(tid, "GetRewards", controllers=["arg.caller"], consuming=False)
+    def get_rewards(tx, p, arg):
+        return int64(int(p["totalRewards"]))
@@ -0,0 +1,25 @@
+# SimpleMarket: ItemAvailable -> OfferPlaced (buyer's MakeOffer) -> Accept,
+# or back to ItemAvailable with the offer price reset by RejectOffer.
+from . import dec, numeric
+
+MODULES = ("SimpleMarket",)
+
+def register(registry, module: str) -> None:
+    tid = f"{module}:Market"
+    registry.template(tid, signatories=["owner"], observers=["buyer"])
+
+    @registry.choice(tid, "MakeOffer", controllers=["buyer"])
+    def make_offer(tx, p, arg):
+        tx.require(p["state"] == "ItemAvailable", "State must be 'ItemAvailable' to make an offer")
+        tx.require(p["owner"] != p["buyer"], "The owner cannot make an offer")
+        return tx.create(tid, {**p, "state": "OfferPlaced", "offerPrice": numeric(dec(arg["offerPrice"]))})
+
+    @registry.choice(tid, "AcceptOffer", controllers=["owner"])
+    def accept_offer(tx, p, arg):
+        tx.require(p["state"] == "OfferPlaced", "State must be 'OfferPlaced' to accept an offer")
+        return tx.create(tid, {**p, "state": "Accept"})
+
+    @registry.choice(tid, "RejectOffer", controllers=["owner"])
+    def reject_offer(tx, p, arg):
+        tx.require(p["state"] == "OfferPlaced", "State must be 'OfferPlaced' to reject an offer")
+        return tx.create(tid, {**p, "state": "ItemAvailable", "offerPrice": "0.0"})
@@ -0,0 +1,24 @@
+# WhitelistedRegistry: the owner sets or unsets whitelisted parties and
+# hands the registry over with ChangeOwner. The successor is signed by the
+# new owner, so that only goes through when the new owner authorizes it:
+# never in WhitelistedRegistry (controller owner) unless the owner stays the
+# same, always in WhitelistedRegistryTwo (controller newOwner, the bug).
+MODULES = ("WhitelistedRegistry", "WhitelistedRegistryTwo")
+
+def register(registry, module: str) -> None:
+    tid = f"{module}:WhitelistedRegistry"
+    registry.template(tid, signatories=["owner"], observers=["whitelisted"])
+    changer = ["arg.newOwner"] if module == "WhitelistedRegistryTwo" else ["owner"]
+
+    @registry.choice(tid, "ChangeOwner", controllers=changer)
+    def change_owner(tx, p, arg):
+        return tx.create(tid, {**p, "owner": arg["newOwner"]})
+
+    @registry.choice(tid, "SetWhitelisted", controllers=["owner"])
+    def set_whitelisted(tx, p, arg):
+        rest = [q for q in p["whitelisted"] if q != arg["addr"]]
+        return tx.create(tid, {**p, "whitelisted": [arg["addr"], *rest] if arg["isWhitelisted"] else rest})
+
+    @registry.choice(tid, "IsWhitelisted", controllers=["arg.caller"], consuming=False)
+    def is_whitelisted(tx, p, arg):
+        return arg["addr"] in p["whitelisted"]
@@ -0,0 +1,34 @@
+# ZeroTokenBank: the operator's Bank opens UserBalance accounts, users
+# Deposit (< 200) and Withdraw (0 < amount <= 100, covered by the balance).
+# ZeroTokenBank2 is the same contract with a Deposit that credits half.
+from . import dec, numeric
+
+MODULES = ("ZeroTokenBank", "ZeroTokenBank2")
+
+def register(registry, module: str) -> None:
+    bank, account = f"{module}:Bank", f"{module}:UserBalance"
+    registry.template(bank, signatories=["operator"])
+    registry.template(account, signatories=["bank"], observers=["user"])
+
+    @registry.choice(bank, "OpenAccount", controllers=["operator"], consuming=False)
+    def open_account(tx, p, arg):
+        return tx.create(account, {"bank": p["operator"], "user": arg["user"], "balance": "0.0"})
+
+    @registry.choice(account, "Deposit", controllers=["user"])
+    def deposit(tx, p, arg):
+        amount = dec(arg["amount"])
+        tx.require(amount < 200, "Deposit must be less than 200")
+        credit = amount / 2 if module == "ZeroTokenBank2" else amount
+        return tx.create(account, {**p, "balance": numeric(dec(p["balance"]) + credit)})
+
+    @registry.choice(account, "Withdraw", controllers=["user"])
+    def withdraw(tx, p, arg):
+        amount = dec(arg["amount"])
+        tx.require(amount > 0, "Withdrawal must be > 0")
+        tx.require(amount <= 100, "Cannot withdraw more than 100")
+        tx.require(amount <= dec(p["balance"]), "Insufficient balance")
+        return tx.create(account, {**p, "balance": numeric(dec(p["balance"]) - amount)})
+
+    @registry.choice(account, "GetBalance", controllers=["user"], consuming=False)
+    def get_balance(tx, p, arg):
+        return numeric(dec(p["balance"]))
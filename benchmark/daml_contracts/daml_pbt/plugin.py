@@ -0,0 +1,186 @@
+# The daml_pbt pytest plugin, loaded once for all suites by the conftest.py
+# above them (or `pytest -p daml_pbt.plugin`). Under pytest-xdist every worker gets its
+# own application id and party namespace, all workers share the
+# --daml-max-inflight cap on the ledger, and the controller merges the
+# per-worker ledger timings into one report. With several --daml-ledgers
+# each test is pinned to the least loaded one.
+import contextlib, glob, inspect, json, os, sys
+
+import pytest
+
+from hypothesis import seed as hseed
+
+from . import (Cassette, FakeLedger, ScriptExportError, ScriptExporter, StalePackageError, _begin_test, _track_examples,
+               check_package, ledger_pool, models, set_ledgers, set_max_inflight, shrink_on_model, timing_report,
+               use_cassette, use_model_shrinking, use_prevalidation, use_script_exporter)
+
+_pbt = sys.modules[__package__]  # the package's current settings (_cassette, _scripts, APP_ID, ...)
+
+def _worker_id() -> str | None:
+    return os.environ.get("PYTEST_XDIST_WORKER")
+
+def _hypothesis_test(obj):
+    # the @given test under decorators that keep __wrapped__ (model_shrink)
+    while obj is not None and not getattr(obj, "is_hypothesis_test", False):
+        obj = getattr(obj, "__wrapped__", None)
+    return obj
+
+def pytest_addoption(parser):
+    group = parser.getgroup("daml_pbt")
+    group.addoption("--daml-max-inflight", type=int, default=0,
+                    help="max concurrent JSON API requests per ledger, shared by all xdist workers (0: no cap)")
+    group.addoption("--daml-ledgers", default=None,
+                    help="comma-separated JSON API base URLs to shard tests across (default: $DAML_PBT_LEDGERS or BASE)")
+    group.addoption("--daml-dar", default=None,
+                    help="comma-separated DARs to upload to every ledger before the run (one per suite run)")
+    group.addoption("--daml-fake", action="store_true", default=False,
+                    help="run against an in-process fake JSON API (daml_pbt.fake) instead of a ledger")
+    group.addoption("--daml-record", default=None, metavar="CASSETTE",
+                    help="append all ledger requests and responses to CASSETTE (daml_pbt.cassette)")
+    group.addoption("--daml-replay", default=None, metavar="CASSETTE",
+                    help="answer ledger requests from CASSETTE instead of a ledger")
+    group.addoption("--daml-export-scripts", nargs="?", const="", default=None, metavar="DIR",
+                    help="write each failing example as a Daml Script module to DIR "
+                         "(default: .daml_pbt/counterexamples/ next to the suite's daml.yaml, a Daml project of its own)")
+    group.addoption("--daml-shrink", choices=("ledger", "model"), default="ledger",
+                    help="shrink failing examples on the ledger, or on the contract models first and confirm "
+                         "the result on the ledger (daml_pbt.shrink)")
+    group.addoption("--daml-prevalidate", action="store_true", default=False,
+                    help="drop commands that the schema or a declared @precondition says the ledger will refuse, "
+                         "instead of sending them (per test: @prevalidated())")
+    group.addoption("--daml-report-dir", default=".daml_pbt",
+                    help="where per-worker and merged ledger timing reports are written")
+
+def pytest_configure(config):
+    worker = _worker_id()
+    if worker:
+        _pbt.APP_ID = f"pbt-tests-{worker}"
+        _pbt.PARTY_NAMESPACE = worker
+    if config.getoption("daml_prevalidate", False):
+        use_prevalidation(True)
+    limit = config.getoption("daml_max_inflight", 0)
+    if limit:
+        set_max_inflight(limit)
+    ledgers = config.getoption("daml_ledgers", None)
+    record, replay = config.getoption("daml_record", None), config.getoption("daml_replay", None)
+    if record and replay:
+        raise pytest.UsageError("--daml-record and --daml-replay are mutually exclusive")
+    seed = config.getoption("hypothesis_seed", None)
+    with contextlib.suppress(TypeError, ValueError):
+        seed = int(seed)  # as Hypothesis reads --hypothesis-seed
+    config._daml_seed = seed  # parallel_given and friends draw with it too
+    if record or replay:
+        use_cassette(Cassette(record or replay, "record" if record else "replay", seed=seed))
+    scripts = config.getoption("daml_export_scripts", None)
+    if scripts is not None:
+        use_script_exporter(ScriptExporter(scripts or None))
+    if config.getoption("daml_fake", False):
+        # one in-process ledger per process; contracts come from fake.REGISTRY,
+        # with the models of the benchmark contracts where nothing else is registered
+        models.register_all(replace=False)
+        config._daml_fake = FakeLedger().start()
+        ledgers = config._daml_fake.base
+    elif config.getoption("daml_shrink", "ledger") == "model" and not (record or replay):
+        use_model_shrinking(models.register_all(replace=False))
+    if ledgers:
+        set_ledgers([b.strip() for b in ledgers.split(",") if b.strip()])
+    dars = config.getoption("daml_dar", None)
+    fake = getattr(config, "_daml_fake", None)
+    if dars and not replay and (fake is not None or not worker):  # each worker has its own fake
+        for dar in dars.split(","):
+            if dar.strip():
+                ledger_pool().upload_dar(dar.strip())
+    report_dir = config.getoption("daml_report_dir", None)
+    if report_dir and not worker:
+        # controller: drop reports left over from a previous run
+        os.makedirs(report_dir, exist_ok=True)
+        for f in glob.glob(os.path.join(report_dir, "timings-*.json")):
+            os.remove(f)
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_call(item):
+    seed = _begin_test(item.nodeid, getattr(item.config, "_daml_seed", None))
+    test = _hypothesis_test(getattr(item, "obj", None))
+    if test is not None:
+        # examples keyed by their drawn arguments in the cassette, replayed under the recorded seed
+        _track_examples(test, item.fixturenames)
+        if seed is not None:
+            hseed(seed)(test)
+    pool = ledger_pool()
+    with pool.pin() if len(pool.clients) > 1 else contextlib.nullcontext():
+        outcome = yield
+    if _pbt._scripts is not None and outcome.excinfo is not None:
+        try:
+            path = _pbt._scripts.export(item.nodeid, outcome.excinfo[1], str(item.path))
+        except ScriptExportError as e:
+            item.add_report_section("call", "daml script", f"not exported: {e}")
+        else:
+            if path:
+                item.add_report_section("call", "daml script", f"counterexample written to {path}")
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    # --daml-shrink=model: plain @given tests shrink on the models first
+    test = pyfuncitem.obj
+    if _pbt._shrink_models is None or not getattr(test, "is_hypothesis_test", False) or getattr(test, "_daml_pbt_shrink", False):
+        return None
+    # the fixtures the test asks for; @given leaves the drawn arguments out of its signature
+    shrink_on_model(test, registry=_pbt._shrink_models,
+                    **{name: pyfuncitem.funcargs[name] for name in inspect.signature(test).parameters})
+    return True
+
+def pytest_collection_finish(session):
+    # a PKG the ledger does not have (stale build, DAR never uploaded) fails
+    # the run before any example
+    seen = set()
+    for item in session.items:
+        mod = getattr(item, "module", None)
+        if mod is None or mod in seen or not isinstance(getattr(mod, "PKG", None), str):
+            continue
+        seen.add(mod)
+        fake = getattr(session.config, "_daml_fake", None)
+        if fake is not None and not session.config.getoption("daml_dar", None):
+            # no --daml-dar: the fake has what each module was built against
+            fake.packages.add(mod.PKG)
+        try:
+            check_package(mod.PKG)
+        except StalePackageError as e:
+            raise pytest.UsageError(f"{mod.__name__}: {e.message}") from e
+
+def pytest_sessionfinish(session):
+    if _pbt._cassette is not None:
+        use_cassette(None).close()
+    fake = getattr(session.config, "_daml_fake", None)
+    if fake is not None:
+        fake.close()
+    report_dir = session.config.getoption("daml_report_dir", None)
+    report = timing_report()
+    if not report_dir or not report:
+        return
+    os.makedirs(report_dir, exist_ok=True)
+    with open(os.path.join(report_dir, f"timings-{_worker_id() or 'main'}.json"), "w") as f:
+        json.dump(report, f)
+
+def merge_timings(report_dir: str) -> dict:
+    merged: dict[str, dict] = {}
+    for name in sorted(glob.glob(os.path.join(report_dir, "timings-*.json"))):
+        with open(name) as f:
+            for path, t in json.load(f).items():
+                m = merged.setdefault(path, {"calls": 0, "seconds": 0.0})
+                m["calls"] += t["calls"]
+                m["seconds"] += t["seconds"]
+    return merged
+
+def pytest_terminal_summary(terminalreporter, config):
+    report_dir = config.getoption("daml_report_dir", None)
+    if _worker_id() or not report_dir:
+        return
+    merged = merge_timings(report_dir)
+    if not merged:
+        return
+    with open(os.path.join(report_dir, "timings.json"), "w") as f:
+        json.dump(merged, f, indent=2)
+    tr = terminalreporter
+    tr.section("daml_pbt ledger timings")
+    for path, t in sorted(merged.items(), key=lambda kv: -kv[1]["seconds"]):
+        tr.write_line(f"{path:<24} {t['calls']:8d} calls {t['seconds']:10.2f} s {t['seconds'] * 1000 / t['calls']:8.1f} ms/call")
@@ -0,0 +1,493 @@
+# Payload codecs and Hypothesis strategies derived from the Daml-LF in the DAR.
+#
+#   SCHEMA = load_schema(__file__)
+#   payload = SCHEMA.encode_payload(TID, {"owner": alice, "balances": [("USD", Decimal("1.5"))]})
+#   @given(arg=SCHEMA.arguments(TID, "Deposit", amount=st.decimals("0.01", "100", places=2)))
+#
+# Python side of each Daml type:
+#   Int64 -> int, Numeric/Decimal -> Decimal, Text/Party/ContractId -> str,
+#   Date -> date, Timestamp -> datetime (UTC), Unit -> {}, List -> list,
+#   Optional a -> None | a (Some(a) when a is itself Optional), TextMap/GenMap -> dict,
+#   records -> dict, DA.Types tuples -> tuple, variants -> {"tag", "value"},
+#   enums -> constructor name.
+# checker(t) validates a JSON API value against its type the way the ledger
+# would (used by daml_pbt's pre-validation; raises SchemaMismatch).
+# Encoders and decoders are compiled once per (instantiated) type: records and
+# tuples become one generated function building a literal, like the
+# hand-written payload dicts, and types whose JSON and Python forms coincide
+# compile to the identity and are inlined away.
+import datetime, json, threading
+from decimal import Decimal
+from typing import NamedTuple
+
+from hypothesis import strategies as st
+
+from . import _dars, find_dar, read_dar
+
+class SchemaMismatch(ValueError):
+    # a value the JSON API would refuse for its Daml type, at `path` ("balances[0]._2")
+    def __init__(self, problem: str, path: str = ""):
+        super().__init__(f"{path}: {problem}" if path else problem)
+        self.problem, self.path = problem, path
+
+class Some(NamedTuple):
+    # Some(x) of a nested Optional: None, Some(None) and Some(x) encode differently
+    value: object
+
+def _identity(v):
+    return v
+
+def _key(t: dict) -> str:
+    return json.dumps(t, sort_keys=True, separators=(",", ":"))
+
+def _subst(t: dict, env: dict) -> dict:
+    if not env:
+        return t
+    if "var" in t:
+        return env.get(t["var"], t)
+    if "args" in t and t["args"]:
+        return {**t, "args": [_subst(a, env) for a in t["args"]]}
+    return t
+
+def _is_optional(t: dict) -> bool:
+    return t.get("prim") == "Optional"
+
+def _literal(name: str, items: list, as_tuple: bool = False):
+    # items: [(key, source expression, converter)] -> def name(v): return {key: converter(source), ...}
+    ns: dict = {}
+    parts = []
+    for i, (key, src, fn) in enumerate(items):
+        if fn is not _identity:
+            ns[f"_f{i}"] = fn
+            src = f"_f{i}({src})"
+        parts.append(src if as_tuple else f"{key!r}: {src}")
+    body = f"({', '.join(parts)},)" if as_tuple else "{" + ", ".join(parts) + "}"
+    exec(f"def {name}(v):\n    return {body}\n", ns)
+    return ns[name]
+
+def _numeric(v) -> str:
+    s = str(v)
+    if "E" in s or "e" in s:  # the JSON API takes no exponents: 1E+2, 1e-07
+        return format(Decimal(s), "f")
+    return s
+
+def _timestamp(v: datetime.datetime) -> str:
+    if v.tzinfo is not None:
+        v = v.astimezone(datetime.timezone.utc)
+    return v.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+def _parse_timestamp(v: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(v.replace("Z", "+00:00"))
+
+def _expect(ok: bool, v, what: str) -> None:
+    if not ok:
+        raise SchemaMismatch(f"expected {what}, got {v!r}")
+
+def _check_int64(v) -> None:
+    try:
+        n = int(v) if isinstance(v, (int, str)) and not isinstance(v, bool) else None
+    except ValueError:
+        n = None
+    _expect(n is not None and -2**63 <= n < 2**63, v, "Int64")
+
+def _numeric_checker(scale: int):
+    bound = Decimal(10) ** (38 - scale)
+    def check(v) -> None:
+        try:
+            d = Decimal(str(v)) if isinstance(v, (str, int, float)) and not isinstance(v, bool) else None
+        except ArithmeticError:
+            d = None
+        _expect(d is not None and d.is_finite(), v, f"Numeric {scale}")
+        _expect(abs(d) < bound, v, f"Numeric {scale} below 10^{38 - scale}")
+        _expect(d == 0 or d.normalize().as_tuple().exponent >= -scale, v, f"at most {scale} decimal places")
+    return check
+
+def _parses(parse, what: str):
+    def check(v) -> None:
+        try:
+            ok = isinstance(v, str) and parse(v) is not None
+        except ValueError:
+            ok = False
+        _expect(ok, v, what)
+    return check
+
+_PRIM_CHECK = {
+    "Unit": lambda v: _expect(v == {}, v, "{} (Unit)"),
+    "Bool": lambda v: _expect(isinstance(v, bool), v, "Bool"),
+    "Int64": _check_int64,
+    "Text": lambda v: _expect(isinstance(v, str), v, "Text"),
+    "Party": lambda v: _expect(isinstance(v, str) and v != "", v, "a Party"),
+    "ContractId": lambda v: _expect(isinstance(v, str) and v != "", v, "a ContractId"),
+    "Date": _parses(datetime.date.fromisoformat, "a Date (YYYY-MM-DD)"),
+    "Timestamp": _parses(_parse_timestamp, "a Timestamp (ISO 8601)"),
+}
+
+def _at(path: str, check, v) -> None:
+    try:
+        check(v)
+    except SchemaMismatch as e:
+        sep = "" if not e.path or e.path.startswith("[") else "."
+        raise SchemaMismatch(e.problem, f"{path}{sep}{e.path}") from None
+
+_PRIM_ENC = {
+    "Unit": lambda v: {}, "Bool": bool, "Int64": str, "Text": _identity, "Party": _identity,
+    "ContractId": _identity, "Numeric": _numeric, "Decimal": _numeric, "Date": lambda v: v.isoformat(),
+    "Timestamp": _timestamp,
+}
+_PRIM_DEC = {
+    "Unit": lambda v: {}, "Bool": bool, "Int64": int, "Text": _identity, "Party": _identity,
+    "ContractId": _identity, "Numeric": Decimal, "Decimal": Decimal, "Date": datetime.date.fromisoformat,
+    "Timestamp": _parse_timestamp,
+}
+
+class Schema:
+    # Templates, choices and serializable data types of one DAR (see read_dar).
+    def __init__(self, info: dict, max_list: int = 5, parties: st.SearchStrategy | None = None):
+        self.info = info
+        self.package_id = info["package_id"]
+        self.types: dict[str, dict] = info["types"]
+        self.max_list = max_list
+        # drawn Party values, e.g. st.sampled_from(roles) of parties allocated
+        # up front; None: every Party field must be overridden
+        self.parties = parties
+        self._enc: dict[str, object] = {}
+        self._dec: dict[str, object] = {}
+        self._chk: dict[str, object] = {}
+        self._strats: dict[str, st.SearchStrategy] = {}
+
+    # --- signatures ---------------------------------------------------------
+
+    def template(self, template_id: str) -> str:
+        # "<pkg>:Module:Entity", "Module:Entity" or "Entity" -> "Module:Entity"
+        parts = template_id.split(":")
+        if len(parts) == 3:
+            if parts[0] != self.package_id:
+                raise KeyError(f"{template_id} is not in package {self.package_id}")
+            parts = parts[1:]
+        name = ":".join(parts)
+        matches = [t for t in self.info["templates"] if t == name or t.split(":", 1)[1] == name]
+        if len(matches) != 1:
+            raise KeyError(f"template {template_id!r} {'is ambiguous' if matches else 'not found'}; "
+                           f"templates: {sorted(self.info['templates'])}")
+        return matches[0]
+
+    def choice(self, template_id: str, choice: str) -> dict:
+        choices = self.info["templates"][self.template(template_id)]["choices"]
+        if choice not in choices:
+            raise KeyError(f"{template_id} has no choice {choice!r}; choices: {sorted(choices)}")
+        return choices[choice]
+
+    def payload_type(self, template_id: str) -> dict:
+        return {"con": f"{self.package_id}:{self.template(template_id)}", "args": []}
+
+    def argument_type(self, template_id: str, choice: str) -> dict:
+        return self.choice(template_id, choice)["arg"]
+
+    def result_type(self, template_id: str, choice: str) -> dict:
+        return self.choice(template_id, choice)["ret"]
+
+    def _data_type(self, t: dict) -> tuple[dict, dict]:
+        try:
+            dt = self.types[t["con"]]
+        except KeyError:
+            raise KeyError(f"no serializable data type {t['con']} in the DAR") from None
+        return dt, dict(zip(dt["params"], t["args"]))
+
+    @staticmethod
+    def _is_tuple(t: dict) -> bool:
+        _, module, entity = t["con"].split(":")
+        return module == "DA.Types" and entity.startswith("Tuple")
+
+    # --- codecs -------------------------------------------------------------
+
+    def _compiled(self, cache: dict, t: dict, compile_):
+        k = _key(t)
+        fn = cache.get(k)
+        if fn is None:
+            cell = []
+            cache[k] = lambda v: cell[0](v)  # recursive types call back through here
+            try:
+                fn = compile_(t)
+            except Exception:
+                del cache[k]  # or the next call gets the placeholder, with an empty cell
+                raise
+            cell.append(fn)
+            cache[k] = fn
+        return fn
+
+    def encoder(self, t: dict):
+        # Python value -> JSON API (LF-JSON) value, for Daml type `t`
+        return self._compiled(self._enc, t, self._compile_encoder)
+
+    def decoder(self, t: dict):
+        # JSON API value -> Python value, for Daml type `t`
+        return self._compiled(self._dec, t, self._compile_decoder)
+
+    def _compile_encoder(self, t: dict):
+        if "prim" in t:
+            name, args = t["prim"], t["args"]
+            if name in _PRIM_ENC:
+                return _PRIM_ENC[name]
+            if name == "List":
+                inner = self.encoder(args[0])
+                return list if inner is _identity else lambda v: [inner(x) for x in v]
+            if name == "Optional":
+                inner = self.encoder(args[0])
+                if _is_optional(args[0]):
+                    return lambda v: None if v is None else [] if v.value is None else [inner(v.value)]
+                return inner if inner is _identity else lambda v: None if v is None else inner(v)
+            if name == "TextMap":
+                inner = self.encoder(args[0])
+                return lambda v: {k: inner(x) for k, x in v.items()}
+            if name == "GenMap":
+                kenc, venc = self.encoder(args[0]), self.encoder(args[1])
+                return lambda v: [[kenc(k), venc(x)] for k, x in v.items()]
+            raise TypeError(f"{name} is not serializable")
+        if "con" in t:
+            dt, env = self._data_type(t)
+            if "enum" in dt:
+                return _identity
+            fields = [(n, _subst(ft, env)) for n, ft in dt.get("record", dt.get("variant", []))]
+            if "variant" in dt:
+                ctors = {n: self.encoder(ft) for n, ft in fields}
+                return lambda v: {"tag": v["tag"], "value": ctors[v["tag"]](v["value"])}
+            if self._is_tuple(t):
+                return _literal("encode", [(n, f"v[{i}]", self.encoder(ft)) for i, (n, ft) in enumerate(fields)])
+            # Optional fields may be left out of the Python dict
+            return _literal("encode", [(n, f"v.get({n!r})" if _is_optional(ft) else f"v[{n!r}]", self.encoder(ft))
+                                       for n, ft in fields])
+        return _identity  # unbound type variable: passed through as given
+
+    def _compile_decoder(self, t: dict):
+        if "prim" in t:
+            name, args = t["prim"], t["args"]
+            if name in _PRIM_DEC:
+                return _PRIM_DEC[name]
+            if name == "List":
+                inner = self.decoder(args[0])
+                return list if inner is _identity else lambda v: [inner(x) for x in v]
+            if name == "Optional":
+                inner = self.decoder(args[0])
+                if _is_optional(args[0]):
+                    return lambda v: None if v is None else Some(inner(v[0]) if v else None)
+                return inner if inner is _identity else lambda v: None if v is None else inner(v)
+            if name == "TextMap":
+                inner = self.decoder(args[0])
+                return lambda v: {k: inner(x) for k, x in v.items()}
+            if name == "GenMap":
+                kdec, vdec = self.decoder(args[0]), self.decoder(args[1])
+                return lambda v: {kdec(k): vdec(x) for k, x in v}
+            raise TypeError(f"{name} is not serializable")
+        if "con" in t:
+            dt, env = self._data_type(t)
+            if "enum" in dt:
+                return _identity
+            fields = [(n, _subst(ft, env)) for n, ft in dt.get("record", dt.get("variant", []))]
+            if "variant" in dt:
+                ctors = {n: self.decoder(ft) for n, ft in fields}
+                return lambda v: {"tag": v["tag"], "value": ctors[v["tag"]](v["value"])}
+            # the JSON API may leave out Optional fields that are None
+            return _literal("decode", [(n, f"v.get({n!r})" if _is_optional(ft) else f"v[{n!r}]", self.decoder(ft))
+                                       for n, ft in fields], as_tuple=self._is_tuple(t))
+        return _identity
+
+    def checker(self, t: dict):
+        # JSON API value -> None, or SchemaMismatch naming the offending field
+        return self._compiled(self._chk, t, self._compile_checker)
+
+    def _compile_checker(self, t: dict):
+        if "prim" in t:
+            name, args = t["prim"], t["args"]
+            if name in _PRIM_CHECK:
+                return _PRIM_CHECK[name]
+            if name in ("Numeric", "Decimal"):
+                return _numeric_checker(args[0]["nat"] if args else 10)
+            if name == "List":
+                inner = self.checker(args[0])
+                def check_list(v):
+                    _expect(isinstance(v, list), v, "a List")
+                    for i, x in enumerate(v):
+                        _at(f"[{i}]", inner, x)
+                return check_list
+            if name == "Optional":
+                inner = self.checker(args[0])
+                if _is_optional(args[0]):
+                    def check_nested(v):
+                        if v is not None:
+                            _expect(isinstance(v, list) and len(v) <= 1, v, "null, [] or [x] (nested Optional)")
+                            if v:
+                                inner(v[0])
+                    return check_nested
+                return lambda v: None if v is None else inner(v)
+            if name == "TextMap":
+                inner = self.checker(args[0])
+                def check_textmap(v):
+                    _expect(isinstance(v, dict), v, "a TextMap")
+                    for k, x in v.items():
+                        _at(k, inner, x)
+                return check_textmap
+            if name == "GenMap":
+                kchk, vchk = self.checker(args[0]), self.checker(args[1])
+                def check_genmap(v):
+                    _expect(isinstance(v, list) and all(isinstance(e, list) and len(e) == 2 for e in v), v,
+                            "a GenMap ([[key, value], ...])")
+                    for i, (k, x) in enumerate(v):
+                        _at(f"[{i}]", kchk, k)
+                        _at(f"[{i}]", vchk, x)
+                return check_genmap
+            raise TypeError(f"{name} is not serializable")
+        if "con" in t:
+            dt, env = self._data_type(t)
+            if "enum" in dt:
+                ctors = frozenset(dt["enum"])
+                return lambda v: _expect(v in ctors, v, f"one of {sorted(ctors)}")
+            fields = [(n, _subst(ft, env)) for n, ft in dt.get("record", dt.get("variant", []))]
+            checks = {n: self.checker(ft) for n, ft in fields}
+            if "variant" in dt:
+                def check_variant(v):
+                    _expect(isinstance(v, dict) and v.get("tag") in checks, v, f"a variant tagged {sorted(checks)}")
+                    _at(v["tag"], checks[v["tag"]], v.get("value"))
+                return check_variant
+            required = frozenset(n for n, ft in fields if not _is_optional(ft))
+            def check_record(v):
+                _expect(isinstance(v, dict), v, f"a {t['con'].split(':', 1)[1]} record")
+                missing, unknown = required - v.keys(), v.keys() - checks.keys()
+                if missing or unknown:
+                    raise SchemaMismatch(f"{t['con'].split(':', 1)[1]}: " + "; ".join(
+                        ([f"missing {sorted(missing)}"] if missing else []) +
+                        ([f"unknown {sorted(unknown)}"] if unknown else [])))
+                for n, x in v.items():
+                    _at(n, checks[n], x)
+            return check_record
+        return lambda v: None  # unbound type variable
+
+    def encode_payload(self, template_id: str, value: dict) -> dict:
+        return self.encoder(self.payload_type(template_id))(value)
+
+    def decode_payload(self, template_id: str, payload: dict) -> dict:
+        return self.decoder(self.payload_type(template_id))(payload)
+
+    def encode_argument(self, template_id: str, choice: str, value: dict) -> dict:
+        return self.encoder(self.argument_type(template_id, choice))(value)
+
+    def decode_result(self, template_id: str, choice: str, result):
+        return self.decoder(self.result_type(template_id, choice))(result)
+
+    # --- strategies ---------------------------------------------------------
+
+    def strategy(self, t: dict) -> st.SearchStrategy:
+        # Python values of Daml type `t`. Parties come from self.parties and
+        # contract ids cannot be invented: override those fields where needed.
+        k = _key(t)
+        s = self._strats.get(k)
+        if s is None:
+            self._strats[k] = st.deferred(lambda: self._strats[k])  # recursive types
+            try:
+                s = self._strats[k] = self._compile_strategy(t)
+            except Exception:
+                del self._strats[k]
+                raise
+        return s
+
+    def _compile_strategy(self, t: dict) -> st.SearchStrategy:
+        if "prim" in t:
+            name, args = t["prim"], t["args"]
+            if name == "Unit":
+                return st.just({})
+            if name == "Bool":
+                return st.booleans()
+            if name == "Int64":
+                return st.integers(-2**63, 2**63 - 1)
+            if name in ("Numeric", "Decimal"):
+                scale = args[0]["nat"] if args else 10
+                bound = Decimal(10) ** (38 - scale) - 1
+                return st.decimals(-bound, bound, places=scale, allow_nan=False, allow_infinity=False)
+            if name == "Text":
+                return st.text()
+            if name == "Party":
+                if self.parties is None:
+                    raise TypeError("no strategy for Party values: pass parties= to load_schema, e.g. "
+                                    "st.sampled_from of parties allocated up front, or override the field")
+                return self.parties
+            if name == "ContractId":
+                return st.nothing()
+            if name == "Date":
+                return st.dates()
+            if name == "Timestamp":
+                return st.datetimes(timezones=st.just(datetime.timezone.utc))
+            if name == "List":
+                return st.lists(self.strategy(args[0]), max_size=self.max_list)
+            if name == "Optional":
+                inner = self.strategy(args[0])
+                return st.none() | (inner.map(Some) if _is_optional(args[0]) else inner)
+            if name == "TextMap":
+                return st.dictionaries(st.text(), self.strategy(args[0]), max_size=self.max_list)
+            if name == "GenMap":
+                return st.dictionaries(self.strategy(args[0]), self.strategy(args[1]), max_size=self.max_list)
+            raise TypeError(f"{name} is not serializable")
+        if "con" in t:
+            dt, env = self._data_type(t)
+            if "enum" in dt:
+                return st.sampled_from(dt["enum"])
+            fields = [(n, self.strategy(_subst(ft, env))) for n, ft in dt.get("record", dt.get("variant", []))]
+            if "variant" in dt:
+                return st.one_of([s.map(lambda v, n=n: {"tag": n, "value": v}) for n, s in fields])
+            if self._is_tuple(t):
+                return st.tuples(*(s for _, s in fields))
+            return st.fixed_dictionaries(dict(fields))
+        raise TypeError(f"cannot generate values of unbound type {t}")
+
+    def _record(self, t: dict, overrides: dict) -> st.SearchStrategy:
+        if not overrides:
+            return self.strategy(t)
+        dt, env = self._data_type(t)
+        names = [n for n, _ in dt.get("record", [])]
+        unknown = set(overrides) - set(names)
+        if unknown:
+            raise KeyError(f"{t['con']} has no field(s) {sorted(unknown)}; fields: {names}")
+        return st.fixed_dictionaries({
+            n: (overrides[n] if isinstance(overrides[n], st.SearchStrategy) else st.just(overrides[n]))
+            if n in overrides else self.strategy(_subst(ft, env))
+            for n, ft in dt["record"]})
+
+    def payloads(self, template_id: str, **overrides) -> st.SearchStrategy:
+        # Template payloads (Python form); overrides are strategies or constants by field name.
+        return self._record(self.payload_type(template_id), overrides)
+
+    def arguments(self, template_id: str, choice: str, **overrides) -> st.SearchStrategy:
+        return self._record(self.argument_type(template_id, choice), overrides)
+
+_schemas: dict[str, Schema] = {}
+_schemas_lock = threading.Lock()
+
+def load_schema(start: str, parties: st.SearchStrategy | None = None) -> Schema:
+    # SCHEMA = load_schema(__file__): the Schema of the DAR of the Daml
+    # project `start` is in (FileNotFoundError if it has none); one Schema
+    # (and codec cache) per package. `parties` replaces the strategy for
+    # drawn Party values.
+    schema = _schema(read_dar(find_dar(start)))
+    if parties is not None and parties is not schema.parties:
+        schema.parties = parties
+        schema._strats.clear()  # compiled with the old one
+    return schema
+
+def schema_for(template_id: str | None) -> Schema | None:
+    # The Schema of the package of `template_id` ("<pkg>:Module:Entity"),
+    # from the DAR this process read it in (package_id(__file__),
+    # load_schema, a FakeLedger's dar=), never from the working directory.
+    # None for an unqualified id or a package no DAR read here has.
+    if not template_id or template_id.count(":") != 2:
+        return None
+    pkg = template_id.split(":", 1)[0]
+    schema = _schemas.get(pkg)
+    if schema is None:
+        info = next((i for i in list(_dars.values()) if i["package_id"] == pkg), None)
+        schema = _schema(info) if info is not None else None
+    return schema
+
+def _schema(info: dict) -> Schema:
+    with _schemas_lock:
+        schema = _schemas.get(info["package_id"])
+        if schema is None:
+            schema = _schemas[info["package_id"]] = Schema(info)
+    return schema
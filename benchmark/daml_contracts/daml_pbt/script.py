@@ -0,0 +1,465 @@
+# Daml Script export of failing examples, to replay a counterexample with
+# `daml test` on the IDE ledger instead of through the sandbox and JSON API:
+#
+#   pytest tests/ --daml-export-scripts        # into .daml_pbt/counterexamples/
+#   pytest tests/ --daml-export-scripts=out/   # or into out/
+#
+# Every party allocation, create, exercise and create-and-exercise a
+# DamlClient sends is logged per example (reads are not: they change
+# nothing). When a test fails, the log of its last (shrunk) example becomes
+# the module Counterexamples.<TestName> of a Daml project of its own next to
+# the suite's daml.yaml, with the suite's DAR as a data-dependency (the
+# layout DamlScriptRunner builds), so the suite's own `daml build` and package
+# id are untouched, e.g. .daml_pbt/counterexamples/daml/Counterexamples/TestDepositIncreasesBalance.daml:
+#
+#   operator <- allocateParty "Operator"
+#   userBalance <- submit operator do
+#     createAndExerciseCmd
+#       (Bank with operator = operator)
+#       (OpenAccount with user = operator)
+#
+# Values are written from their Daml types in the DAR (see daml_pbt.schema).
+# Commands the ledger rejected become submitMustFail, except a rejection that
+# failed the test: that one stays a submit, so the script fails where the
+# test did. Results other than contract ids are printed with `debug`; the
+# Python assertions are not translated, the failure message heads the module.
+# A contract an exercise created without returning its id is looked up by
+# payload (queryFilter) where it is used. Works on --daml-replay as well.
+import datetime, os, re, threading
+from decimal import Decimal
+
+from . import CommandRejected, _error_text, _example_state, _party_of, find_dar, read_dar
+from .fake import _claims
+from .schema import _is_optional, _parse_timestamp, _subst, schema_for
+
+class ScriptExportError(ValueError):
+    # the example cannot be written as Daml Script (no DAR, a contract from outside it)
+    pass
+
+_COMMANDS = ("/parties/allocate", "/create", "/exercise", "/create-and-exercise")
+
+_RESERVED = frozenset((
+    "as", "case", "choice", "class", "controller", "data", "do", "else", "ensure", "exception", "if", "import",
+    "in", "instance", "interface", "key", "let", "maintainer", "module", "observer", "of", "qualified", "script",
+    "signatory", "template", "then", "this", "type", "where", "with",
+))
+
+_MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+class CommandLog:
+    # The commands of one example run, in the order their responses came back.
+    def __init__(self, test: str):
+        self.test = test
+        self.entries: list[dict] = []
+        self._lock = threading.Lock()
+
+    def note(self, path: str, body: dict, act_as: list, read_as: list, ok: bool, result,
+             error: str | None = None) -> None:
+        with self._lock:
+            self.entries.append({"path": path, "body": body, "act_as": act_as, "read_as": read_as,
+                                 "ok": ok, "result": result, "error": error})
+
+def _atom(s: str) -> str:
+    # parenthesize unless s is one token or one bracketed group
+    depth, in_str, esc = 0, False, False
+    for ch in s:
+        if in_str:
+            if esc:
+                esc = False
+            elif ch == "\\":
+                esc = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch in "([":
+            depth += 1
+        elif ch in ")]":
+            depth -= 1
+        elif ch == " " and depth == 0:
+            return f"({s})"
+    return s
+
+def _text(s: str) -> str:
+    out = ['"']
+    for ch in s:
+        if ch in '"\\':
+            out.append("\\" + ch)
+        elif ch == "\n":
+            out.append("\\n")
+        elif ch == "\t":
+            out.append("\\t")
+        elif ord(ch) < 32 or ord(ch) == 127:
+            out.append(f"\\{ord(ch)}\\&")
+        else:
+            out.append(ch)
+    out.append('"')
+    return "".join(out)
+
+def _signed(s: str) -> str:
+    return f"({s})" if s.startswith("-") else s
+
+def _date(d: datetime.date) -> str:
+    return f"date {d.year} {_MONTHS[d.month - 1]} {d.day}"
+
+def _camel(name: str, upper: bool) -> str:
+    words = [w for w in re.split(r"[^0-9A-Za-z]+", name) if w]
+    s = "".join(w[:1].upper() + w[1:] for w in words) or "Example"
+    return s if upper else s[:1].lower() + s[1:]
+
+class _Writer:
+    # Renders one CommandLog; keeps the variable names of parties and contracts.
+    # With check=True every result and every contract the commands created is
+    # also asserted to be what the log recorded (daml_pbt.batch).
+    def __init__(self, schema, check: bool = False):
+        self.schema = schema
+        self.check = check
+        self.names: set[str] = set()
+        self.parties: dict[str, str] = {}
+        self.cids: dict[str, str] = {}
+        self.created: dict[str, tuple] = {}  # contract id -> (template id, payload, reader) of unbound contracts
+        self.imports = {"Daml.Script"}
+        self.preamble: list[str] = []
+        self.lines: list[str] = []
+        self.debug: tuple | None = None  # (variable, type, value) of the last command's result
+
+    def fresh(self, base: str) -> str:
+        base = _camel(base, upper=False)
+        if base[0].isdigit() or base in _RESERVED:
+            base = "x" + base[:1].upper() + base[1:]
+        name, i = base, 1
+        while name in self.names:
+            i += 1
+            name = f"{base}{i}"
+        self.names.add(name)
+        return name
+
+    def party(self, p: str) -> str:
+        v = self.parties.get(p)
+        if v is None:
+            # allocated outside this example (isolation("test"/"session"), a PartyPool)
+            hint = p.split("::")[0].split("-")[0]
+            v = self.parties[p] = self.fresh(hint)
+            self.preamble.append(f"  {v} <- allocateParty {_text(hint)}")
+        return v
+
+    def contract(self, cid: str) -> str:
+        v = self.cids.get(cid)
+        if v is not None:
+            return v
+        if cid not in self.created:
+            raise ScriptExportError(f"contract {cid} was not created in this example")
+        tid, payload, reader = self.created.pop(cid)
+        return self.lookup(cid, tid, payload, reader)
+
+    def lookup(self, cid: str, template_id: str, payload: dict, reader: str) -> str:
+        # bind a contract the script has no id for by its payload
+        entity = self.entity(template_id)
+        v = self.cids[cid] = self.fresh(entity)
+        self.lines.append(f"  ({v}, _) :: _ <- queryFilter @{entity} {reader} "
+                          f"(== {_atom(self.payload(template_id, payload))})")
+        return v
+
+    def entity(self, template_id: str) -> str:
+        key = self.schema.template(template_id)
+        self.imports.add(key.split(":")[0])
+        return key.split(":")[1]
+
+    def payload(self, template_id: str, payload: dict) -> str:
+        return self.value(self.schema.payload_type(template_id), payload)
+
+    def value(self, t: dict, v) -> str:
+        if "prim" in t:
+            name, args = t["prim"], t["args"]
+            if name == "Unit":
+                return "()"
+            if name == "Bool":
+                return "True" if v else "False"
+            if name == "Int64":
+                return _signed(str(int(v)))
+            if name in ("Numeric", "Decimal"):
+                s = format(Decimal(str(v)), "f")
+                return _signed(s if "." in s else s + ".0")
+            if name == "Text":
+                return _text(v)
+            if name == "Party":
+                return self.party(v)
+            if name == "ContractId":
+                return self.contract(v)
+            if name == "Date":
+                self.imports.add("DA.Date")
+                return _date(datetime.date.fromisoformat(v))
+            if name == "Timestamp":
+                self.imports.update(("DA.Date", "DA.Time"))
+                ts = _parse_timestamp(v).astimezone(datetime.timezone.utc)
+                s = f"time ({_date(ts.date())}) {ts.hour} {ts.minute} {ts.second}"
+                return f"addRelTime ({s}) (microseconds {ts.microsecond})" if ts.microsecond else s
+            if name == "List":
+                return "[" + ", ".join(_atom(self.value(args[0], x)) for x in v) + "]"
+            if name == "Optional":
+                if v is None:
+                    return "None"
+                if _is_optional(args[0]):  # Some None is [], Some x is [x]
+                    v = v[0] if v else None
+                return f"Some {_atom(self.value(args[0], v))}"
+            if name == "TextMap":
+                self.imports.add("qualified DA.TextMap as TextMap")
+                return "TextMap.fromList [" + ", ".join(
+                    f"({_text(k)}, {self.value(args[0], x)})" for k, x in v.items()) + "]"
+            if name == "GenMap":
+                self.imports.add("qualified DA.Map as Map")
+                return "Map.fromList [" + ", ".join(
+                    f"({self.value(args[0], k)}, {self.value(args[1], x)})" for k, x in v) + "]"
+            raise ScriptExportError(f"{name} is not serializable")
+        if "con" not in t:
+            raise ScriptExportError(f"unbound type variable {t.get('var')}")
+        dt, env = self.schema._data_type(t)
+        pkg, module, entity = t["con"].split(":")
+        if pkg == self.schema.package_id:
+            self.imports.add(module)
+        if "enum" in dt:
+            return v
+        fields = {n: _subst(ft, env) for n, ft in dt.get("record", dt.get("variant", []))}
+        if "variant" in dt:
+            ft = fields[v["tag"]]
+            if ft.get("prim") == "Unit":
+                return v["tag"]
+            if ft.get("con", "").endswith(f":{entity}.{v['tag']}"):  # constructor with record fields
+                return self.value(ft, v["value"])
+            return f"{v['tag']} {_atom(self.value(ft, v['value']))}"
+        if self.schema._is_tuple(t):
+            return "(" + ", ".join(self.value(ft, v[n]) for n, ft in fields.items()) + ")"
+        ctor = entity.split(".")[-1]
+        if not fields:
+            return ctor
+        return f"{ctor} with " + "; ".join(f"{n} = {_atom(self.value(ft, v.get(n)))}" for n, ft in fields.items())
+
+    def record_block(self, t: dict, v: dict, indent: str) -> str:
+        # "Ctor with" and one field per line, as in the hand-written test scripts
+        dt, env = self.schema._data_type(t)
+        fields = [(n, _subst(ft, env)) for n, ft in dt.get("record", [])]
+        ctor = t["con"].split(":")[2].split(".")[-1]
+        if t["con"].split(":")[0] == self.schema.package_id:
+            self.imports.add(t["con"].split(":")[1])
+        if not fields:
+            return ctor
+        return f"{ctor} with\n" + "\n".join(f"{indent}{n} = {self.value(ft, v.get(n))}" for n, ft in fields)
+
+    def submit(self, e: dict, must_fail: bool) -> str:
+        act = [self.party(p) for p in e["act_as"]]
+        read = [self.party(p) for p in e["read_as"]]
+        fail = "MustFail" if must_fail else ""
+        if len(act) == 1 and not read:
+            return f"submit{fail} {act[0]} do"
+        return f"submitMulti{fail} [{', '.join(act)}] [{', '.join(read)}] do"
+
+    def bind(self, template_id: str, choice: str | None, result, reader: str) -> str:
+        # "<var> <- " for a result the script can refer to, "" for Unit
+        if choice is None:
+            ret = {"prim": "ContractId", "args": [self.schema.payload_type(template_id)]}
+        elif choice == "Archive":
+            return ""
+        else:
+            ret = self.schema.result_type(template_id, choice)
+        if ret.get("prim") == "Unit":
+            return ""
+        if ret.get("prim") == "ContractId" and isinstance(result, str):
+            target = ret["args"][0]
+            v = self.cids[result] = self.fresh(target["con"].split(":")[2] if "con" in target else "cid")
+            self.created.pop(result, None)
+            return f"{v} <- "
+        v = self.fresh("result")
+        self.debug = (v, ret, result)
+        return f"{v} <- "
+
+    def note_events(self, result, reader: str) -> None:
+        readers = "[" + ", ".join(sorted(set(self.parties.values()))) + "]"
+        for ev in (result or {}).get("events") or []:
+            c = ev.get("created")
+            if not c:
+                continue
+            cid, tid, payload = c["contractId"], c["templateId"], c["payload"]
+            if not self.check:
+                if cid not in self.cids:
+                    self.created[cid] = (tid, payload, reader)
+            elif cid in self.cids:
+                v = self.fresh("payload")
+                self.lines.append(f"  {v} <- queryContractId {readers} {self.cids[cid]}")
+                self.lines.append(f"  assertEq {v} (Some {_atom(self.payload(tid, payload))})")
+            else:
+                self.lookup(cid, tid, payload, readers)
+
+    def show_result(self) -> None:
+        if self.debug is None:
+            return
+        v, ret, result = self.debug
+        if self.check:
+            try:
+                self.lines.append(f"  assertEq {v} {_atom(self.value(ret, result))}")
+                return
+            except ScriptExportError:  # refers to a contract the script cannot name
+                pass
+        self.lines.append(f"  debug {v}")
+
+    def command(self, e: dict, must_fail: bool) -> None:
+        body, path, res = e["body"], e["path"], e["result"]
+        if path == "/parties/allocate":
+            if not e["ok"]:
+                return
+            hint = str(body.get("identifierHint", "")).split("-")[0]
+            v = self.parties[res] = self.fresh(hint)
+            self.lines.append(f"  {v} <- allocateParty {_text(hint)}")
+            return
+        tid, choice = body["templateId"], body.get("choice")
+        if path == "/exercise":
+            cid = self.contract(body["contractId"])
+        submit = self.submit(e, must_fail)
+        reader = self.party(e["act_as"][0])
+        self.debug = None
+        bind = "" if not e["ok"] else self.bind(tid, choice, (res or {}).get(
+            "contractId" if path == "/create" else "exerciseResult"), reader)
+        if path == "/create":
+            cmd = f"createCmd {self.record_block(self.schema.payload_type(tid), body['payload'], '      ')}"
+        elif choice == "Archive":
+            cmd = f"exerciseCmd {cid} Archive"
+        else:
+            arg_type, arg = self.schema.argument_type(tid, choice), body.get("argument") or {}
+            if path == "/exercise":
+                cmd = f"exerciseCmd {cid} {self.record_block(arg_type, arg, '      ')}"
+            else:
+                cmd = f"createAndExerciseCmd\n      {_atom(self.payload(tid, body['payload']))}" \
+                      f"\n      {_atom(self.value(arg_type, arg))}"
+        self.lines.append(f"  {bind}{submit}\n    {cmd}")
+        if e["ok"] and not must_fail:
+            self.note_events(res, reader)
+        self.show_result()
+
+def _schema(logs: list[CommandLog]):
+    tids = [e["body"]["templateId"] for log in logs for e in log.entries if "templateId" in e["body"]]
+    schema = next((s for s in map(schema_for, tids) if s is not None), None)
+    if schema is None:
+        test = logs[0].test if logs else "the batch"
+        raise ScriptExportError(f"no DAR read by the tests has the templates of {test}" if tids
+                                else f"{test} sent no commands")
+    return schema
+
+def _module(header: list[str], module: str, imports: set[str], scripts: list[tuple[str, _Writer]]) -> str:
+    imports = sorted(imports - {"Daml.Script"}, key=lambda m: m.replace("qualified ", "~"))
+    out = [*header, "", f"module {module} where", "", "import Daml.Script", *[f"import {m}" for m in imports]]
+    for name, w in scripts:
+        out += ["", f"{name} : Script ()", f"{name} = script do", *w.preamble, *w.lines, "  pure ()"]
+    return "\n".join(out) + "\n"
+
+def render_script(log: CommandLog, module: str, name: str, failure: BaseException | None = None) -> str:
+    # The Daml Script module replaying `log` as the script `name`.
+    w = _Writer(_schema([log]))
+    entries = log.entries
+    last_failed = entries[-1]["path"] != "/parties/allocate" and not entries[-1]["ok"] if entries else False
+    for i, e in enumerate(entries):
+        culprit = last_failed and i == len(entries) - 1 and isinstance(failure, CommandRejected)
+        w.command(e, must_fail=not e["ok"] and not culprit)
+    header = [f"-- Counterexample for {log.test}, exported by daml_pbt."]
+    if failure is not None:
+        header.append("-- The Python test failed with:")
+        header += [f"--   {line}" for line in f"{type(failure).__name__}: {failure}".splitlines()[:12]]
+    return _module(header, module, w.imports, [(name, w)])
+
+def render_batch(logs: dict[str, CommandLog], module: str) -> str:
+    # One module with a script per log that replays its commands and asserts
+    # every result, rejection and created contract the log recorded.
+    schema = _schema(list(logs.values()))
+    imports: set[str] = set()
+    scripts = []
+    for name, log in logs.items():
+        w = _Writer(schema, check=True)
+        for e in log.entries:
+            w.command(e, must_fail=not e["ok"])
+        imports |= w.imports
+        scripts.append((name, w))
+    return _module([f"-- {len(logs)} example(s) checked by daml_pbt in one Daml Script run."], module, imports, scripts)
+
+def project_dir(start: str) -> str:
+    # the directory of the nearest daml.yaml above `start`
+    d = os.path.abspath(start)
+    if os.path.isfile(d):
+        d = os.path.dirname(d)
+    while not os.path.isfile(os.path.join(d, "daml.yaml")):
+        parent = os.path.dirname(d)
+        if parent == d:
+            raise ScriptExportError(f"no daml.yaml above {start}")
+        d = parent
+    return d
+
+def script_project(name: str, sdk: str, dar: str) -> str:
+    # daml.yaml of a project of scripts against `dar`, kept apart from the
+    # contract's own project so its package id and dependencies stay as they are
+    return (f"sdk-version: {sdk}\nname: {name}\nsource: daml\nversion: 0.0.1\n"
+            f"dependencies:\n  - daml-prim\n  - daml-stdlib\n  - daml-script\n"
+            f"data-dependencies:\n  - {dar}\n")
+
+class ScriptExporter:
+    # Keeps the command log of each example and writes the failing one out:
+    # the last example of the test that raised (Hypothesis ends on the
+    # shrunk one), else its last example.
+    def __init__(self, directory: str | None = None):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._latest: dict[str, CommandLog] = {}
+        self._failed: dict[str, CommandLog] = {}
+
+    def log(self) -> CommandLog:
+        # the log of the example running on this thread
+        state = _example_state()
+        with self._lock:
+            log = state.get("script")
+            if log is None:
+                log = state["script"] = CommandLog(state["test"])
+                self._latest[log.test] = log
+        return log
+
+    def failed(self, state: dict) -> None:
+        # the example of `state` raised (see daml_pbt._track_examples)
+        log = state.get("script")
+        if log is not None:
+            with self._lock:
+                self._failed[log.test] = log
+
+    def note(self, path: str, body: dict, headers: dict, r) -> None:
+        if path not in _COMMANDS:
+            return
+        claims = _claims(headers.get("Authorization"))
+        ok = r.status_code == 200
+        try:
+            result = r.json().get("result") if ok else None
+        except ValueError:
+            ok, result = False, None
+        if path == "/parties/allocate" and ok:
+            result = _party_of(result)
+        error = None if ok else _error_text(r)[0]
+        self.log().note(path, body, claims.get("actAs") or [], claims.get("readAs") or [], ok, result, error)
+
+    def export(self, test: str, failure: BaseException | None, start: str) -> str | None:
+        # Write the last (shrunk) example of `test` as Daml Script; its path, or None if it sent nothing.
+        with self._lock:
+            log = self._failed.pop(test, None) or self._latest.get(test)
+            self._latest.pop(test, None)
+        if log is None or not log.entries:
+            return None
+        name = test.split("::")[-1].split("[")[0]
+        module = f"Counterexamples.{_camel(name, upper=True)}"
+        text = render_script(log, module, _camel(name, upper=False), failure)
+        try:
+            dar = find_dar(start)
+        except FileNotFoundError as e:
+            raise ScriptExportError(str(e)) from e
+        sdk = read_dar(dar)["sdk_version"]
+        if not sdk:
+            raise ScriptExportError(f"{dar} does not name its SDK version")
+        directory = os.path.abspath(self.directory or os.path.join(project_dir(start), ".daml_pbt", "counterexamples"))
+        path = os.path.join(directory, "daml", *module.split(".")) + ".daml"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(os.path.join(directory, "daml.yaml"), "w") as f:
+            f.write(script_project("daml-pbt-counterexamples", sdk, os.path.relpath(os.path.abspath(dar), directory)))
+        with open(path, "w") as f:
+            f.write(text)
+        return path
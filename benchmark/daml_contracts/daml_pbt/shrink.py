@@ -0,0 +1,195 @@
+# Two-phase shrinking: minimize a ledger counterexample on the contract
+# models (daml_pbt.models) in memory, and send only the result back to the
+# ledger:
+#
+#   @model_shrink()                 # or `pytest --daml-shrink=model` for every test
+#   @given(desc=alpha, asking=money, offer=money, first_inspect=st.booleans())
+#   @settings(max_examples=12, deadline=None)
+#   def test_full_path_to_terminated_with_checks(desc, asking, offer, first_inspect): ...
+#
+# Hypothesis shrinks by rerunning the whole workflow for every candidate
+# (fresh parties, the create, every exercise), so a long test can take
+# hundreds of ledger transactions to minimize. Here the test runs under
+# Hypothesis as usual, with its own settings, but the examples change
+# ledgers: they run on the ledger until the first one fails. That example
+# is replayed right away on a FakeLedger answering in-process with the
+# models registered (fake.REGISTRY by default, or `registry=`). If it fails
+# there the same way (the same exception type raised from the same line,
+# which is how Hypothesis tells bugs apart), every later example, and so
+# the whole shrink, runs on the models. The example Hypothesis ends on then
+# runs once more on the ledger:
+#
+# - if it fails the same way, that is the counterexample;
+# - if it does not, or the model never failed, the model is wrong about this
+#   test: the test runs again on the ledger only, and the report says why.
+#
+# Only public Hypothesis API is used: the examples are redirected through
+# test.hypothesis.inner_test, which Hypothesis lets plugins replace, and
+# the last one is replayed by calling the test body with its drawn
+# arguments. parallel_given (under --daml-shrink=model) and
+# differential_given already know the test fails on the ledger; they start
+# on the models directly (explore=True).
+#
+# Nothing changes while a cassette records or replays: a replay follows the
+# recorded ledger shrink path and has no answers for any other.
+import contextlib, functools, traceback
+
+from hypothesis.errors import HypothesisException, UnsatisfiedAssumption
+
+from . import DamlClient, TransientError, _example_state, _in_scope, _scope, use_cassette, use_script_exporter
+from .fake import FakeLedger
+
+def model_shrink(registry=None):
+    # Goes above @given and @settings: shrink the test's failures on the
+    # models in `registry` first (see above).
+    def deco(test):
+        if not getattr(test, "is_hypothesis_test", False):
+            raise TypeError(f"@model_shrink goes above @given, not on {test.__qualname__}")
+
+        @functools.wraps(test)
+        def wrapper(*args, **kwargs):
+            shrink_on_model(test, *args, registry=registry, **kwargs)
+        wrapper._daml_pbt_shrink = True
+        return wrapper
+    return deco
+
+def shrink_on_model(test, *args, registry=None, explore: bool = False, **kwargs) -> None:
+    # Run the @given test `test`, shrinking a ledger failure on the models
+    # first. explore=True: `test` is known to fail on the ledger, so the
+    # failure is searched for on the models instead of on the ledger.
+    cassette = use_cassette(None)
+    use_cassette(cassette)
+    if cassette is not None:
+        return test(*args, **kwargs)
+    run = _Run(test, registry, on_model=explore)
+    try:
+        with run.redirected():
+            test(*args, **kwargs)
+        if not run.on_model:
+            return  # passed on the ledger, or failed there and was shrunk there (run.why says why)
+        why = "it passed on the models"
+    except Exception as e:
+        if not run.on_model:
+            if run.why is not None:
+                e.add_note(f"daml_pbt: shrunk on the ledger, the models are wrong about this test: {run.why}")
+            raise
+        model = e
+        if isinstance(model, (HypothesisException, BaseExceptionGroup)) or run.last is None:
+            why = f"the models raised {type(model).__name__}"
+        else:
+            try:
+                run.replay(*run.last)
+                why = "the example the models shrank it to passed on the ledger"
+            except Exception as e:
+                if _origin(e) == _origin(model):
+                    e.add_note(f"daml_pbt: shrunk on the contract models to {run.last[1]!r}, "
+                               f"confirmed on the ledger")
+                    raise e from model
+                if isinstance(e, TransientError):
+                    raise
+                why = f"the example the models shrank it to raised {type(e).__name__} on the ledger, " \
+                      f"{type(model).__name__} on the models"
+    finally:
+        run.close()
+
+    # the models disagree with the ledger: run on the ledger after all
+    note = f"daml_pbt: shrunk on the ledger, the models are wrong about this test: {why}"
+    run = _Run(test, registry, on_model=False, switch=False)
+    try:
+        with run.redirected():
+            test(*args, **kwargs)
+    except Exception as e:
+        e.add_note(note)
+        raise
+    if run.first is not None:
+        run.first.add_note(f"{note}; and it passed when replayed on the ledger")
+        raise run.first
+
+class _Run:
+    # One run of `test` whose examples go to the ledger or, once `on_model`,
+    # to a FakeLedger with the models of `registry`. `switch`: move to the
+    # models at the first ledger failure they reproduce.
+    def __init__(self, test, registry, on_model: bool, switch: bool = True):
+        self.test, self.registry, self.on_model, self.switch = test, registry, on_model, switch
+        self.first = None  # the first ledger failure
+        self.last = None   # (args, kwargs) of the last example that failed on the models
+        self.why = None    # why the first ledger failure stayed on the ledger
+        self.fake = None
+
+    @contextlib.contextmanager
+    def redirected(self):
+        hyp = self.test.hypothesis
+        self.inner = inner = hyp.inner_test
+
+        @functools.wraps(inner)
+        def example(*args, **kwargs):
+            if self.on_model:
+                try:
+                    with self.models():
+                        return inner(*args, **kwargs)
+                except Exception:
+                    self.last = (args, kwargs)
+                    raise
+            try:
+                return inner(*args, **kwargs)
+            except Exception as e:
+                if self.first is None and not isinstance(e, TransientError):
+                    self.first = e
+                    if self.switch:
+                        self.why = self.check(e, args, kwargs)
+                        self.on_model = self.why is None
+                raise
+        hyp.inner_test = example
+        try:
+            yield
+        finally:
+            hyp.inner_test = inner
+
+    def check(self, failure: Exception, args: tuple, kwargs: dict) -> str | None:
+        # None if the failing example fails the same way on the models, else why not
+        try:
+            with self.models():
+                self.inner(*args, **kwargs)
+        except UnsatisfiedAssumption:
+            return "the models rejected it"
+        except Exception as e:
+            if _origin(e) == _origin(failure):
+                self.last = (args, kwargs)
+                return None
+            return f"it raised {type(failure).__name__} on the ledger, {type(e).__name__} on the models"
+        return "it passed on the models"
+
+    def replay(self, args: tuple, kwargs: dict) -> None:
+        # one more run of an example on the ledger, outside Hypothesis
+        state = {"test": _example_state()["test"], "label": repr(kwargs)}
+        try:
+            _in_scope((getattr(_scope, "current", None), getattr(_scope, "client", None),
+                       getattr(_scope, "prevalidate", None), True, state), self.inner, *args, **kwargs)
+        except UnsatisfiedAssumption:
+            pass  # pre-validation rejected it on the ledger: not a failure
+
+    @contextlib.contextmanager
+    def models(self):
+        # this thread's requests go to an in-process FakeLedger, and are not
+        # logged for script export
+        if self.fake is None:
+            self.fake = FakeLedger(self.registry)
+        pinned = getattr(_scope, "client", None)
+        exporter = use_script_exporter(None)
+        try:
+            with DamlClient(self.fake.base, adapter=self.fake.adapter()) as client:
+                _scope.client = client
+                yield
+        finally:
+            _scope.client = pinned
+            use_script_exporter(exporter)
+
+    def close(self) -> None:
+        if self.fake is not None:
+            self.fake.close()
+            self.fake = None
+
+def _origin(e: BaseException) -> tuple:
+    # how Hypothesis tells bugs apart: the exception type and where it was raised
+    frames = traceback.extract_tb(e.__traceback__)
+    return (type(e), frames[-1].filename, frames[-1].lineno) if frames else (type(e),)
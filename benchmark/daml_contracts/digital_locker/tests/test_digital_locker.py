@@ -1,20 +1,13 @@
-import requests
 from hypothesis import given, settings, strategies as st
-from daml_pbt import make_request, make_auth, allocate_unique_party, ensure_ok
+from daml_pbt import make_request, allocate_unique_party, lookup_contract, package_id
 
-BASE = "http://localhost:7575/v1"
-PKG = "96e0e79add91322ee74dfc969c825c088622b5d000d89cd7d912a3bda7ca085a"
+PKG = package_id(__file__)
 LOCKER_TID = f"{PKG}:DigitalLocker:DigitalLocker"
 
 alpha = st.text(alphabet="abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 -_", min_size=1, max_size=24)
 
 def fetch_payload(cid: str, act_as: str) -> dict:
-    r = requests.post(
-        f"{BASE}/fetch",
-        json={"templateId": LOCKER_TID, "contractId": cid},
-        headers=make_auth(act_as),
-    )
-    res = ensure_ok(r, "/fetch")
+    res = lookup_contract(cid, LOCKER_TID, act_as=act_as)
     return res["payload"]
 
 def create_locker(owner: str, bank: str, third: list[str], friendly_name: str) -> str:
@@ -1,9 +1,9 @@
 # tests/test_simple_market.py
 from decimal import Decimal
 from hypothesis import given, settings, strategies as st
-from daml_pbt import make_request, allocate_unique_party
+from daml_pbt import make_request, allocate_unique_party, lookup_contract, CommandRejected, package_id
 
-PKG = "c988d208293f53653ca3aa965a21f15fa5bb318df0b41e87722b1d4d9cbf4249"
+PKG = package_id(__file__)
 MARKET_TID = f"{PKG}:SimpleMarket:Market"
 
 def create_market(owner: str, buyer: str, item: str, state: str = "ItemAvailable", offer: Decimal = Decimal("0.0")) -> str:
@@ -61,12 +61,11 @@ def reject_offer(cid: str, owner: str) -> str:
     return res["exerciseResult"]
 
 def get_payload(cid: str, reader: str) -> dict:
-    # Helper: read the current payload for cid using JSON API /query
-    res = make_request("query", read_as=[reader], template_ids=[MARKET_TID], query={})
-    for c in res:
-        if c["contractId"] == cid:
-            return c["payload"]
-    raise AssertionError("contract not visible")
+    # Read helper via /fetch (using readAs=reader) to retrieve payload for cid
+    c = lookup_contract(cid, MARKET_TID, reader=[reader])
+    if c is None:
+        raise AssertionError("contract not visible")
+    return c["payload"]
 
 @given(state=st.sampled_from(["ItemAvailable", "OfferPlaced", "Accept"]),
        price=st.decimals(min_value="0.01", max_value="10000.00", places=2),
@@ -86,7 +85,7 @@ def test_makeoffer_only_when_itemavailable(state, price, item):
         try:
             make_offer(cid, buyer, Decimal(price))
             assert False
-        except AssertionError:
+        except CommandRejected:
             pass
 
 @given(price=st.decimals(min_value="0.01", max_value="10000.00", places=2),
@@ -112,7 +111,7 @@ def test_only_owner_can_accept(item,price):
     try:
         accept_offer(cid2, buyer)
         assert False
-    except AssertionError:
+    except CommandRejected:
         pass
 
 @given(item=st.sampled_from(["Phone","Book"]),price = st.decimals(min_value="0.01", max_value="10000.00", places=2))
@@ -126,7 +125,7 @@ def test_only_owner_can_reject(item,price):
     try:
         reject_offer(cid2, buyer)
         assert False
-    except AssertionError:
+    except CommandRejected:
         pass
 
 @given(item=st.sampled_from(["Phone","Book"]),
@@ -147,7 +146,7 @@ def test_owner_accept_only_when_offerplaced(item, state):
         try:
             accept_offer(cid, owner)
             assert False
-        except AssertionError:
+        except CommandRejected:
             pass
 
 
@@ -172,5 +171,5 @@ def test_owner_reject_only_when_offerplaced(item, state):
         try:
             reject_offer(cid, owner)
             assert False
-        except AssertionError:
+        except CommandRejected:
             pass
@@ -1,10 +1,10 @@
 import base64, json, requests, uuid
 from decimal import Decimal
 from hypothesis import given, settings, strategies as st
-from daml_pbt import make_request, make_auth, make_admin_auth, ensure_ok, allocate_party, allocate_unique_party
+from daml_pbt import make_request, make_auth, make_admin_auth, ensure_ok, allocate_party, allocate_unique_party, CommandRejected, package_id
 
-# Package ID from the DAR
-PKG = "PASTE_YOUR_PKG_HERE"
+# Package ID, read from .daml/dist/*.dar
+PKG = package_id(__file__)
 
 # JSON API wants "<packageId>:<module>:<entity>"
 BANK_TID = f"{PKG}:ZeroTokenBank:Bank"
@@ -113,6 +113,6 @@ def test_cannot_withdraw_any_amount_without_deposit(amount):
             choice="Withdraw",
             argument={"amount": str(Decimal(amount))}, # Add or remove fields as per your contract
         )
-    except AssertionError:
-        return  # expected failure surfaced by ensure_ok
+    except CommandRejected:
+        return  # expected rejection surfaced by ensure_ok
     raise AssertionError("expected withdrawal to fail with zero balance")
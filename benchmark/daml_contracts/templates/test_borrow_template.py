@@ -1,10 +1,8 @@
 from decimal import Decimal
-import requests
 from hypothesis import given, settings, strategies as st
-from daml_pbt import make_request, make_auth, allocate_unique_party, ensure_ok
+from daml_pbt import make_request, allocate_unique_party, lookup_contract, package_id
 
-BASE = "http://localhost:7575/v1"
-PKG = "PASTE_YOUR_PKG_HERE"
+PKG = package_id(__file__)
 BAL_TID = f"{PKG}:BorrowAndLending:BorrowAndLending"
 
 tokens_fixed = ["USD", "BTC", "ETH"] # Add more tokens if desired
@@ -15,10 +13,7 @@ def tup(token: str, amount: Decimal):
     return {"_1": token, "_2": str(amount)}
 
 def fetch_payload(cid: str, act_as: str) -> dict:
-    r = requests.post(f"{BASE}/fetch",
-                      json={"templateId": BAL_TID, "contractId": cid},
-                      headers=make_auth(act_as))
-    res = ensure_ok(r, "/fetch")
+    res = lookup_contract(cid, BAL_TID, act_as=act_as)
     return res["payload"]
 
 def create_contract(owner: str, balances: list[tuple[str, Decimal]]) -> str:
@@ -1,10 +1,10 @@
 import base64, json, requests, uuid
 from decimal import Decimal
 from hypothesis import given, settings, strategies as st
-from daml_pbt import make_request, make_auth, make_admin_auth, ensure_ok, allocate_party, allocate_unique_party
+from daml_pbt import make_request, make_auth, make_admin_auth, ensure_ok, allocate_party, allocate_unique_party, isolation, command_batch, exercise_view, view, CommandRejected, package_id, precondition, expect_rejection
 
-# Package ID from the DAR
-PKG = "c6f004b1cd672ae532964d33767186c66d1b0673ce87a0e05b35e7b78c2fc514"
+# Package ID, read from .daml/dist/*.dar
+PKG = package_id(__file__)
 
 # JSON API wants "<packageId>:<module>:<entity>"
 BANK_TID = f"{PKG}:ZeroTokenBank:Bank"
@@ -37,6 +37,15 @@ def open_account(bank_cid: str, operator: str, user: str) -> str:
     )
     return res["exerciseResult"]
 
+def open_bank_with_account(operator: str, user: str) -> str:
+    # create Bank + OpenAccount in a single /create-and-exercise transaction
+    # - returns contractId of the new UserBalance (balance = 0.0)
+    res = (command_batch()
+           .create(operator, BANK_TID, {"operator": operator})
+           .exercise(operator, "OpenAccount", {"user": user})
+           .submit())
+    return res["exerciseResult"]
+
 def deposit(ub_cid: str, user: str, amount: Decimal) -> str:
     # Choice Deposit (by user):
     # - precondition: amount < 200.0
@@ -52,28 +61,43 @@ def deposit(ub_cid: str, user: str, amount: Decimal) -> str:
     )
     return res["exerciseResult"]
 
+# assertMsg bounds of Deposit/Withdraw; with pre-validation on (--daml-prevalidate)
+# a generated amount the ledger is bound to refuse is discarded without a round-trip
+@precondition(UB_TID, "Deposit", "Deposit must be less than 200")
+def _deposit_below_200(p: dict | None, arg: dict) -> bool:
+    return Decimal(str(arg["amount"])) < 200
+
+@precondition(UB_TID, "Withdraw", "Withdrawal must be > 0")
+def _withdraw_positive(p: dict | None, arg: dict) -> bool:
+    return Decimal(str(arg["amount"])) > 0
+
+@precondition(UB_TID, "Withdraw", "Cannot withdraw more than 100")
+def _withdraw_at_most_100(p: dict | None, arg: dict) -> bool:
+    return Decimal(str(arg["amount"])) <= 100
+
+@precondition(UB_TID, "Withdraw", "Insufficient balance")
+def _withdraw_covered(p: dict | None, arg: dict) -> bool:
+    return p is None or Decimal(str(arg["amount"])) <= Decimal(str(p["balance"]))
+
+@view(UB_TID, "GetBalance")
+def _view_balance(p: dict, arg: dict):
+    return p["balance"]
+
 def get_balance(ub_cid: str, user: str) -> Decimal:
     # Nonconsuming GetBalance (by user):
     # - returns Decimal current balance
-    res = make_request(
-        "exercise",
-        act_as=user,
-        template_id=UB_TID,
-        contract_id=ub_cid,
-        choice="GetBalance",
-        argument={},
-    )
-    return Decimal(str(res["exerciseResult"]))
+    # - answered from the UserBalance payload, no transaction (see exercise_view)
+    return Decimal(str(exercise_view(user, UB_TID, ub_cid, "GetBalance")))
 
 # ---------- Property tests ----------
 
 @given(d=st.decimals(min_value="0.01", max_value="199.99", places=2))
 @settings(max_examples=5, deadline=None)
+@isolation("test")  # fresh Bank/UserBalance per example, read by contract id
 def test_deposit_increases_balance(d:Decimal):
     # Setup: operator opens an account for herself
     operator = allocate_unique_party("Operator")      # unique party per example
-    bank = create_bank(operator)                      # create Bank
-    ub   = open_account(bank, operator, operator)     # create UserBalance with balance=0
+    ub   = open_bank_with_account(operator, operator) # Bank + UserBalance with balance=0
 
     # Before deposit: balance = b0
     b0   = get_balance(ub, operator)
@@ -87,12 +111,13 @@ def test_deposit_increases_balance(d:Decimal):
 
 @given(amount=st.decimals(min_value="0.00", max_value="250.00", places=2))
 @settings(max_examples=25, deadline=None)
+@isolation("test")
+@expect_rejection()  # the ledger itself must refuse every one of these withdrawals
 def test_cannot_withdraw_any_amount_without_deposit(amount):
     # Setup: operator opens an account for Alice; starting balance = 0
     operator = allocate_unique_party("Operator")
     alice    = allocate_unique_party("Alice")
-    bank     = create_bank(operator)
-    ub       = open_account(bank, operator, alice)
+    ub       = open_bank_with_account(operator, alice)
 
     # Invariant: with zero balance, any Withdraw must fail
     assert get_balance(ub, alice) == Decimal("0")
@@ -109,6 +134,6 @@ def test_cannot_withdraw_any_amount_without_deposit(amount):
             choice="Withdraw",
             argument={"amount": str(Decimal(amount))},
         )
-    except AssertionError:
-        return  # expected failure surfaced by ensure_ok
+    except CommandRejected:
+        return  # expected rejection surfaced by ensure_ok
     raise AssertionError("expected withdrawal to fail with zero balance")